@@ -0,0 +1,142 @@
+"""
+Kiểm soát nhận request cho server.py: giới hạn số request /chat đang xử lý (toàn cục và theo client),
+hàng đợi FIFO có giới hạn và từ chối sớm khi thời gian chờ ước lượng vượt hạn chót của request.
+Thà trả 429/503 + Retry-After ngay còn hơn để mọi người cùng timeout: p99 của request đã nhận được giữ ổn định.
+"""
+import time
+import asyncio
+from collections import deque
+from typing import Dict, Optional
+
+
+class AdmissionRejected(Exception):
+    """Request bị từ chối trước khi xử lý; server.py chuyển thành HTTP `status_code` + Retry-After."""
+
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """Một request đã được nhận; `release()` gọi nhiều lần vẫn an toàn (stream có thể đóng theo hai đường)."""
+
+    def __init__(self, controller: "AdmissionController", client: str):
+        self.controller = controller
+        self.client = client
+        self.started = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self.controller._release(self.client, time.monotonic() - self.started)
+
+
+class AdmissionController:
+    """
+    `max_concurrent` request xử lý đồng thời, tối đa `max_queue` request chờ (0 = không giới hạn),
+    mỗi client tối đa `per_client` request đang xử lý + đang chờ. Thời gian chờ ước lượng từ EWMA thời gian xử lý;
+    vượt `queue_timeout_s` (hoặc hạn chót client gửi lên, nếu ngắn hơn) thì từ chối ngay.
+    Chỉ dùng trong event loop của server (một thread).
+    """
+
+    def __init__(self, max_concurrent: int, per_client: int = 0, max_queue: int = 0, queue_timeout_s: float = 10.0):
+        self.max_concurrent = max_concurrent
+        self.per_client = per_client
+        self.max_queue = max_queue
+        self.queue_timeout_s = queue_timeout_s
+        self.active = 0
+        self._queue: deque = deque()
+        self._clients: Dict[str, int] = {}
+        self._service_s = 1.0  # EWMA thời gian xử lý một request
+        self._wait_s = 0.0  # EWMA thời gian chờ của request được nhận
+        self.counters = {
+            "admitted": 0, "queued": 0, "rejected_client": 0, "rejected_queue_full": 0,
+            "rejected_deadline": 0, "timed_out": 0,
+        }
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, fut in self._queue if not fut.done())
+
+    def estimated_wait(self, position: int) -> float:
+        """Thời gian chờ ước lượng của request đứng thứ `position` (từ 1) trong hàng đợi."""
+        if self.max_concurrent <= 0:
+            return 0.0
+        return -(-position // self.max_concurrent) * self._service_s
+
+    def _reject(self, counter: str, status_code: int, reason: str, retry_after: float):
+        self.counters[counter] += 1
+        return AdmissionRejected(status_code, reason, max(1.0, retry_after))
+
+    async def acquire(self, client: str, timeout: Optional[float] = None) -> Ticket:
+        timeout = self.queue_timeout_s if timeout is None else min(timeout, self.queue_timeout_s)
+        if self.per_client > 0 and self._clients.get(client, 0) >= self.per_client:
+            raise self._reject("rejected_client", 429, "Quá nhiều request đồng thời từ client này", self._service_s)
+        if self.max_concurrent <= 0 or (self.active < self.max_concurrent and not self.waiting):
+            return self._admit(client, 0.0)
+
+        position = self.waiting + 1
+        if self.max_queue > 0 and position > self.max_queue:
+            raise self._reject("rejected_queue_full", 503, "Hàng đợi đầy", self.estimated_wait(position))
+        expected = self.estimated_wait(position)
+        if expected > timeout:
+            raise self._reject("rejected_deadline", 503, "Thời gian chờ ước lượng vượt hạn chót", expected)
+
+        self.counters["queued"] += 1
+        self._clients[client] = self._clients.get(client, 0) + 1  # giữ chỗ của client trong lúc chờ
+        fut = asyncio.get_running_loop().create_future()
+        entry = (client, fut)
+        self._queue.append(entry)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            self._clients[client] -= 1
+            self._drop_client(client)
+            if fut.done() and not fut.cancelled():
+                # Slot đã được trao đúng lúc hết hạn / bị hủy: trả lại cho người kế tiếp
+                self._release(client, None)
+            else:
+                fut.cancel()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise self._reject("timed_out", 503, "Hết thời gian chờ trong hàng đợi", self.estimated_wait(self.waiting or 1))
+        self._clients[client] -= 1
+        return self._admit(client, time.monotonic() - start, slot_taken=True)
+
+    def _admit(self, client: str, waited: float, slot_taken: bool = False) -> Ticket:
+        if not slot_taken:
+            self.active += 1
+        self._clients[client] = self._clients.get(client, 0) + 1
+        self.counters["admitted"] += 1
+        self._wait_s = 0.9 * self._wait_s + 0.1 * waited
+        return Ticket(self, client)
+
+    def _drop_client(self, client: str) -> None:
+        if self._clients.get(client) == 0:
+            del self._clients[client]
+
+    def _release(self, client: str, service_s: Optional[float]) -> None:
+        if service_s is not None:
+            self._clients[client] -= 1
+            self._drop_client(client)
+            self._service_s = 0.9 * self._service_s + 0.1 * service_s
+        while self._queue:
+            _, fut = self._queue.popleft()
+            if not fut.done():
+                fut.set_result(None)  # slot chuyển thẳng cho request chờ, active không đổi
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "active": self.active,
+            "waiting": self.waiting,
+            "clients": len(self._clients),
+            "avg_service_ms": round(self._service_s * 1000, 1),
+            "avg_wait_ms": round(self._wait_s * 1000, 1),
+        }
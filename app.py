@@ -1,13 +1,14 @@
 import os, time
 import gradio as gr
 from dotenv import load_dotenv
-from langchain_core.messages import HumanMessage, AIMessage
-from rag_core import build_rag_chain
+from llm_scheduler import LLMOverloadedError
+from rag_core import (
+    LLM_PROVIDER, STARTUP, iter_answer_events, retrieval_config, start_background_warmup, get_rag_chain, degraded_answer,
+    ALL_CLUBS, TARGET_CLUB_ID, club_ids,
+)
 
 load_dotenv()
 
-rag_chain = None
-
 # ---------- THEME & CSS ----------
 THEME = gr.themes.Soft(
     primary_hue="blue",
@@ -358,12 +359,18 @@ html.dark .source-chip {
 """
 
 # ---------- HELPERS ----------
-def startup():
-    global rag_chain
-    if rag_chain is None:
-        rag_chain = build_rag_chain()
+def warming_message():
+    state = STARTUP.snapshot()
+    if state["status"] == "failed":
+        return f"❌ **Lỗi khởi động:** {state['error']}"
+    return (
+        f"⏳ **Hệ thống đang khởi động** ({int(state['progress'] * 100)}%, bước: `{state['stage'] or '...'}`). "
+        "Vui lòng thử lại sau ít giây!"
+    )
 
 def lc_history_from_messages(history_msgs):
+    from langchain_core.messages import AIMessage, HumanMessage
+
     lc_hist = []
     for m in history_msgs or []:
         role = m.get("role")
@@ -438,59 +445,114 @@ def format_sources(ctx_docs):
     return f"{chips_html}\n\n{summary}\n\n---\n\n{sources_content}"
 
 # ---------- CALLBACKS ----------
-def respond(user_msg, history_msgs, top_k, dark_on):
-    startup()
+def build_meta_info(latency, top_k, n_docs, timing=None):
+    timing_lines = ""
+    if timing:
+        if timing.get("retrieval_s") is not None:
+            timing_lines += f"🔎 **Truy hồi xong sau:** {timing['retrieval_s']:.2f}s  \n"
+        if timing.get("first_token_s") is not None:
+            timing_lines += f"⏱️ **Token đầu tiên sau:** {timing['first_token_s']:.2f}s  \n"
+        if timing.get("context_tokens") is not None:
+            saved = ""
+            raw = timing.get("context_tokens_raw")
+            if raw and raw > timing["context_tokens"]:
+                saved = f" (gốc {raw}, giảm {100 * (raw - timing['context_tokens']) / raw:.0f}%)"
+            timing_lines += f"🧮 **Token context trong prompt:** {timing['context_tokens']}{saved}  \n"
+        if timing.get("cache_hit"):
+            timing_lines += "♻️ **Trả lời từ cache**  \n"
+        if timing.get("fast_path"):
+            timing_lines += "📈 **Trả lời trực tiếp từ bảng thống kê**  \n"
+
+    # Meta information with emoji and better formatting
+    return f"""
+### ⚡ **Thông tin phản hồi**
+
+📊 **Thời gian xử lý:** {latency}  
+{timing_lines}🔍 **Số nguồn tìm kiếm:** {int(top_k)}  
+📚 **Số nguồn tìm thấy:** {n_docs}  
+🎯 **Độ chính xác:** {"Cao" if n_docs >= 3 else "Trung bình" if n_docs >= 1 else "Thấp"}
+
+---
+
+### 💡 **Mẹo sử dụng**
+- Hỏi cụ thể hơn để có kết quả chính xác
+- Tăng Top-K nếu cần nhiều thông tin hơn
+- Sử dụng từ khóa liên quan đến Pickleball, DUPR
+"""
+
+def respond(user_msg, history_msgs, top_k, club_id, dark_on):
+    """Generator: Gradio hiển thị câu trả lời dần dần theo từng token."""
+    start_background_warmup()
 
     # Toggle dark class (client-side JS call below handles it; this is a no-op server-side)
     _ = dark_on
 
+    rag_chain = get_rag_chain()
+    if rag_chain is None:
+        # Chain chưa sẵn sàng: trả lời suy giảm (thống kê / từ khóa) hoặc thông báo đang khởi động
+        start = time.time()
+        resp = degraded_answer(user_msg, club_id=club_id or None, has_history=bool(history_msgs)) \
+            or {"answer": warming_message(), "context": []}
+        history_msgs = (history_msgs or []) + [
+            {"role": "user", "content": user_msg},
+            {"role": "assistant", "content": resp["answer"]},
+        ]
+        yield history_msgs, format_sources(resp["context"]), build_meta_info(
+            f"{(time.time() - start):.2f}s", top_k, len(resp["context"]), {"fast_path": resp.get("fast_path")}
+        )
+        return
+
     lc_hist = lc_history_from_messages(history_msgs)
     
     # Tinh chỉnh k (retriever top_k) runtime
     start = time.time()
-    
+    answer, ctx_docs, timing = "", [], None
+    history_msgs = (history_msgs or []) + [
+        {"role": "user", "content": user_msg},
+        {"role": "assistant", "content": "💭 ..."},
+    ]
+    sources_md = "⏳ **Đang tìm kiếm nguồn tham khảo...**"
+
     try:
-        resp = rag_chain.invoke(
+        events = iter_answer_events(
+            rag_chain,
             {"input": user_msg, "chat_history": lc_hist},
-            config={"configurable": {"retriever_kwargs": {"k": int(top_k)}}}
+            config=retrieval_config(top_k, club_id or None),
         )
-        answer = resp["answer"]
-        ctx_docs = resp.get("context", [])
-        
-        # Thêm emoji và format đẹp hơn cho câu trả lời
-        if answer and not answer.startswith(("🏓", "📚", "💡", "⚡")):
-            answer = f"🏓 {answer}"
+        for kind, payload in events:
+            if kind == "sources":
+                ctx_docs = payload
+                sources_md = format_sources(ctx_docs)
+            elif kind == "token":
+                # Thêm emoji và format đẹp hơn cho câu trả lời
+                if not answer and not payload.startswith(("🏓", "📚", "💡", "⚡")):
+                    answer = "🏓 "
+                answer += payload
+            else:
+                timing = payload
+                break
+            history_msgs[-1]["content"] = answer or "💭 ..."
+            yield history_msgs, sources_md, build_meta_info(f"{(time.time() - start):.2f}s", top_k, len(ctx_docs))
             
+    except LLMOverloadedError as e:
+        answer = f"⏳ **Hệ thống đang quá tải**, vui lòng thử lại sau khoảng {max(1, round(e.retry_after))} giây."
+        ctx_docs = []
     except Exception as e:
         answer = f"❌ **Lỗi:** Không thể xử lý câu hỏi của bạn. Chi tiết: {str(e)}"
         ctx_docs = []
 
-    history_msgs = (history_msgs or []) + [
-        {"role": "user", "content": user_msg},
-        {"role": "assistant", "content": answer},
-    ]
-
+    history_msgs[-1]["content"] = answer
     sources_md = format_sources(ctx_docs)
     latency = f"{(time.time() - start):.2f}s"
-    
-    # Meta information with emoji and better formatting
-    meta_info = f"""
-### ⚡ **Thông tin phản hồi**
-
-📊 **Thời gian xử lý:** {latency}  
-🔍 **Số nguồn tìm kiếm:** {int(top_k)}  
-📚 **Số nguồn tìm thấy:** {len(ctx_docs)}  
-🎯 **Độ chính xác:** {"Cao" if len(ctx_docs) >= 3 else "Trung bình" if len(ctx_docs) >= 1 else "Thấp"}
-
----
+    yield history_msgs, sources_md, build_meta_info(latency, top_k, len(ctx_docs), timing)
 
-### 💡 **Mẹo sử dụng**
-- Hỏi cụ thể hơn để có kết quả chính xác
-- Tăng Top-K nếu cần nhiều thông tin hơn
-- Sử dụng từ khóa liên quan đến Pickleball, DUPR
-"""
+def club_options(clubs):
+    """Lựa chọn CLB cho dropdown: "" = CLB mặc định (TARGET_CLUB_ID, nếu có), ALL_CLUBS = tất cả CLB."""
+    default = [(f"⭐ CLB mặc định ({TARGET_CLUB_ID})", "")] if TARGET_CLUB_ID else []
+    return default + [("🌐 Tất cả CLB", ALL_CLUBS)] + [(f"🏟️ CLB {c}", c) for c in clubs]
 
-    return history_msgs, sources_md, meta_info
+def club_choices():
+    return gr.update(choices=club_options(club_ids()))
 
 def clear_chat():
     return [], "📭 **Không có nguồn tham khảo nào.**", "🔄 **Đã xóa lịch sử chat.** Sẵn sàng cho cuộc trò chuyện mới!"
@@ -564,6 +626,7 @@ with gr.Blocks(theme=THEME, css=CSS) as demo:
         # Sources & meta panel
         with gr.Column(scale=5):
             with gr.Group(elem_classes="side-panel"):
+                club = gr.Dropdown(choices=club_options([]), value=club_options([])[0][1], label="Câu lạc bộ", interactive=True)
                 with gr.Tab("📚 Nguồn tham khảo"):
                     sources = gr.Markdown("Chưa có nguồn tham khảo nào.", elem_classes="card")
                 with gr.Tab("⚡ Thông tin"):
@@ -579,8 +642,9 @@ with gr.Blocks(theme=THEME, css=CSS) as demo:
     ''')
 
     # Bindings
-    send.click(respond, [msg, chatbot, top_k, dark_toggle], [chatbot, sources, meta]).then(lambda: "", None, msg)
-    msg.submit(respond, [msg, chatbot, top_k, dark_toggle], [chatbot, sources, meta]).then(lambda: "", None, msg)
+    send.click(respond, [msg, chatbot, top_k, club, dark_toggle], [chatbot, sources, meta]).then(lambda: "", None, msg)
+    msg.submit(respond, [msg, chatbot, top_k, club, dark_toggle], [chatbot, sources, meta]).then(lambda: "", None, msg)
+    demo.load(club_choices, None, club)
     clear.click(clear_chat, None, [chatbot, sources, meta])
 
     # Dark toggle JS
@@ -588,5 +652,7 @@ with gr.Blocks(theme=THEME, css=CSS) as demo:
     dark_toggle.change(_noop, dark_toggle, None, js="toggleDark")
 
 if __name__ == "__main__":
-    assert os.getenv("GROQ_API_KEY"), "Thiếu GROQ_API_KEY env"
+    assert LLM_PROVIDER != "groq" or os.getenv("GROQ_API_KEY"), "Thiếu GROQ_API_KEY env"
+    # Tải model/chỉ mục trong nền ngay khi khởi động thay vì đợi người dùng đầu tiên
+    start_background_warmup()
     demo.launch(server_name="0.0.0.0", server_port=7861, share=False)
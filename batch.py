@@ -0,0 +1,110 @@
+"""
+Trả lời hàng loạt câu hỏi (báo cáo đêm, chạy eval) mà không cần gửi từng POST /chat:
+    python batch.py questions.txt --output answers.jsonl              # trong process
+    python batch.py questions.jsonl --url http://127.0.0.1:8000       # qua /chat/batch của server
+Đầu vào: .txt (mỗi dòng một câu) hoặc .jsonl (`question`/`message`/`input`). Đầu ra: NDJSON,
+mỗi dòng một câu hỏi theo thứ tự đầu vào (thêm --unordered để ghi ngay khi có kết quả).
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+from typing import List
+
+
+def read_questions(path: str) -> List[str]:
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                row = json.loads(line)
+                line = row.get("question") or row.get("message") or row.get("input") or ""
+            if line:
+                questions.append(line)
+    return questions
+
+
+async def _in_process(questions: List[str], top_k, concurrency: int, club_id=None):
+    import rag_core
+
+    rag_core.start_background_warmup()
+    while not rag_core.STARTUP.ready:
+        if rag_core.STARTUP.snapshot()["status"] == "failed":
+            raise RuntimeError(f"Khởi động thất bại: {rag_core.STARTUP.snapshot()['error']}")
+        await asyncio.sleep(0.2)
+    async for item in rag_core.abatch_answer(questions, top_k=top_k, concurrency=concurrency, club_id=club_id):
+        yield item
+
+
+async def _remote(questions: List[str], top_k, url: str, timeout: float, chunk_size: int, club_id=None):
+    import httpx
+
+    async with httpx.AsyncClient(base_url=url, timeout=httpx.Timeout(timeout)) as client:
+        # Chia theo BATCH_MAX_QUESTIONS của server, chỉ số được dịch về vị trí trong toàn bộ danh sách
+        for offset in range(0, len(questions), chunk_size):
+            body = {"questions": questions[offset:offset + chunk_size], "top_k": top_k, "club_id": club_id}
+            async with client.stream("POST", "/chat/batch", json=body) as resp:
+                resp.raise_for_status()
+                async for line in resp.aiter_lines():
+                    if line.strip():
+                        item = json.loads(line)
+                        item["indices"] = [offset + i for i in item["indices"]]
+                        yield item
+
+
+async def main_async(args) -> int:
+    questions = read_questions(args.input)
+    if not questions:
+        print("❌ Không có câu hỏi nào trong file đầu vào.")
+        return 1
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    start = time.perf_counter()
+    results = [None] * len(questions)
+    done = errors = 0
+    items = (_remote(questions, args.top_k, args.url, args.timeout, args.chunk_size, args.club_id) if args.url
+             else _in_process(questions, args.top_k, args.concurrency, args.club_id))
+    try:
+        async for item in items:
+            done += len(item["indices"])
+            errors += len(item["indices"]) if item.get("error") else 0
+            for i in item["indices"]:
+                row = {"index": i, **{k: v for k, v in item.items() if k != "indices"}, "question": questions[i]}
+                if args.unordered:
+                    out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                else:
+                    results[i] = row
+            print(f"⏳ {done}/{len(questions)} câu hỏi ({time.perf_counter() - start:.1f}s)", file=sys.stderr)
+        if not args.unordered:
+            for row in results:
+                if row is not None:
+                    out.write(json.dumps(row, ensure_ascii=False) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"✅ Xong {done} câu hỏi ({errors} lỗi) trong {time.perf_counter() - start:.1f}s.", file=sys.stderr)
+    return 0 if not errors and done == len(questions) else 1
+
+
+def main(argv=None) -> int:
+    import rag_core
+
+    parser = argparse.ArgumentParser(description="Trả lời hàng loạt câu hỏi, xuất NDJSON.")
+    parser.add_argument("input", help=".txt hoặc .jsonl")
+    parser.add_argument("--output", default=None, help="File NDJSON (mặc định: stdout)")
+    parser.add_argument("--top-k", type=int, default=None)
+    parser.add_argument("--club-id", default=None, help="CLB được hỏi (mặc định TARGET_CLUB_ID hoặc tất cả)")
+    parser.add_argument("--concurrency", type=int, default=rag_core.BATCH_LLM_CONCURRENCY, help="Số lời gọi LLM đồng thời")
+    parser.add_argument("--url", default=None, help="Gọi /chat/batch của server thay vì chạy trong process")
+    parser.add_argument("--timeout", type=float, default=3600.0)
+    parser.add_argument("--chunk-size", type=int, default=rag_core.BATCH_MAX_QUESTIONS, help="Số câu mỗi request khi dùng --url")
+    parser.add_argument("--unordered", action="store_true")
+    args = parser.parse_args(argv)
+    return asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
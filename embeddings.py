@@ -0,0 +1,205 @@
+import os
+import time
+import queue
+import sqlite3
+import hashlib
+import asyncio
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Optional
+from langchain_core.embeddings import Embeddings
+
+
+def _normalize_query(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text or "").split())
+
+
+class _DiskStore:
+    """Lưu embedding câu hỏi trong SQLite (float32), khóa theo (model, câu hỏi đã chuẩn hóa)."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS query_embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            row = self._conn.execute("SELECT vector FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+        return array("f", row[0]).tolist() if row else None
+
+    def put_many(self, items) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO query_embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in items],
+            )
+            self._conn.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Bọc một Embeddings (vd. HuggingFaceEmbeddings) cho câu hỏi:
+    - LRU trong bộ nhớ + SQLite tùy chọn, khóa theo (model, câu hỏi đã chuẩn hóa);
+    - các embed_query đồng thời (nhiều request cùng lúc) được gom trong `batch_window_ms`
+      thành một lần gọi encode duy nhất (tối đa `max_batch` câu).
+    embed_documents (lúc ingest) đi thẳng xuống model gốc, không qua cache.
+    """
+
+    def __init__(
+        self,
+        base: Embeddings,
+        model_name: str,
+        cache_size: int = 4096,
+        cache_path: str = "",
+        batch_window_ms: float = 5.0,
+        max_batch: int = 32,
+        workers: int = 1,
+    ):
+        self.base = base
+        self.model_name = model_name
+        self.cache_size = cache_size
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch = max_batch
+        self._lru: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = _DiskStore(cache_path) if cache_path else None
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "batches": 0, "batched_queries": 0}
+        for i in range(max(1, workers)):
+            threading.Thread(target=self._batch_worker, name=f"embed-batcher-{i}", daemon=True).start()
+
+    # --- cache ---
+    def _key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model_name}\0{_normalize_query(text)}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        with self._lock:
+            self._lru[key] = vector
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.cache_size:
+                self._lru.popitem(last=False)
+
+    def _in_memory(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+                self.counters["memory_hits"] += 1
+            return vector
+
+    def _cached(self, key: str) -> Optional[List[float]]:
+        vector = self._in_memory(key)
+        if vector is not None:
+            return vector
+        if self._disk:
+            vector = self._disk.get(key)
+            if vector is not None:
+                self._remember(key, vector)
+                with self._lock:
+                    self.counters["disk_hits"] += 1
+                return vector
+        return None
+
+    # --- micro-batching ---
+    def _batch_worker(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._encode_batch(batch)
+
+    def _encode_batch(self, batch) -> None:
+        # SQLite được tra ở đây (thread worker), không phải trên event loop của request.
+        # Câu hỏi trùng nhau trong cùng batch chỉ tra / encode một lần.
+        texts = OrderedDict((key, text) for key, text, _ in batch)
+        by_key, error = {}, None
+        if self._disk:
+            for key in texts:
+                vector = self._disk.get(key)
+                if vector is not None:
+                    self._remember(key, vector)
+                    by_key[key] = vector
+            with self._lock:
+                self.counters["disk_hits"] += len(by_key)
+        missing = [(key, text) for key, text in texts.items() if key not in by_key]
+        queued = sum(1 for key, _, _ in batch if key not in by_key)
+        if missing:
+            try:
+                vectors = self.base.embed_documents([text for _, text in missing])
+            except Exception as e:
+                error = e
+            else:
+                fresh = dict(zip((key for key, _ in missing), vectors))
+                for key, vector in fresh.items():
+                    self._remember(key, vector)
+                if self._disk:
+                    self._disk.put_many(fresh.items())
+                by_key.update(fresh)
+            with self._lock:
+                self.counters["misses"] += queued
+                self.counters["batches"] += 1
+                self.counters["batched_queries"] += queued
+        for key, _, future in batch:
+            if key in by_key:
+                future.set_result(by_key[key])
+            else:
+                future.set_exception(error)
+
+    def _submit(self, text: str) -> Future:
+        # Chỉ LRU trong bộ nhớ được tra trên thread gọi (có thể là event loop); SQLite để thread worker tra
+        key = self._key(text)
+        future: Future = Future()
+        vector = self._in_memory(key)
+        if vector is not None:
+            future.set_result(vector)
+            return future
+        self._queue.put((key, text, future))
+        return future
+
+    # --- Embeddings interface ---
+    def embed_query(self, text: str) -> List[float]:
+        return self._submit(text).result()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self._submit(text))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents(texts)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Nhiều câu hỏi một lúc (batch job): qua cache, các câu còn thiếu được encode trong một lần gọi."""
+        keys = [self._key(text) for text in texts]
+        found = {key: self._cached(key) for key in keys}
+        missing = OrderedDict((key, text) for key, text in zip(keys, texts) if found[key] is None)
+        if missing:
+            vectors = self.base.embed_documents(list(missing.values()))
+            for key, vector in zip(missing, vectors):
+                self._remember(key, vector)
+                found[key] = vector
+            if self._disk:
+                self._disk.put_many((key, found[key]) for key in missing)
+            with self._lock:
+                self.counters["misses"] += len(missing)
+                self.counters["batches"] += 1
+                self.counters["batched_queries"] += len(missing)
+        return [found[key] for key in keys]
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed_queries, texts)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, "memory_size": len(self._lru)}
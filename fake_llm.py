@@ -0,0 +1,88 @@
+import time
+import asyncio
+from typing import Any, AsyncIterator, Iterator, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from fake_text import approx_tokens, filler_tokens
+from rag_core import get_llm_scheduler
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Model chat giả lập Groq cho load test / CI không có mạng (LLM_PROVIDER=fake):
+    chờ `latency_ms` trước token đầu tiên rồi sinh `reply_tokens` token với tốc độ `tokens_per_s`.
+    `streaming=False` giả lập model trả nguyên câu một lần ở cuối. `echo=True` (bước viết lại câu hỏi)
+    trả lại nguyên câu hỏi cuối cùng của người dùng.
+    """
+
+    model_name: str = "fake"
+    latency_ms: float = 300.0
+    tokens_per_s: float = 200.0
+    reply_tokens: int = 80
+    max_tokens: Optional[int] = None
+    streaming: bool = True
+    echo: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-groq"
+
+    def _reply(self, messages: List[BaseMessage]) -> List[str]:
+        if not self.echo:
+            return filler_tokens(min(self.reply_tokens, self.max_tokens or self.reply_tokens))
+        words = str(messages[-1].content).split() if messages else []
+        return [w if i == 0 else f" {w}" for i, w in enumerate(words)]
+
+    def _usage(self, messages: List[BaseMessage], tokens: List[str]) -> dict:
+        prompt = sum(approx_tokens(str(m.content)) for m in messages)
+        return {"input_tokens": prompt, "output_tokens": len(tokens), "total_tokens": prompt + len(tokens)}
+
+    def _result(self, messages: List[BaseMessage], tokens: List[str]) -> ChatResult:
+        message = AIMessage(content="".join(tokens), usage_metadata=self._usage(messages, tokens))
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output={"model_name": self.model_name})
+
+    def _chunks(self, messages: List[BaseMessage], tokens: List[str]) -> Iterator[ChatGenerationChunk]:
+        if not self.streaming:
+            tokens = ["".join(tokens)]
+        for i, token in enumerate(tokens):
+            usage = self._usage(messages, tokens) if i == len(tokens) - 1 else None
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token, usage_metadata=usage))
+
+    # --- sync ---
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        tokens = self._reply(messages)
+        time.sleep(self.latency_ms / 1000.0 + len(tokens) / self.tokens_per_s)
+        return self._result(messages, tokens)
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        tokens = self._reply(messages)
+        time.sleep(self.latency_ms / 1000.0)
+        if not self.streaming:
+            time.sleep(len(tokens) / self.tokens_per_s)
+        for chunk in self._chunks(messages, tokens):
+            if self.streaming:
+                time.sleep(1.0 / self.tokens_per_s)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    # --- async (chiếm slot của scheduler LLM như ScheduledChatGroq) ---
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        async with get_llm_scheduler().slot():
+            tokens = self._reply(messages)
+            await asyncio.sleep(self.latency_ms / 1000.0 + len(tokens) / self.tokens_per_s)
+            return self._result(messages, tokens)
+
+    async def _astream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        async with get_llm_scheduler().slot():
+            tokens = self._reply(messages)
+            await asyncio.sleep(self.latency_ms / 1000.0)
+            if not self.streaming:
+                await asyncio.sleep(len(tokens) / self.tokens_per_s)
+            for chunk in self._chunks(messages, tokens):
+                if self.streaming:
+                    await asyncio.sleep(1.0 / self.tokens_per_s)
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
@@ -0,0 +1,20 @@
+"""
+Văn bản giả dùng chung cho fake_llm.py (model giả trong process) và groq_standin.py (server giả lập Groq).
+Không phụ thuộc gì ngoài thư viện chuẩn để server giả lập khởi động nhẹ, không kéo theo rag_core.
+"""
+from typing import List
+
+FILLER = (
+    "Theo dữ liệu DUPR của câu lạc bộ , người chơi này có thành tích ổn định trong các trận đôi "
+    "và đơn , với tỉ lệ thắng được tính trên tổng số trận đã ghi nhận ."
+).split()
+
+
+def filler_tokens(n: int) -> List[str]:
+    """`n` token giả (từ đầu không có khoảng trắng đứng trước), ghép lại thành một câu trả lời."""
+    words = [FILLER[i % len(FILLER)] for i in range(n)]
+    return [w if i == 0 else f" {w}" for i, w in enumerate(words)]
+
+
+def approx_tokens(text: str) -> int:
+    return int(len(text.split()) * 1.3) + 1
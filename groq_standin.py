@@ -0,0 +1,136 @@
+"""
+Server giả lập API Groq (OpenAI-compatible /openai/v1/chat/completions) để thử scheduler LLM (rag_core.get_llm_scheduler) offline:
+hạn mức request/token mỗi phút theo model (429 + Retry-After như Groq), độ trễ, tốc độ sinh token,
+tỉ lệ lỗi 5xx ngẫu nhiên, model chậm (để thử hedging). Hỗ trợ cả `stream: true` (SSE).
+
+    python groq_standin.py --port 9000 --rpm 30 --tpm 6000 --error-rate 0.05
+    GROQ_API_KEY=x GROQ_API_BASE=http://127.0.0.1:9000 LLM_RPM=30 LLM_TPM=6000 python server.py
+"""
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from typing import Dict, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from fake_text import approx_tokens, filler_tokens
+from llm_scheduler import TokenBucket
+
+
+class StandinLimits:
+    """Hạn mức từng model như phía Groq: từ chối (429) thay vì xếp hàng."""
+
+    def __init__(self, rpm: float, tpm: float):
+        self.rpm, self.tpm = rpm, tpm
+        self.buckets: Dict[str, tuple] = {}
+        self.counters = {"requests": 0, "rate_limited": 0, "errors": 0}
+
+    def admit(self, model: str, tokens: int) -> Optional[float]:
+        """None nếu nhận request, ngược lại số giây Retry-After."""
+        if model not in self.buckets:
+            self.buckets[model] = (
+                TokenBucket(self.rpm) if self.rpm > 0 else None,
+                TokenBucket(self.tpm) if self.tpm > 0 else None,
+            )
+        checks = [(b, n) for b, n in zip(self.buckets[model], (1, tokens)) if b is not None]
+        short = [(n - b.available()) / b.rate for b, n in checks if b.available() < n]
+        if short:
+            self.counters["rate_limited"] += 1
+            return max(short)
+        for bucket, amount in checks:
+            bucket.adjust(amount)
+        return None
+
+
+def create_app(
+    rpm: float = 0, tpm: float = 0, latency_ms: float = 300.0, tokens_per_s: float = 200.0,
+    reply_tokens: int = 80, error_rate: float = 0.0, slow_model: str = "", slow_factor: float = 5.0,
+) -> FastAPI:
+    app = FastAPI(title="Groq stand-in")
+    limits = StandinLimits(rpm, tpm)
+
+    @app.get("/stats")
+    def stats():
+        return limits.counters
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "stand-in")
+        prompt_tokens = sum(approx_tokens(str(m.get("content", ""))) for m in body.get("messages", []))
+        n = min(reply_tokens, body.get("max_tokens") or reply_tokens)
+        limits.counters["requests"] += 1
+        retry_after = limits.admit(model, prompt_tokens + n)
+        if retry_after is not None:
+            return JSONResponse(
+                {"error": {"message": f"Rate limit reached for model `{model}`", "type": "tokens", "code": "rate_limit_exceeded"}},
+                status_code=429,
+                headers={"retry-after": f"{retry_after:.2f}"},
+            )
+        if random.random() < error_rate:
+            limits.counters["errors"] += 1
+            return JSONResponse({"error": {"message": "Service Unavailable", "type": "internal_server_error"}}, status_code=503)
+
+        factor = slow_factor if model == slow_model else 1.0
+        tokens = filler_tokens(n)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": n, "total_tokens": prompt_tokens + n}
+        rid, created = f"chatcmpl-{uuid.uuid4().hex}", int(time.time())
+        await asyncio.sleep(latency_ms * factor / 1000.0)
+
+        if not body.get("stream"):
+            await asyncio.sleep(n * factor / tokens_per_s)
+            return {
+                "id": rid, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        async def events():
+            for i, token in enumerate(tokens):
+                await asyncio.sleep(factor / tokens_per_s)
+                last = i == len(tokens) - 1
+                chunk = {
+                    "id": rid, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"role": "assistant", "content": token} if i == 0 else {"content": token},
+                                 "finish_reason": "stop" if last else None}],
+                }
+                if last:
+                    chunk["x_groq"] = {"id": rid, "usage": usage}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main(argv=None) -> int:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Server giả lập Groq (429/5xx/độ trễ) cho thử nghiệm scheduler LLM.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--rpm", type=float, default=30, help="Request/phút mỗi model, 0 = không giới hạn")
+    parser.add_argument("--tpm", type=float, default=6000, help="Token/phút mỗi model, 0 = không giới hạn")
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--tokens-per-s", type=float, default=200.0)
+    parser.add_argument("--reply-tokens", type=int, default=80)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Tỉ lệ trả 503 ngẫu nhiên")
+    parser.add_argument("--slow-model", default="", help="Model chậm hơn --slow-factor lần (thử hedging)")
+    parser.add_argument("--slow-factor", type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    app = create_app(
+        args.rpm, args.tpm, args.latency_ms, args.tokens_per_s, args.reply_tokens,
+        args.error_rate, args.slow_model, args.slow_factor,
+    )
+    print(f"🧪 Groq stand-in: http://{args.host}:{args.port} (rpm={args.rpm}, tpm={args.tpm}, lỗi={args.error_rate:.0%})")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
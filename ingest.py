@@ -0,0 +1,225 @@
+"""
+Ingest hàng loạt vào ChromaDB, tách khỏi server (chạy trong CI / job riêng):
+    python ingest.py --workers 8 --batch-size 256
+Corpus (SUMMARIES_JSONL, BLOGS_JSONL) được đọc theo luồng; embed theo batch cố định trên nhiều process;
+upsert vào Chroma theo batch có giới hạn. Trạng thái (doc_id -> content hash) nằm trong SQLite cạnh
+ChromaDB nên bộ nhớ không tăng theo kích thước corpus và lần chạy bị ngắt sẽ tiếp tục từ chỗ dừng:
+tài liệu đã upsert với cùng hash được bỏ qua, không embed lại.
+Kết thúc: xóa tài liệu đã biến mất khỏi corpus và ghi manifest để server chỉ còn phải so hash khi khởi động.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import multiprocessing as mp
+from typing import Iterator, List, Optional
+
+import rag_core
+
+_EMBEDDINGS = None
+
+
+def _init_worker(threads: int) -> None:
+    """Mỗi process nạp model một lần, giới hạn số luồng để các process không tranh nhau core."""
+    global _EMBEDDINGS
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["ONNX_THREADS"] = str(threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    import rag_core as worker_core
+    worker_core.ONNX_THREADS = threads
+    _EMBEDDINGS = worker_core.make_embeddings()
+
+
+def _embed(texts: List[str]):
+    import numpy as np
+    return np.asarray(_EMBEDDINGS.embed_documents(texts), dtype=np.float32)
+
+
+class IngestState:
+    """Checkpoint trong SQLite: hash của từng doc đã upsert và run đang chạy (để resume / xóa tài liệu cũ)."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS docs (doc_id TEXT PRIMARY KEY, hash TEXT, run TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, **values) -> None:
+        self.conn.executemany("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", [(k, str(v)) for k, v in values.items()])
+        self.conn.commit()
+
+    def hashes(self, doc_ids: List[str]) -> dict:
+        marks = ",".join("?" * len(doc_ids))
+        return dict(self.conn.execute(f"SELECT doc_id, hash FROM docs WHERE doc_id IN ({marks})", doc_ids))
+
+    def mark_seen(self, doc_ids: List[str], run: str) -> None:
+        self.conn.executemany("UPDATE docs SET run = ? WHERE doc_id = ?", [(run, i) for i in doc_ids])
+
+    def commit_docs(self, rows: List[tuple], run: str) -> None:
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO docs (doc_id, hash, run) VALUES (?, ?, ?)", [(i, h, run) for i, h in rows]
+        )
+        self.conn.commit()
+
+    def stale(self, run: str) -> Iterator[List[str]]:
+        while True:
+            ids = [r[0] for r in self.conn.execute("SELECT doc_id FROM docs WHERE run != ? LIMIT 1000", (run,))]
+            if not ids:
+                return
+            yield ids
+
+    def delete(self, doc_ids: List[str]) -> None:
+        self.conn.executemany("DELETE FROM docs WHERE doc_id = ?", [(i,) for i in doc_ids])
+        self.conn.commit()
+
+    def sorted_hashes(self) -> Iterator[tuple]:
+        yield from self.conn.execute("SELECT doc_id, hash FROM docs ORDER BY doc_id")
+
+    def reset(self) -> None:
+        self.conn.execute("DELETE FROM docs")
+        self.conn.execute("DELETE FROM state")
+        self.conn.commit()
+
+
+def _batches(iterable, size: int) -> Iterator[list]:
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _write_manifest(state: IngestState) -> str:
+    """Manifest cùng định dạng với sync_vector_store, ghi theo luồng từ SQLite."""
+    version = rag_core.index_version(state.sorted_hashes())
+    os.makedirs(os.path.dirname(rag_core.MANIFEST_PATH) or ".", exist_ok=True)
+    tmp_path = f"{rag_core.MANIFEST_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(f'{{"embedding_model": {json.dumps(rag_core.embedding_model_id())}, "version": "{version}", "docs": {{')
+        for i, (doc_id, doc_hash) in enumerate(state.sorted_hashes()):
+            f.write(f'{"," if i else ""}\n{json.dumps(doc_id, ensure_ascii=False)}: "{doc_hash}"')
+        f.write("\n}}\n")
+    os.replace(tmp_path, rag_core.MANIFEST_PATH)
+    return version
+
+
+def run(args) -> int:
+    state = IngestState(args.state)
+    model_id = rag_core.embedding_model_id()
+    if args.restart or (state.get("embedding_model") not in (None, model_id)):
+        print("⚠️  Bắt đầu lại từ đầu (yêu cầu --restart hoặc đổi model embedding), xóa collection cũ...")
+        state.reset()
+        vector_store = rag_core._open_vector_store(None)
+        vector_store.delete_collection()
+    # Run dang dở (bị ngắt) được tiếp tục với cùng run id để bước xóa tài liệu cũ vẫn đúng
+    run_id = state.get("run") if state.get("status") == "running" else uuid.uuid4().hex
+    state.set(embedding_model=model_id, run=run_id, status="running")
+    collection = rag_core._open_vector_store(None)._collection
+
+    workers = max(1, args.workers)
+    if workers == 1:
+        _init_worker(args.threads_per_worker)
+        pool = None
+    else:
+        # spawn: không kế thừa torch/tokenizer đã khởi tạo của process cha
+        pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=mp.get_context("spawn"),
+            initializer=_init_worker, initargs=(args.threads_per_worker,),
+        )
+    inflight: deque = deque()
+    counters = {"seen": 0, "skipped": 0, "embedded": 0}
+    start = time.perf_counter()
+
+    def commit(batch: List[tuple], vectors) -> None:
+        for i in range(0, len(batch), args.upsert_batch):
+            part = batch[i:i + args.upsert_batch]
+            collection.upsert(
+                ids=[doc.metadata["doc_id"] for doc, _ in part],
+                embeddings=vectors[i:i + args.upsert_batch].tolist(),
+                metadatas=[doc.metadata for doc, _ in part],
+                documents=[doc.page_content for doc, _ in part],
+            )
+        # Hash chỉ ghi sau khi upsert xong: bị ngắt giữa chừng thì batch này được embed lại
+        state.commit_docs([(doc.metadata["doc_id"], h) for doc, h in batch], run_id)
+        counters["embedded"] += len(batch)
+
+    def drain(limit: int) -> None:
+        while len(inflight) > limit:
+            batch, future = inflight.popleft()
+            commit(batch, future.result() if pool else future)
+            elapsed = time.perf_counter() - start
+            print(f"⏳ {counters['seen']} tài liệu, {counters['embedded']} đã embed, {counters['skipped']} bỏ qua "
+                  f"({counters['embedded'] / elapsed:.1f} doc/s)", file=sys.stderr)
+
+    try:
+        for batch in _batches(rag_core.iter_documents(), args.batch_size):
+            counters["seen"] += len(batch)
+            known = state.hashes([d.metadata["doc_id"] for d in batch])
+            todo = []
+            for doc in batch:
+                doc_hash = rag_core._content_hash(doc)
+                if known.get(doc.metadata["doc_id"]) == doc_hash:
+                    continue
+                todo.append((doc, doc_hash))
+            state.mark_seen([d.metadata["doc_id"] for d in batch], run_id)
+            counters["skipped"] += len(batch) - len(todo)
+            if not todo:
+                continue
+            texts = [doc.page_content for doc, _ in todo]
+            # Giới hạn số batch đang embed: bộ nhớ phẳng, thứ tự commit giữ nguyên thứ tự corpus
+            inflight.append((todo, pool.submit(_embed, texts) if pool else _embed(texts)))
+            drain(args.max_inflight)
+        drain(0)
+        state.conn.commit()
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+
+    removed = 0
+    for stale_ids in state.stale(run_id):
+        collection.delete(ids=stale_ids)
+        state.delete(stale_ids)
+        removed += len(stale_ids)
+    version = _write_manifest(state)
+    state.set(status="done", version=version)
+    elapsed = time.perf_counter() - start
+    print(f"✅ Ingest xong trong {elapsed:.1f}s: {counters['seen']} tài liệu, embed {counters['embedded']}, "
+          f"bỏ qua {counters['skipped']} (không đổi), xóa {removed}. Phiên bản chỉ mục: {version}")
+    return 0
+
+
+def main(argv=None) -> int:
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Ingest corpus JSONL vào ChromaDB theo luồng, song song, có checkpoint.")
+    parser.add_argument("--workers", type=int, default=cpus, help="Số process embed (1 = trong process hiện tại)")
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=rag_core.INDEX_BATCH_SIZE, help="Số tài liệu mỗi batch embed")
+    parser.add_argument("--upsert-batch", type=int, default=rag_core.INDEX_BATCH_SIZE, help="Số tài liệu mỗi lần upsert Chroma")
+    parser.add_argument("--max-inflight", type=int, default=0, help="Số batch embed tối đa đang chờ (mặc định 2 x workers)")
+    parser.add_argument("--state", default=os.path.join(rag_core.PERSIST_DIRECTORY, "ingest_state.sqlite"))
+    parser.add_argument("--restart", action="store_true", help="Bỏ checkpoint, dựng lại collection từ đầu")
+    args = parser.parse_args(argv)
+    args.max_inflight = args.max_inflight or 2 * max(1, args.workers)
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+import os
+import re
+import json
+import math
+import heapq
+import unicodedata
+from collections import Counter
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def fold_diacritics(text: str) -> str:
+    """Bỏ dấu tiếng Việt/Latin ('Đỗ Thị Hà' -> 'do thi ha') và chuyển chữ thường."""
+    text = unicodedata.normalize("NFKD", text or "").replace("đ", "d").replace("Đ", "D")
+    return "".join(ch for ch in text if not unicodedata.combining(ch)).lower()
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(fold_diacritics(text))
+
+
+class BM25Index:
+    """
+    Chỉ mục BM25 trong process trên token đã bỏ dấu, dựng cùng lúc với collection Chroma
+    và lưu thành JSON cạnh nó (kèm nội dung Document để trả kết quả mà không cần hỏi Chroma).
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.version: Optional[str] = None
+        self.documents: List["Document"] = []
+        self.doc_len: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.avgdl = 0.0
+
+    @classmethod
+    def build(cls, docs: Sequence["Document"], version: Optional[str] = None) -> "BM25Index":
+        index = cls()
+        index.version = version
+        index.documents = list(docs)
+        for i, doc in enumerate(index.documents):
+            counts = Counter(tokenize(doc.page_content))
+            index.doc_len.append(sum(counts.values()))
+            for term, tf in counts.items():
+                index.postings.setdefault(term, []).append((i, tf))
+        index.avgdl = sum(index.doc_len) / len(index.doc_len) if index.doc_len else 0.0
+        return index
+
+    def search(self, query: str, k: int, predicate: Optional[Callable[["Document"], bool]] = None) -> List[Tuple["Document", float]]:
+        """Top-k theo BM25; `predicate` (tùy chọn) loại tài liệu không thỏa trước khi xếp hạng (vd. lọc theo CLB)."""
+        n = len(self.documents)
+        if not n:
+            return []
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for i, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[i] / self.avgdl)
+                scores[i] = scores.get(i, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        if predicate is not None:
+            scores = {i: score for i, score in scores.items() if predicate(self.documents[i])}
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.documents[i], score) for i, score in top]
+
+    # --- lưu / tải ---
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        payload = {
+            "version": self.version,
+            "k1": self.k1,
+            "b": self.b,
+            "doc_len": self.doc_len,
+            "postings": self.postings,
+            "documents": [{"page_content": d.page_content, "metadata": d.metadata} for d in self.documents],
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BM25Index"]:
+        from langchain_core.documents import Document
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        index = cls(k1=payload["k1"], b=payload["b"])
+        index.version = payload.get("version")
+        index.doc_len = payload["doc_len"]
+        index.postings = {term: [tuple(p) for p in plist] for term, plist in payload["postings"].items()}
+        index.documents = [Document(page_content=d["page_content"], metadata=d["metadata"]) for d in payload["documents"]]
+        index.avgdl = sum(index.doc_len) / len(index.doc_len) if index.doc_len else 0.0
+        return index
+
+
+def reciprocal_rank_fusion(result_lists: Sequence[Sequence["Document"]], k: int, rrf_k: int = 60) -> List["Document"]:
+    """Gộp nhiều danh sách xếp hạng bằng RRF: score(d) = sum 1 / (rrf_k + rank). Khóa theo doc_id."""
+    scores: Dict[str, float] = {}
+    docs: Dict[str, "Document"] = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, 1):
+            key = doc.metadata.get("doc_id") or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[key] for key in ranked]
@@ -0,0 +1,77 @@
+import httpx
+from typing import Any, List, Optional
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult
+from langchain_groq import ChatGroq
+from rag_core import (
+    LLM_EXPECTED_COMPLETION_TOKENS, LLM_HTTP_MAX_CONNECTIONS, LLM_HTTP_KEEPALIVE, LLM_TIMEOUT_S,
+    count_tokens, get_llm_scheduler,
+)
+
+_HTTP_CLIENTS = None
+
+
+def http_clients():
+    """
+    Cặp httpx client (sync, async) dùng chung cho mọi ChatGroq trong process: giữ kết nối keep-alive
+    tới Groq thay vì mỗi model một pool riêng. SDK không tự thử lại (max_retries=0), scheduler (get_llm_scheduler) lo việc đó.
+    """
+    global _HTTP_CLIENTS
+    if _HTTP_CLIENTS is None:
+        limits = httpx.Limits(max_connections=LLM_HTTP_MAX_CONNECTIONS, max_keepalive_connections=LLM_HTTP_KEEPALIVE)
+        timeout = httpx.Timeout(LLM_TIMEOUT_S, connect=10.0)
+        _HTTP_CLIENTS = (httpx.Client(limits=limits, timeout=timeout), httpx.AsyncClient(limits=limits, timeout=timeout))
+    return _HTTP_CLIENTS
+
+
+class ScheduledChatGroq(ChatGroq):
+    """
+    ChatGroq đi qua scheduler chung (get_llm_scheduler): slot theo độ ưu tiên, pacing theo hạn mức request/token mỗi phút của model,
+    thử lại có jitter khi 429 / 5xx. Nếu có `fallback` và bật LLM_HEDGE_AFTER_S, lời gọi không stream
+    quá hạn được gửi song song sang model dự phòng.
+    """
+    fallback: Optional[ChatGroq] = None
+
+    def _estimate(self, messages: List[BaseMessage]) -> int:
+        prompt = sum(count_tokens(str(m.content)) + 4 for m in messages)
+        return prompt + (self.max_tokens or LLM_EXPECTED_COMPLETION_TOKENS)
+
+    @staticmethod
+    def _usage(result: ChatResult) -> Optional[int]:
+        return ((result.llm_output or {}).get("token_usage") or {}).get("total_tokens")
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.streaming:
+            # ChatGroq tự chuyển sang _astream (đã qua scheduler)
+            return await super()._agenerate(messages, stop, run_manager, **kwargs)
+        generate = super()._agenerate
+        tokens = self._estimate(messages)
+
+        def primary():
+            return get_llm_scheduler().call(
+                self.model_name, tokens, lambda: generate(messages, stop, run_manager, **kwargs), self._usage
+            )
+
+        backup = (lambda: self.fallback._agenerate(messages, stop, None, **kwargs)) if self.fallback is not None else None
+        return await get_llm_scheduler().hedged(primary, backup)
+
+    async def _astream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any):
+        stream = super()._astream
+        async for chunk in get_llm_scheduler().stream(
+            self.model_name, self._estimate(messages), lambda: stream(messages, stop, run_manager, **kwargs)
+        ):
+            yield chunk
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.streaming:
+            return super()._generate(messages, stop, run_manager, **kwargs)
+        generate = super()._generate
+        return get_llm_scheduler().call_sync(
+            self.model_name, self._estimate(messages), lambda: generate(messages, stop, run_manager, **kwargs), self._usage
+        )
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any):
+        stream = super()._stream
+        yield from get_llm_scheduler().stream_sync(
+            self.model_name, self._estimate(messages), lambda: stream(messages, stop, run_manager, **kwargs)
+        )
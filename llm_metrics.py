@@ -0,0 +1,90 @@
+"""
+Callback LangChain đo các lời gọi model chat, tách khỏi metrics.py để import metrics (server, rag_core)
+không kéo theo langchain_core; chỉ make_chat_model import module này, lúc dựng chain.
+"""
+import time
+import threading
+from typing import Dict
+from uuid import UUID
+from langchain_core.callbacks import BaseCallbackHandler
+from metrics import collectors, current_trace
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """
+    Callback gắn vào model chat: đo thời gian tới token đầu tiên và tổng thời gian sinh,
+    đếm token prompt/completion (usage của provider, nếu thiếu thì đếm token stream).
+    Stage được đặt tên theo vai trò: llm_first_token / llm_total cho model trả lời,
+    rewrite_llm_first_token / rewrite_llm_total cho model viết lại câu hỏi.
+    """
+    run_inline = True
+
+    def __init__(self, role: str = "answer"):
+        self.role = role
+        self._prefix = "llm" if role == "answer" else f"{role}_llm"
+        self._runs: Dict[UUID, dict] = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs):
+        with self._lock:
+            self._runs[run_id] = {"start": time.perf_counter(), "first": None, "streamed": 0, "trace": current_trace()}
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs):
+        self.on_chat_model_start(serialized, [], run_id=run_id, **kwargs)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs):
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is None:
+                return
+            run["streamed"] += 1
+            if run["first"] is not None:
+                return
+            run["first"] = time.perf_counter() - run["start"]
+        self._observe(run, "first_token", run["first"])
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        total = time.perf_counter() - run["start"]
+        if run["first"] is None:  # không stream: token đầu tiên đến cùng lúc với cả câu
+            self._observe(run, "first_token", total)
+        self._observe(run, "total", total)
+        prompt, completion = self._usage(response)
+        completion = completion or run["streamed"]
+        tokens = collectors().llm_tokens
+        tokens.labels(self.role, "prompt").inc(prompt)
+        tokens.labels(self.role, "completion").inc(completion)
+        self._incr(run, f"{self._prefix}_prompt_tokens", prompt)
+        self._incr(run, f"{self._prefix}_completion_tokens", completion)
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs):
+        with self._lock:
+            self._runs.pop(run_id, None)
+
+    def _observe(self, run: dict, stage: str, seconds: float) -> None:
+        name = f"{self._prefix}_{stage}"
+        collectors().stage_seconds.labels(name).observe(seconds)
+        trace = run["trace"]
+        if trace is not None:
+            trace["stages"][name] = round(trace["stages"].get(name, 0.0) + seconds, 4)
+
+    @staticmethod
+    def _incr(run: dict, name: str, value: int) -> None:
+        trace = run["trace"]
+        if trace is not None and value:
+            trace["counters"][name] = trace["counters"].get(name, 0) + value
+
+    @staticmethod
+    def _usage(response) -> tuple:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            return int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0)
+        for generations in response.generations:
+            for gen in generations:
+                meta = getattr(getattr(gen, "message", None), "usage_metadata", None)
+                if meta:
+                    return int(meta.get("input_tokens") or 0), int(meta.get("output_tokens") or 0)
+        return 0, 0
@@ -0,0 +1,369 @@
+"""
+Lớp điều phối các lời gọi LLM (đặt trước Groq), dùng chung cho mọi model trong process:
+- token bucket theo request/phút và token/phút cho từng model, dựa trên số token ước lượng
+  (prompt + max completion), đối soát lại bằng usage thực tế sau mỗi lời gọi;
+- hàng đợi ưu tiên cho các slot đồng thời: request tương tác (/chat, UI) trước việc nền (batch, tóm tắt phiên);
+  việc nền còn phải chừa lại `batch_reserve` dung lượng token cho request tương tác;
+- thử lại có jitter khi gặp 429 / 5xx / lỗi kết nối (tôn trọng Retry-After, 429 tạm dừng bucket của model);
+- hedging: quá `hedge_after_s` mà chưa có kết quả thì gửi song song sang model dự phòng, lấy kết quả về trước.
+Không phụ thuộc SDK Groq: lỗi được nhận diện qua `status_code` / `response.headers` của exception.
+"""
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+import contextvars
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+INTERACTIVE, BATCH = 0, 1
+# Pacing ở mức 95% hạn mức khai báo: bù lệch ước lượng token và lệch đồng hồ với phía Groq
+_HEADROOM = 0.95
+_PRIORITY: contextvars.ContextVar = contextvars.ContextVar("llm_priority", default=INTERACTIVE)
+
+_TRANSIENT_ERRORS = (
+    "APIConnectionError", "APITimeoutError", "ConnectError", "ConnectTimeout", "ReadTimeout",
+    "RemoteProtocolError", "TimeoutException",
+)
+
+
+@contextmanager
+def llm_priority(priority: int):
+    """Đặt độ ưu tiên cho mọi lời gọi LLM trong khối (đi theo task/thread con qua ContextVar)."""
+    token = _PRIORITY.set(priority)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+
+class LLMOverloadedError(RuntimeError):
+    """Hết lượt thử mà nhà cung cấp vẫn báo quá hạn mức; `retry_after` gợi ý cho client (giây)."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def retry_info(error: BaseException) -> Tuple[bool, Optional[int], Optional[float]]:
+    """(có nên thử lại, status HTTP, Retry-After giây) của một exception từ client LLM."""
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    retry_after = None
+    headers = getattr(response, "headers", None) or {}
+    try:
+        retry_after = float(headers.get("retry-after")) if headers.get("retry-after") else None
+    except (TypeError, ValueError):
+        retry_after = None
+    if status is None:
+        return type(error).__name__ in _TRANSIENT_ERRORS, None, None
+    return status == 429 or 500 <= status < 600, status, retry_after
+
+
+class TokenBucket:
+    """
+    Bucket nạp đều `per_minute` đơn vị/phút, chứa tối đa một phút. `reserve` trừ ngay (có thể âm) và trả về
+    số giây phải chờ đến khi khoản nợ được bù, nên dùng được cả từ code sync lẫn async, không cần hàng đợi riêng.
+    """
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, floor: float = 0.0) -> float:
+        """Trừ `amount`; chờ đến khi mức còn lại >= `floor` (phần chừa cho request ưu tiên cao hơn)."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.level -= amount
+            wait = max(0.0, (floor * self.capacity - self.level) / self.rate)
+            return max(wait, self.paused_until - now)
+
+    def adjust(self, delta: float) -> None:
+        """Đối soát: dương = dùng nhiều hơn ước lượng, âm = hoàn lại."""
+        with self._lock:
+            self.level = min(self.capacity, self.level - delta)
+
+    def pause(self, seconds: float) -> None:
+        """Nhà cung cấp báo 429: ước lượng đã lệch, xả bucket và tạm dừng."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.level = min(self.level, 0.0)
+
+    def available(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.level
+
+
+class RateLimiter:
+    """Hạn mức của một model: request/phút và token/phút (0 = không giới hạn)."""
+
+    def __init__(self, rpm: float, tpm: float, batch_reserve: float):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.batch_reserve = batch_reserve
+
+    def reserve(self, tokens: int, priority: int) -> float:
+        floor = self.batch_reserve if priority >= BATCH else 0.0
+        return max([bucket.reserve(amount, floor) for bucket, amount in self._buckets(tokens)], default=0.0)
+
+    def _buckets(self, tokens: int):
+        return [(b, n) for b, n in ((self.requests, 1), (self.tokens, tokens)) if b is not None]
+
+    def adjust(self, delta_tokens: int) -> None:
+        if self.tokens is not None and delta_tokens:
+            self.tokens.adjust(delta_tokens)
+
+    def refund(self, tokens: int) -> None:
+        """Lời gọi bị từ chối (429) không bị tính vào hạn mức."""
+        for bucket, amount in self._buckets(tokens):
+            bucket.adjust(-amount)
+
+    def pause(self, seconds: float) -> None:
+        for bucket, _ in self._buckets(0):
+            bucket.pause(seconds)
+
+
+class PriorityGate:
+    """Giới hạn số lời gọi đồng thời; slot trống được trao cho request chờ có độ ưu tiên cao nhất (FIFO trong cùng mức)."""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.active = 0
+        self._waiters: list = []
+        self._seq = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, fut in self._waiters if not fut.done())
+
+    async def acquire(self, priority: int) -> None:
+        if self.active < self.limit and not self.waiting:
+            self.active += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # Slot đã được trao đúng lúc bị hủy: trả lại cho người kế tiếp
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)  # slot chuyển thẳng cho người chờ, active không đổi
+                return
+        self.active -= 1
+
+
+class LLMScheduler:
+    def __init__(
+        self,
+        rpm: float = 0,
+        tpm: float = 0,
+        max_concurrent: int = 64,
+        batch_reserve: float = 0.2,
+        max_retries: int = 4,
+        retry_base_s: float = 0.5,
+        retry_max_s: float = 8.0,
+        hedge_after_s: float = 0.0,
+    ):
+        self.rpm, self.tpm, self.batch_reserve = rpm, tpm, batch_reserve
+        self.max_retries = max_retries
+        self.retry_base_s = retry_base_s
+        self.retry_max_s = retry_max_s
+        self.hedge_after_s = hedge_after_s
+        self.gate = PriorityGate(max_concurrent)
+        self._limiters: Dict[str, RateLimiter] = {}
+        self._lock = threading.Lock()
+        self.counters = {
+            "calls": 0, "retries": 0, "rate_limited": 0, "server_errors": 0, "overloaded": 0,
+            "hedged": 0, "hedge_wins": 0, "paced": 0, "paced_s": 0.0,
+        }
+
+    def limiter(self, model: str) -> RateLimiter:
+        """Hạn mức của Groq tính theo từng model nên mỗi model có bucket riêng."""
+        with self._lock:
+            if model not in self._limiters:
+                self._limiters[model] = RateLimiter(self.rpm * _HEADROOM, self.tpm * _HEADROOM, self.batch_reserve)
+            return self._limiters[model]
+
+    def _count(self, key: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[key] += value
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        # Full jitter: các request cùng bị 429 không dội lại cùng một lúc
+        delay = random.uniform(0, min(self.retry_max_s, self.retry_base_s * 2 ** attempt))
+        return max(delay, retry_after or 0.0)
+
+    def _on_error(self, model: str, tokens: int, error: BaseException, attempt: int) -> float:
+        """Trả về số giây chờ trước lần thử lại, hoặc ném lại lỗi nếu không thử lại được."""
+        retryable, status, retry_after = retry_info(error)
+        if status == 429:
+            self._count("rate_limited")
+            limiter = self.limiter(model)
+            limiter.refund(tokens)
+            limiter.pause(retry_after or self._backoff(attempt, None))
+        elif status:
+            self._count("server_errors")
+        if not retryable:
+            raise error
+        if attempt >= self.max_retries:
+            if status == 429:
+                self._count("overloaded")
+                raise LLMOverloadedError(f"LLM {model} quá hạn mức sau {attempt + 1} lần thử", retry_after or self.retry_max_s) from error
+            raise error
+        self._count("retries")
+        return self._backoff(attempt, retry_after)
+
+    def _pace(self, model: str, tokens: int, priority: int) -> float:
+        wait = self.limiter(model).reserve(tokens, priority)
+        if wait > 0:
+            self._count("paced")
+            self._count("paced_s", wait)
+        return wait
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[int] = None):
+        await self.gate.acquire(_PRIORITY.get() if priority is None else priority)
+        try:
+            yield
+        finally:
+            self.gate.release()
+
+    # --- async ---
+    async def call(
+        self, model: str, tokens: int, fn: Callable[[], Awaitable[Any]],
+        usage: Optional[Callable[[Any], Optional[int]]] = None, priority: Optional[int] = None,
+    ) -> Any:
+        """Gọi `fn` trong một slot, có pacing và thử lại. `usage(result)` trả về số token thực tế để đối soát."""
+        priority = _PRIORITY.get() if priority is None else priority
+        async with self.slot(priority):
+            for attempt in itertools.count():
+                wait = self._pace(model, tokens, priority)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self._count("calls")
+                try:
+                    result = await fn()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    await asyncio.sleep(self._on_error(model, tokens, e, attempt))
+                    continue
+                actual = usage(result) if usage else None
+                if actual:
+                    self.limiter(model).adjust(actual - tokens)
+                return result
+
+    async def stream(
+        self, model: str, tokens: int, open_stream: Callable[[], AsyncIterator[Any]], priority: Optional[int] = None,
+    ) -> AsyncIterator[Any]:
+        """Như `call` cho stream: chỉ thử lại khi chưa nhận được chunk nào (đã gửi token cho client thì không)."""
+        priority = _PRIORITY.get() if priority is None else priority
+        async with self.slot(priority):
+            for attempt in itertools.count():
+                wait = self._pace(model, tokens, priority)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self._count("calls")
+                started = False
+                try:
+                    async for chunk in open_stream():
+                        started = True
+                        yield chunk
+                    return
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if started:
+                        raise
+                    await asyncio.sleep(self._on_error(model, tokens, e, attempt))
+
+    async def hedged(self, primary: Callable[[], Awaitable[Any]], backup: Optional[Callable[[], Awaitable[Any]]]) -> Any:
+        """Chạy `primary`; quá hedge_after_s chưa xong thì chạy thêm `backup`, lấy kết quả thành công đầu tiên."""
+        if backup is None or self.hedge_after_s <= 0:
+            return await primary()
+        tasks = [asyncio.ensure_future(primary())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after_s)
+            if not done:
+                self._count("hedged")
+                tasks.append(asyncio.ensure_future(backup()))
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    # --- sync (UI Gradio chạy trong thread): pacing + thử lại, không qua slot async ---
+    def call_sync(self, model: str, tokens: int, fn: Callable[[], Any], usage: Optional[Callable[[Any], Optional[int]]] = None) -> Any:
+        priority = _PRIORITY.get()
+        for attempt in itertools.count():
+            wait = self._pace(model, tokens, priority)
+            if wait > 0:
+                time.sleep(wait)
+            self._count("calls")
+            try:
+                result = fn()
+            except Exception as e:
+                time.sleep(self._on_error(model, tokens, e, attempt))
+                continue
+            actual = usage(result) if usage else None
+            if actual:
+                self.limiter(model).adjust(actual - tokens)
+            return result
+
+    def stream_sync(self, model: str, tokens: int, open_stream: Callable[[], Any]):
+        priority = _PRIORITY.get()
+        for attempt in itertools.count():
+            wait = self._pace(model, tokens, priority)
+            if wait > 0:
+                time.sleep(wait)
+            self._count("calls")
+            started = False
+            try:
+                for chunk in open_stream():
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started:
+                    raise
+                time.sleep(self._on_error(model, tokens, e, attempt))
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {**self.counters, "paced_s": round(self.counters["paced_s"], 3)}
+            limiters = dict(self._limiters)
+        stats["active"] = self.gate.active
+        stats["waiting"] = self.gate.waiting
+        stats["tokens_available"] = {
+            model: round(limiter.tokens.available(), 1) for model, limiter in limiters.items() if limiter.tokens is not None
+        }
+        return stats
@@ -0,0 +1,270 @@
+"""
+Load test cho server.py: phát lại bộ câu hỏi vào /chat (hoặc /chat/stream) với độ đồng thời cố định
+và in báo cáo JSON (p50/p95/p99, throughput, thời gian từng stage) để so sánh giữa các commit.
+
+Chạy offline không tốn quota Groq:
+    LLM_PROVIDER=fake python loadtest.py --in-process --concurrency 16 --requests 500 --output bench.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+from collections import Counter
+from typing import Dict, List, Optional
+import numpy as np
+import httpx
+
+DEFAULT_QUESTIONS = [
+    "What is DUPR?",
+    "How is a DUPR rating calculated?",
+    "Who has the highest win rate?",
+    "Who has the most doubles wins?",
+    "How many players are in the club?",
+    "What is the average win rate?",
+    "DUPR là gì?",
+    "Ai có tỉ lệ thắng cao nhất?",
+    "Làm thế nào để tăng điểm DUPR?",
+    "What are the latest pickleball tournaments?",
+    "Tell me about the DUPR partnership announcements.",
+    "What does reliability score mean in DUPR?",
+]
+
+
+def load_questions(paths: List[str]) -> List[dict]:
+    """
+    Đọc câu hỏi: .txt (mỗi dòng một câu) hoặc .jsonl. Dòng jsonl có `message` được gửi nguyên
+    (log request thật: message/history/top_k), nếu không lấy `question`/`input`/`title`.
+    """
+    if not paths:
+        return [{"message": q} for q in DEFAULT_QUESTIONS]
+    bodies = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                if not path.endswith(".jsonl"):
+                    bodies.append({"message": line})
+                    continue
+                row = json.loads(line)
+                if row.get("message"):
+                    bodies.append({k: row[k] for k in ("message", "history", "top_k") if row.get(k) is not None})
+                else:
+                    message = row.get("question") or row.get("input") or row.get("title")
+                    if message:
+                        bodies.append({"message": message})
+    return bodies
+
+
+def percentiles(values: List[float]) -> Optional[Dict[str, float]]:
+    if not values:
+        return None
+    arr = np.asarray(values, dtype=float) * 1000.0
+    return {
+        "p50_ms": round(float(np.percentile(arr, 50)), 2),
+        "p95_ms": round(float(np.percentile(arr, 95)), 2),
+        "p99_ms": round(float(np.percentile(arr, 99)), 2),
+        "mean_ms": round(float(arr.mean()), 2),
+        "max_ms": round(float(arr.max()), 2),
+    }
+
+
+def _parse_sse(text: str) -> List[tuple]:
+    events = []
+    for block in text.split("\n\n"):
+        kind, data = None, None
+        for line in block.splitlines():
+            if line.startswith("event: "):
+                kind = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+        if kind:
+            events.append((kind, data))
+    return events
+
+
+async def _one(client: httpx.AsyncClient, body: dict, stream: bool, headers: Optional[dict] = None) -> dict:
+    start = time.perf_counter()
+    result = {"ok": False, "status": None, "stages": {}, "flags": {}}
+    try:
+        if stream:
+            first_byte = None
+            chunks = []
+            async with client.stream("POST", "/chat/stream", json=body, headers=headers) as resp:
+                result["status"] = resp.status_code
+                async for chunk in resp.aiter_text():
+                    if first_byte is None and "event: token" in chunk:
+                        first_byte = time.perf_counter() - start
+                    chunks.append(chunk)
+            events = _parse_sse("".join(chunks))
+            done = next((d for k, d in events if k == "done"), None) or {}
+            result["ok"] = resp.status_code == 200 and not any(k == "error" for k, _ in events)
+            result["stages"] = {
+                "client_first_token_s": first_byte,
+                "retrieval_s": done.get("retrieval_s"),
+                "first_token_s": done.get("first_token_s"),
+                "server_total_s": done.get("total_s"),
+                **(done.get("stages") or {}),
+            }
+            result["flags"] = {k: bool(done.get(k)) for k in ("cache_hit", "fast_path", "degraded")}
+        else:
+            resp = await client.post("/chat", json=body, headers=headers)
+            result["status"] = resp.status_code
+            result["ok"] = resp.status_code == 200
+            if result["ok"]:
+                data = resp.json()
+                result["flags"] = {k: bool(data.get(k)) for k in ("cache_hit", "fast_path", "degraded")}
+                result["stages"] = {"context_tokens": data.get("context_tokens"), "context_tokens_raw": data.get("context_tokens_raw")}
+                result["stages"].update(data.get("timing") or {})
+    except httpx.HTTPError as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["latency_s"] = time.perf_counter() - start
+    return result
+
+
+async def run(client: httpx.AsyncClient, bodies: List[dict], concurrency: int, stream: bool) -> dict:
+    queue: "asyncio.Queue[dict]" = asyncio.Queue()
+    for body in bodies:
+        queue.put_nowait(body)
+    results: List[dict] = []
+
+    async def worker(i: int):
+        # Mỗi worker là một client riêng với admission control của server (ADMISSION_PER_CLIENT)
+        headers = {"X-Client-Id": f"loadtest-{i}"}
+        while True:
+            try:
+                body = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            results.append(await _one(client, body, stream, headers))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    duration = time.perf_counter() - start
+
+    ok = [r for r in results if r["ok"]]
+    stage_names = sorted({k for r in ok for k, v in r["stages"].items() if isinstance(v, float)})
+    report = {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "shed": sum(1 for r in results if r["status"] in (429, 503)),
+        "status_counts": dict(Counter(str(r["status"]) for r in results)),
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(ok) / duration, 2) if duration else None,
+        "latency": percentiles([r["latency_s"] for r in ok]),
+        "stages": {
+            name: percentiles([r["stages"][name] for r in ok if isinstance(r["stages"].get(name), float)])
+            for name in stage_names
+        },
+        "paths": {flag: sum(1 for r in ok if r["flags"].get(flag)) for flag in ("cache_hit", "fast_path", "degraded")},
+    }
+    context_tokens = [r["stages"]["context_tokens"] for r in ok if r["stages"].get("context_tokens") is not None]
+    if context_tokens:
+        report["context_tokens_mean"] = round(float(np.mean(context_tokens)), 1)
+    raw_tokens = [r["stages"]["context_tokens_raw"] for r in ok if r["stages"].get("context_tokens_raw") is not None]
+    if raw_tokens:
+        report["context_tokens_raw_mean"] = round(float(np.mean(raw_tokens)), 1)
+    errors = Counter(r.get("error") for r in results if r.get("error"))
+    if errors:
+        report["error_samples"] = dict(errors.most_common(5))
+    return report
+
+
+async def _wait_ready(client: httpx.AsyncClient, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        resp = await client.get("/readyz")
+        if resp.status_code == 200:
+            return
+        if resp.json().get("status") == "failed":
+            raise RuntimeError(f"Khởi động thất bại: {resp.json().get('error')}")
+        await asyncio.sleep(0.5)
+    raise TimeoutError("Server chưa sẵn sàng sau thời gian chờ")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main_async(args) -> dict:
+    bodies = load_questions(args.questions)
+    if args.top_k:
+        bodies = [{**b, "top_k": args.top_k} for b in bodies]
+    total = args.requests or len(bodies)
+    rng = random.Random(args.seed)
+    # Lặp lại bộ câu hỏi theo thứ tự (hoặc xáo trộn) cho đủ số request
+    plan = [bodies[i % len(bodies)] for i in range(total)]
+    if args.shuffle:
+        rng.shuffle(plan)
+
+    if args.in_process:
+        import server
+        server.on_start()
+        transport = httpx.ASGITransport(app=server.app)
+        base_url = "http://loadtest"
+    else:
+        transport, base_url = None, args.url
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=timeout, limits=limits) as client:
+        await _wait_ready(client, args.ready_timeout)
+        if args.warmup:
+            await run(client, plan[:args.warmup], args.concurrency, args.stream)
+        report = await run(client, plan, args.concurrency, args.stream)
+        stats = await client.get("/cache/stats")
+        if stats.status_code == 200:
+            report["server_stats"] = stats.json()
+
+    report = {
+        "label": args.label or _git_commit(),
+        "config": {
+            "endpoint": "/chat/stream" if args.stream else "/chat",
+            "concurrency": args.concurrency,
+            "in_process": args.in_process,
+            "llm_provider": os.getenv("LLM_PROVIDER", "groq"),
+            "fake_llm_latency_ms": os.getenv("FAKE_LLM_LATENCY_MS"),
+            "fake_llm_tokens_per_s": os.getenv("FAKE_LLM_TOKENS_PER_S"),
+            "questions": len(bodies),
+        },
+        **report,
+    }
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load test /chat với độ đồng thời cố định, báo cáo JSON.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--in-process", action="store_true", help="Gọi thẳng app FastAPI qua ASGI, không cần chạy uvicorn")
+    parser.add_argument("--questions", action="append", default=[], help=".txt hoặc .jsonl, có thể lặp lại")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=0, help="Tổng số request (mặc định = số câu hỏi)")
+    parser.add_argument("--warmup", type=int, default=0, help="Số request chạy trước, không tính vào báo cáo")
+    parser.add_argument("--stream", action="store_true", help="Dùng /chat/stream để lấy thời gian từng stage")
+    parser.add_argument("--top-k", type=int, default=None)
+    parser.add_argument("--shuffle", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--ready-timeout", type=float, default=600.0)
+    parser.add_argument("--label", default=None, help="Nhãn báo cáo (mặc định: commit git hiện tại)")
+    parser.add_argument("--output", default=None, help="Ghi báo cáo JSON ra file")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(main_async(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return 0 if report["requests"] and not report["errors"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+# Một dòng JSON cho mỗi request (stage + counter) ghi vào logger "rag_requests"
+REQUEST_LOG = os.getenv("REQUEST_LOG", "0") == "1"
+request_logger = logging.getLogger("rag_requests")
+if REQUEST_LOG and not request_logger.handlers:
+    request_logger.addHandler(logging.StreamHandler())
+    request_logger.setLevel(logging.INFO)
+    request_logger.propagate = False
+
+_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Collectors:
+    """Các metric Prometheus của process; tạo ở lần dùng đầu tiên để import metrics không kéo theo prometheus_client."""
+
+    def __init__(self):
+        from prometheus_client import Counter, Histogram
+
+        self.stage_seconds = Histogram(
+            "rag_stage_seconds", "Thời gian từng stage của chain (rewrite, embed, vector_search, format, llm_*)",
+            ["stage"], buckets=_BUCKETS,
+        )
+        self.request_seconds = Histogram(
+            "rag_request_seconds", "Thời gian xử lý request end-to-end", ["endpoint", "path"], buckets=_BUCKETS,
+        )
+        self.requests = Counter(
+            "rag_requests_total", "Số request theo endpoint / đường xử lý / trạng thái", ["endpoint", "path", "status"],
+        )
+        self.llm_tokens = Counter("rag_llm_tokens_total", "Token LLM (prompt / completion)", ["role", "kind"])
+        self.docs = Histogram(
+            "rag_documents", "Số tài liệu truy hồi (retrieved) và đưa vào prompt (packed)", ["phase"],
+            buckets=(0, 1, 2, 3, 5, 8, 13, 20, 40),
+        )
+        self.cache_events = Counter("rag_cache_events_total", "Trúng / trượt cache", ["cache", "result"])
+        self.context_tokens = Counter(
+            "rag_context_tokens_total", "Token context: raw = page_content gốc, prompt = dạng thực sự đưa vào prompt", ["kind"],
+        )
+
+
+_COLLECTORS: Optional[_Collectors] = None
+_collectors_lock = threading.Lock()
+
+
+def collectors() -> _Collectors:
+    global _COLLECTORS
+    if _COLLECTORS is None:
+        with _collectors_lock:
+            if _COLLECTORS is None:
+                _COLLECTORS = _Collectors()
+    return _COLLECTORS
+
+
+_TRACE: ContextVar[Optional[dict]] = ContextVar("rag_trace", default=None)
+
+
+def observe(stage: str, seconds: float) -> None:
+    collectors().stage_seconds.labels(stage).observe(seconds)
+    trace = _TRACE.get()
+    if trace is not None:
+        # Stage lặp lại trong cùng request (vd. embed cho cache + retriever) được cộng dồn
+        trace["stages"][stage] = round(trace["stages"].get(stage, 0.0) + seconds, 4)
+
+
+def incr(name: str, value: float = 1) -> None:
+    """Counter gắn với request hiện tại (chỉ cho dòng log), vd. retrieved_docs, prompt_tokens."""
+    trace = _TRACE.get()
+    if trace is not None:
+        trace["counters"][name] = trace["counters"].get(name, 0) + value
+
+
+@contextmanager
+def span(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def count_docs(phase: str, n: int) -> None:
+    collectors().docs.labels(phase).observe(n)
+    incr(f"{phase}_docs", n)
+
+
+def count_context_tokens(raw: int, prompt: int) -> None:
+    metric = collectors().context_tokens
+    metric.labels("raw").inc(raw)
+    metric.labels("prompt").inc(prompt)
+    incr("context_tokens_saved", raw - prompt)
+
+
+def count_cache(cache: str, hit: bool) -> None:
+    collectors().cache_events.labels(cache, "hit" if hit else "miss").inc()
+    incr(f"{cache}_{'hits' if hit else 'misses'}")
+
+
+@contextmanager
+def request_trace(endpoint: str, **fields):
+    """
+    Bao một request: gom các stage/counter của request vào một dict (qua ContextVar nên đi theo
+    cả các task/thread mà LangChain tạo), đo thời gian tổng và ghi dòng log JSON nếu REQUEST_LOG=1.
+    Đặt trace["path"] (rag / cache_hit / fast_path / degraded) trước khi thoát để gắn nhãn.
+    status: ok / error / disconnected (client ngắt stream giữa chừng hoặc request bị hủy, không phải lỗi).
+    """
+    trace = {"endpoint": endpoint, "path": "rag", "status": "ok", "stages": {}, "counters": {}, **fields}
+    token = _TRACE.set(trace)
+    start = time.perf_counter()
+    try:
+        yield trace
+    except (GeneratorExit, asyncio.CancelledError):
+        trace["status"] = "disconnected"
+        raise
+    except BaseException:
+        trace["status"] = "error"
+        raise
+    finally:
+        _TRACE.reset(token)
+        total = time.perf_counter() - start
+        metrics = collectors()
+        metrics.request_seconds.labels(endpoint, trace["path"]).observe(total)
+        metrics.requests.labels(endpoint, trace["path"], trace["status"]).inc()
+        if REQUEST_LOG:
+            trace["total_s"] = round(total, 4)
+            request_logger.info(json.dumps(trace, ensure_ascii=False, default=str))
+
+
+def current_trace() -> Optional[dict]:
+    return _TRACE.get()
+
+
+class StatsCollector:
+    """Xuất các bộ đếm sẵn có (cache_stats() của rag_core) dưới dạng metric Prometheus lúc scrape."""
+
+    def __init__(self, stats_fn: Callable[[], dict]):
+        self.stats_fn = stats_fn
+
+    def collect(self):
+        from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+        try:
+            stats = self.stats_fn() or {}
+        except Exception:
+            return
+        for group, values in stats.items():
+            if not isinstance(values, dict):
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"rag_{group}_{key}"
+                if key in ("size", "memory_size", "hit_rate", "inflight", "docs", "generation", "active", "waiting", "clients") or key.startswith(("avg_", "last_")):
+                    yield GaugeMetricFamily(name, f"{group}.{key}", value=value)
+                else:
+                    yield CounterMetricFamily(name, f"{group}.{key}", value=value)
+
+
+_collector_registered = False
+
+
+def register_stats(stats_fn: Callable[[], dict]) -> None:
+    global _collector_registered
+    from prometheus_client.core import REGISTRY
+
+    if not _collector_registered:
+        REGISTRY.register(StatsCollector(stats_fn))
+        _collector_registered = True
+
+
+def render_metrics() -> tuple:
+    """(body, content_type) cho endpoint /metrics."""
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+
+    collectors()  # /metrics có đủ các metric ngay cả khi chưa có request nào
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
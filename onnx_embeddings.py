@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import time
+import argparse
+from typing import List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+_META_FILE = "export.json"
+
+
+def model_path(model_dir: str, quantize: bool) -> str:
+    return os.path.join(model_dir, "model.int8.onnx" if quantize else "model.onnx")
+
+
+def export_onnx(model_name: str, model_dir: str, quantize: bool = True, opset: int = 14) -> str:
+    """
+    Xuất model sentence-transformers sang ONNX (một lần, cần torch) và lượng tử hóa int8 động nếu `quantize`.
+    Ghi kèm tokenizer.json và export.json (pooling, normalize, max_length) để lúc chạy chỉ cần
+    onnxruntime + tokenizers, không import torch.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    os.makedirs(model_dir, exist_ok=True)
+    st = SentenceTransformer(model_name, device="cpu")
+    transformer = st[0].auto_model.eval()
+    tokenizer = st.tokenizer
+    pooling = next((m for m in st if isinstance(m, Pooling)), None)
+    meta = {
+        "model_name": model_name,
+        "max_length": int(st.max_seq_length or 256),
+        "pooling": "cls" if pooling is not None and pooling.pooling_mode_cls_token else "mean",
+        "normalize": any(isinstance(m, Normalize) for m in st),
+        "pad_token": tokenizer.pad_token,
+        "pad_id": tokenizer.pad_token_id,
+    }
+
+    dummy = tokenizer(["xin chào pickleball"], return_tensors="pt")
+    input_names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in dummy]
+
+    class _Wrapper(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs)), return_dict=True).last_hidden_state
+
+    fp32_path = model_path(model_dir, quantize=False)
+    dynamic_axes = {n: {0: "batch", 1: "seq"} for n in input_names + ["last_hidden_state"]}
+    with torch.no_grad():
+        torch.onnx.export(
+            _Wrapper(transformer), tuple(dummy[n] for n in input_names), fp32_path,
+            input_names=input_names, output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes, opset_version=opset, do_constant_folding=True,
+        )
+    tokenizer.save_pretrained(model_dir)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, model_path(model_dir, quantize=True), weight_type=QuantType.QInt8)
+    meta["quantized"] = quantize
+    with open(os.path.join(model_dir, _META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    print(f"✅ Đã xuất ONNX{' (int8)' if quantize else ''}: {model_path(model_dir, quantize)}")
+    return model_path(model_dir, quantize)
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Embeddings chạy bằng onnxruntime trên CPU (model đã xuất bởi `export_onnx`), cùng pooling
+    và chuẩn hóa như sentence-transformers nên vector thay thế được HuggingFaceEmbeddings.
+    `threads` = số luồng intra-op của onnxruntime (0 = mặc định của onnxruntime).
+    """
+
+    def __init__(self, model_dir: str, quantize: bool = True, threads: int = 0, batch_size: int = 32):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, _META_FILE), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.batch_size = batch_size
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.meta["max_length"])
+        self.tokenizer.enable_padding(pad_id=self.meta["pad_id"], pad_token=self.meta["pad_token"])
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.inter_op_num_threads = 1
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            model_path(model_dir, quantize), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        feed = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden = self.session.run(None, {n: feed[n] for n in self.input_names})[0]
+        if self.meta["pooling"] == "cls":
+            vectors = hidden[:, 0]
+        else:
+            mask = feed["attention_mask"][..., None].astype(np.float32)
+            vectors = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.meta["normalize"]:
+            vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        # Gom các câu dài gần nhau vào cùng batch để giảm padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out: List[Optional[List[float]]] = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            idx = order[start:start + self.batch_size]
+            for i, vector in zip(idx, self._encode([texts[i] for i in idx])):
+                out[i] = vector.tolist()
+        return out
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0].tolist()
+
+
+def parity_check(model_name: str, model_dir: str, texts: List[str], quantize: bool = True, threads: int = 0) -> dict:
+    """So sánh vector ONNX với HuggingFaceEmbeddings (PyTorch): cosine từng câu và thời gian embed từng câu hỏi."""
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    reference = HuggingFaceEmbeddings(model_name=model_name)
+    candidate = OnnxEmbeddings(model_dir, quantize=quantize, threads=threads)
+
+    ref = np.asarray(reference.embed_documents(texts), dtype=np.float32)
+    got = np.asarray(candidate.embed_documents(texts), dtype=np.float32)
+    cos = (ref * got).sum(axis=1) / (np.linalg.norm(ref, axis=1) * np.linalg.norm(got, axis=1))
+
+    def per_query(model) -> float:
+        model.embed_query(texts[0])  # warm-up
+        start = time.perf_counter()
+        for text in texts:
+            model.embed_query(text)
+        return (time.perf_counter() - start) / len(texts)
+
+    torch_s, onnx_s = per_query(reference), per_query(candidate)
+    return {
+        "texts": len(texts),
+        "min_cosine": float(cos.min()),
+        "mean_cosine": float(cos.mean()),
+        "torch_query_ms": round(torch_s * 1000, 3),
+        "onnx_query_ms": round(onnx_s * 1000, 3),
+        "speedup": round(torch_s / onnx_s, 2) if onnx_s else None,
+    }
+
+
+def main(argv=None) -> int:
+    import rag_core
+
+    parser = argparse.ArgumentParser(description="Xuất model embedding sang ONNX và kiểm tra độ khớp với PyTorch.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("export", help="Xuất (và lượng tử hóa) model vào ONNX_MODEL_DIR")
+    parity = sub.add_parser("parity", help="So sánh cosine ONNX vs PyTorch trên mẫu tài liệu + câu hỏi")
+    parity.add_argument("--samples", type=int, default=200)
+    parity.add_argument("--min-cosine", type=float, default=0.98)
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        export_onnx(rag_core.EMBEDDING_MODEL_NAME, rag_core.ONNX_MODEL_DIR, quantize=rag_core.ONNX_QUANTIZE)
+        return 0
+
+    if not os.path.exists(os.path.join(rag_core.ONNX_MODEL_DIR, _META_FILE)):
+        export_onnx(rag_core.EMBEDDING_MODEL_NAME, rag_core.ONNX_MODEL_DIR, quantize=rag_core.ONNX_QUANTIZE)
+    texts = [d.page_content for d in rag_core.load_documents()[:args.samples]] + [
+        "Who has the highest win rate?",
+        "Tỉ lệ thắng của người chơi cao nhất là bao nhiêu?",
+        "What is DUPR?",
+    ]
+    report = parity_check(
+        rag_core.EMBEDDING_MODEL_NAME, rag_core.ONNX_MODEL_DIR, texts,
+        quantize=rag_core.ONNX_QUANTIZE, threads=rag_core.ONNX_THREADS,
+    )
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if report["min_cosine"] < args.min_cosine:
+        print(f"❌ Cosine thấp nhất {report['min_cosine']:.4f} < {args.min_cosine}")
+        return 1
+    print("✅ ONNX khớp với PyTorch.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
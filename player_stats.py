@@ -0,0 +1,269 @@
+import re
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+from lexical import fold_diacritics
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+_VI_CHARS = set("ăâđêôơưáàảãạấầẩẫậắằẳẵặéèẻẽẹếềểễệíìỉĩịóòỏõọốồổỗộớờởỡợúùủũụứừửữựýỳỷỹỵ")
+
+
+def normalize_name(name: str) -> str:
+    """'Joaquin  Aguiar' / 'joaquín aguiar' -> 'joaquin aguiar'."""
+    return " ".join(re.findall(r"\w+", fold_diacritics(name)))
+
+
+@dataclass
+class PlayerRecord:
+    player_id: str
+    player_name: str
+    club_id: str
+    total_matches: int = 0
+    wins: int = 0
+    losses: int = 0
+    singles_wins: int = 0
+    singles_losses: int = 0
+    doubles_wins: int = 0
+    doubles_losses: int = 0
+    recent_12m_matches: int = 0
+    recent_12m_wins: int = 0
+    recent_12m_losses: int = 0
+    singles_rating_delta: Optional[float] = None
+    doubles_rating_delta: Optional[float] = None
+    top_opponents: List[dict] = field(default_factory=list)
+
+    @classmethod
+    def from_json(cls, d: dict) -> "PlayerRecord":
+        def _int(key):
+            return int(d.get(key) or 0)
+
+        def _float(key):
+            return None if d.get(key) is None else float(d[key])
+
+        return cls(
+            player_id=str(d.get("player_id")),
+            player_name=" ".join((d.get("player_name") or "N/A").split()),
+            club_id=str(d.get("club_id")),
+            total_matches=_int("total_matches"),
+            wins=_int("wins"),
+            losses=_int("losses"),
+            singles_wins=_int("singles_wins"),
+            singles_losses=_int("singles_losses"),
+            doubles_wins=_int("doubles_wins"),
+            doubles_losses=_int("doubles_losses"),
+            recent_12m_matches=_int("recent_12m_matches"),
+            recent_12m_wins=_int("recent_12m_wins"),
+            recent_12m_losses=_int("recent_12m_losses"),
+            singles_rating_delta=_float("singles_rating_delta"),
+            doubles_rating_delta=_float("doubles_rating_delta"),
+            top_opponents=list(d.get("top_opponents") or []),
+        )
+
+    @property
+    def win_rate(self) -> Optional[float]:
+        return self.wins / self.total_matches if self.total_matches else None
+
+
+# field -> (nhãn EN, nhãn VI)
+_LABELS = {
+    "doubles_rating_delta": ("doubles rating change", "thay đổi rating đôi"),
+    "singles_rating_delta": ("singles rating change", "thay đổi rating đơn"),
+    "doubles_wins": ("doubles wins", "số trận thắng đôi"),
+    "doubles_losses": ("doubles losses", "số trận thua đôi"),
+    "singles_wins": ("singles wins", "số trận thắng đơn"),
+    "singles_losses": ("singles losses", "số trận thua đơn"),
+    "win_rate": ("win rate", "tỉ lệ thắng"),
+    "recent_12m_matches": ("matches in the last 12 months", "số trận trong 12 tháng qua"),
+    "top_opponents": ("frequent opponents", "đối thủ thường gặp"),
+    "losses": ("losses", "số trận thua"),
+    "wins": ("wins", "số trận thắng"),
+    "total_matches": ("matches played", "tổng số trận"),
+}
+# (chỉ số gốc, từ khóa). Cụm cụ thể đứng trước cụm chung. Từ khóa tiếng Việt so khớp trên
+# chữ có dấu vì bỏ dấu sẽ nhập "thắng" với "tháng".
+_BASE_METRICS = [
+    ("rating_delta", ("rating", "điểm")),
+    ("win_rate", ("win rate", "winning percentage", "win percentage", "tỉ lệ thắng", "tỷ lệ thắng")),
+    ("recent_12m_matches", ("12 month", "last year", "12 tháng", "năm qua")),
+    ("top_opponents", ("opponent", "played against", "đối thủ")),
+    ("losses", ("loss", "lost", "thua")),
+    ("wins", ("win", "won", "thắng")),
+    ("total_matches", ("match", "game", "played", "trận")),
+]
+_DOUBLES = ("doubles", "double", "đôi")
+_SINGLES = ("singles", "single", "đơn")
+_SUPERLATIVE_HIGH = ("best", "highest", "most", "top", "cao nhất", "nhiều nhất", "tốt nhất", "giỏi nhất")
+_SUPERLATIVE_LOW = ("worst", "lowest", "least", "fewest", "thấp nhất", "ít nhất", "kém nhất")
+_WHO = ("who", "which", "ai", "người nào")
+_COUNT_PLAYERS = ("how many players", "how many members", "number of players",
+                  "bao nhiêu người chơi", "bao nhiêu thành viên", "số người chơi")
+_AVERAGE = ("average", "mean", "trung bình")
+_TOTAL = ("total", "sum of", "tổng")
+# Câu hỏi không nêu người chơi chỉ được trả lời từ bảng khi rõ ràng hỏi về dữ liệu CLB
+_CLUB = ("club", "clb", "câu lạc bộ", "our data", "the data", "this data", "dữ liệu")
+
+
+def _has(text: str, phrases) -> bool:
+    # Cho phép số nhiều tiếng Anh: "win" khớp "wins", "match" khớp "matches"
+    return any(re.search(rf"(?<!\w){re.escape(p)}(?:e?s)?(?!\w)", text) for p in phrases)
+
+
+def _fmt(value, metric: str) -> str:
+    if value is None:
+        return "N/A"
+    if metric == "win_rate":
+        return f"{value * 100:.1f}%"
+    if metric.endswith("rating_delta"):
+        return f"{value:+.2f}"
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return str(value)
+
+
+class PlayerTable:
+    """
+    Bảng người chơi có kiểu, index theo id và tên đã chuẩn hóa, cùng bộ định tuyến ý định
+    trả lời trực tiếp các câu hỏi tra cứu / tổng hợp / xếp hạng mà không cần RAG + LLM.
+    """
+
+    def __init__(self, records: List[PlayerRecord]):
+        self.players = records
+        # Một người chơi có thể có bản ghi ở nhiều CLB: giữ tất cả, như by_name
+        self.by_id: Dict[str, List[PlayerRecord]] = {}
+        self.by_name: Dict[str, List[PlayerRecord]] = {}
+        for p in records:
+            self.by_id.setdefault(p.player_id, []).append(p)
+            self.by_name.setdefault(normalize_name(p.player_name), []).append(p)
+        self.club_ids = {p.club_id for p in records}
+        self._by_club: Dict[str, "PlayerTable"] = {}
+
+    @classmethod
+    def from_records(cls, rows) -> "PlayerTable":
+        return cls([PlayerRecord.from_json(d) for d in rows if d.get("player_id")])
+
+    def for_club(self, club_id: Optional[str]) -> "PlayerTable":
+        """Bảng con của một CLB (dựng một lần rồi giữ lại), hoặc chính bảng này nếu không chọn CLB."""
+        if not club_id:
+            return self
+        table = self._by_club.get(club_id)
+        if table is None:
+            table = self._by_club[club_id] = PlayerTable([p for p in self.players if p.club_id == club_id])
+        return table
+
+    # --- nhận diện thực thể ---
+    def find_players(self, question: str) -> List[PlayerRecord]:
+        found = [p for t in re.findall(r"\d{6,}", question) for p in self.by_id.get(t, [])]
+        text = f" {normalize_name(question)} "
+        for name, players in self.by_name.items():
+            if f" {name} " in text:
+                found.extend(p for p in players if p not in found)
+        return found
+
+    def _mentioned_clubs(self, question: str) -> List[str]:
+        return [c for c in re.findall(r"\d{6,}", question) if c in self.club_ids]
+
+    def _club_filter(self, question: str) -> List[PlayerRecord]:
+        clubs = self._mentioned_clubs(question)
+        return [p for p in self.players if p.club_id in clubs] if clubs else self.players
+
+    @staticmethod
+    def _metric(text: str) -> Optional[Tuple[str, str, str]]:
+        """Nhận diện chỉ số được hỏi, kết hợp chỉ số gốc với đơn/đôi nếu có: (field, nhãn EN, nhãn VI)."""
+        mode = "doubles" if _has(text, _DOUBLES) else "singles" if _has(text, _SINGLES) else None
+        for base, phrases in _BASE_METRICS:
+            if not _has(text, phrases):
+                continue
+            if base == "rating_delta":
+                if mode is None:
+                    return None
+                key = f"{mode}_rating_delta"
+            elif base in ("wins", "losses") and mode:
+                key = f"{mode}_{base}"
+            else:
+                key = base
+            return (key,) + _LABELS[key]
+        return None
+
+    # --- định tuyến ---
+    def answer(self, question: str, has_history: bool = False) -> Optional[Tuple[str, List[PlayerRecord]]]:
+        """
+        Trả về (câu trả lời, người chơi liên quan) nếu câu hỏi thuộc dạng trả lời được bằng bảng.
+        `has_history`: câu hỏi nằm trong một cuộc hội thoại; khi đó câu không nêu người chơi
+        ("Ai thắng nhiều nhất?") có thể nói về chủ đề trước đó nên để RAG xử lý.
+        """
+        text = " ".join(re.findall(r"\w+", question.lower()))
+        vi = any(ch in _VI_CHARS for ch in text)
+        players = self.find_players(question)
+        metric = self._metric(text)
+
+        if players and metric and len(players) == 1:
+            return self._lookup(players[0], metric, vi), players
+        if players or has_history or not self.players:
+            return None
+        # Đếm / xếp hạng / tổng hợp không có người chơi cụ thể: "Ai thắng nhiều nhất giải MLP?" là câu hỏi
+        # chung về pickleball, chỉ trả lời từ bảng khi câu hỏi nêu CLB (ID hoặc từ "CLB"/"club"/"dữ liệu")
+        if not (self._mentioned_clubs(question) or _has(text, _CLUB)):
+            return None
+
+        pool = self._club_filter(question)
+        if _has(text, _COUNT_PLAYERS):
+            return (f"Có {len(pool)} người chơi trong dữ liệu." if vi
+                    else f"There are {len(pool)} players in the data."), []
+        if metric is None or metric[0] == "top_opponents":
+            return None
+        if _has(text, _SUPERLATIVE_HIGH + _SUPERLATIVE_LOW) and (_has(text, _WHO) or re.search(r"\btop \d+", text)):
+            return self._ranking(pool, metric, text, vi)
+        if _has(text, _AVERAGE + _TOTAL):
+            return self._aggregate(pool, metric, text, vi), []
+        return None
+
+    def _lookup(self, p: PlayerRecord, metric: Tuple[str, str, str], vi: bool) -> str:
+        key, en, vi_label = metric
+        if key == "top_opponents":
+            opponents = ", ".join(f"{o.get('name')} ({o.get('count')})" for o in p.top_opponents) or "N/A"
+            return f"{vi_label.capitalize()} của {p.player_name}: {opponents}." if vi \
+                else f"{p.player_name}'s {en}: {opponents}."
+        value = _fmt(getattr(p, key), key)
+        detail = f" (W/L: {p.wins}/{p.losses}, {p.total_matches})"
+        if vi:
+            return f"{vi_label.capitalize()} của {p.player_name} (ID {p.player_id}): {value}.{detail if key == 'win_rate' else ''}"
+        return f"{p.player_name} (ID {p.player_id}) — {en}: {value}.{detail if key == 'win_rate' else ''}"
+
+    def _ranking(self, pool, metric, text: str, vi: bool):
+        key, en, vi_label = metric
+        low = _has(text, _SUPERLATIVE_LOW)
+        top_n = re.search(r"\btop (\d+)", text)
+        n = min(int(top_n.group(1)), 20) if top_n else 1
+        candidates = [p for p in pool if getattr(p, key) is not None]
+        # Tỉ lệ thắng chỉ xét người chơi có ít nhất 5 trận để tránh 1/1 = 100%
+        if key == "win_rate":
+            candidates = [p for p in candidates if p.total_matches >= 5] or candidates
+        ranked = sorted(candidates, key=lambda p: getattr(p, key), reverse=not low)[:n]
+        if not ranked:
+            return None
+        lines = [f"{i}. {p.player_name} (ID {p.player_id}): {_fmt(getattr(p, key), key)}" for i, p in enumerate(ranked, 1)]
+        order = ("thấp nhất" if low else "cao nhất") if vi else ("lowest" if low else "highest")
+        title = f"Người chơi có {vi_label} {order}:" if vi else f"Players with the {order} {en}:"
+        return "\n".join([title] + lines), ranked
+
+    def _aggregate(self, pool, metric, text: str, vi: bool) -> str:
+        key, en, vi_label = metric
+        values = [getattr(p, key) for p in pool if getattr(p, key) is not None]
+        if _has(text, _AVERAGE):
+            value, label_en, label_vi = (sum(values) / len(values) if values else None), "average", "trung bình"
+        else:
+            value, label_en, label_vi = sum(values), "total", "tổng"
+        value = _fmt(value, key)
+        return (f"{vi_label.capitalize()} {label_vi} của {len(values)} người chơi: {value}." if vi
+                else f"{label_en.capitalize()} {en} across {len(values)} players: {value}.")
+
+    @staticmethod
+    def to_document(p: PlayerRecord) -> "Document":
+        from langchain_core.documents import Document
+
+        return Document(
+            page_content=f"{p.player_name} (ID {p.player_id}), CLB {p.club_id}: "
+                         f"{p.total_matches} trận, {p.wins} thắng / {p.losses} thua.",
+            metadata={"source": "player_stats", "player_id": p.player_id, "player_name": p.player_name},
+        )
@@ -1,25 +1,151 @@
 import os
 import json
-from typing import List
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain_community.docstore.document import Document
-from langchain_groq import ChatGroq
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import HumanMessage, AIMessage
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
+import asyncio
+import logging
+import re
+import time
+import glob
+import hashlib
+import threading
+import unicodedata
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 from dotenv import load_dotenv
+from llm_scheduler import BATCH, LLMScheduler, llm_priority
+from lexical import BM25Index, tokenize
+from player_stats import PlayerTable
+from metrics import count_cache, count_context_tokens, count_docs, span
+from sessions import SessionStore
+
+# Import rag_core phải nhẹ (pod live trong < 1s): numpy, langchain_core, prometheus_client, torch, chromadb
+# chỉ được import trong hàm dùng tới chúng, phần lớn ở luồng khởi động nền (build_generation)
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
 
 load_dotenv()  # nạp biến môi trường từ .env nếu có
+logger = logging.getLogger("rag_core")
 
 # --- Config qua ENV (có default) ---
-TARGET_CLUB_ID = os.getenv("TARGET_CLUB_ID", "5380169465")
-SUMMARIES_JSONL = os.getenv("SUMMARIES_JSONL", f"player_summaries_{TARGET_CLUB_ID}.jsonl")
+# Nhiều CLB trong một process: mọi file player summary khớp SUMMARIES_JSONL (glob, có thể nhiều mẫu cách
+# nhau bởi dấu phẩy) vào chung một chỉ mục, gắn metadata club_id; blog dùng chung cho mọi CLB.
+# TARGET_CLUB_ID (tùy chọn): CLB mặc định khi request không chọn CLB ("" = tất cả).
+TARGET_CLUB_ID = os.getenv("TARGET_CLUB_ID", "")
+ALL_CLUBS = "*"  # club_id của request để hỏi trên mọi CLB, bỏ qua TARGET_CLUB_ID
+SUMMARIES_JSONL = os.getenv(
+    "SUMMARIES_JSONL", f"player_summaries_{TARGET_CLUB_ID}.jsonl" if TARGET_CLUB_ID else "player_summaries_*.jsonl"
+)
 BLOGS_JSONL = os.getenv("BLOGS_JSONL", "blog_posts_detail.jsonl")
 EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2")
 LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", "llama3-8b-8192")
+# Model (nhỏ/nhanh) dùng riêng cho bước viết lại câu hỏi theo lịch sử hội thoại
+REWRITE_MODEL_NAME = os.getenv("REWRITE_MODEL_NAME", LLM_MODEL_NAME)
+REWRITE_MAX_TOKENS = int(os.getenv("REWRITE_MAX_TOKENS", "96"))
+# "groq" hoặc "fake" (model giả lập cho load test / CI không có mạng, không cần GROQ_API_KEY)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "groq").lower()
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "300"))
+FAKE_LLM_TOKENS_PER_S = float(os.getenv("FAKE_LLM_TOKENS_PER_S", "200"))
+FAKE_LLM_REPLY_TOKENS = int(os.getenv("FAKE_LLM_REPLY_TOKENS", "80"))
+FAKE_LLM_STREAM = os.getenv("FAKE_LLM_STREAM", "1") == "1"
 PERSIST_DIRECTORY = os.getenv("PERSIST_DIRECTORY", "chroma_db_dupr")
+COLLECTION_NAME = os.getenv("COLLECTION_NAME", "langchain")
+MANIFEST_PATH = os.getenv("MANIFEST_PATH", os.path.join(PERSIST_DIRECTORY, "ingest_manifest.json"))
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "256"))
+# Chunking blog: all-MiniLM-L6-v2 cắt input ở 256 word piece. CHUNK_SIZE_TOKENS=0 để tắt chunking.
+CHUNK_SIZE_TOKENS = int(os.getenv("CHUNK_SIZE_TOKENS", "240"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+# Khử trùng lặp blog: khoảng cách Hamming SimHash tối đa để coi là bản sao gần giống (-1 để tắt)
+NEAR_DUP_MAX_HAMMING = int(os.getenv("NEAR_DUP_MAX_HAMMING", "3"))
+# Giới hạn đồng thời theo từng stage cho đường async (số luồng encode câu hỏi, truy vấn Chroma, gọi LLM)
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "2"))
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", "4"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "64"))
+# Truy hồi lai BM25 + vector, gộp bằng reciprocal-rank fusion
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", os.path.join(PERSIST_DIRECTORY, "bm25_index.json"))
+# Snapshot chỉ mục dựng sẵn (python snapshot.py export): mở read-only bằng mmap thay cho ChromaDB
+INDEX_SNAPSHOT = os.getenv("INDEX_SNAPSHOT", "")
+# Backend tìm kiếm vector: "numpy" (ma trận trong RAM, top-k chính xác) hoặc "chroma" (HNSW + SQLite).
+# ChromaDB vẫn là nơi lưu trữ / đồng bộ tăng dần; "numpy" nạp các vector từ đó khi khởi động.
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "numpy").lower()
+# Reload nóng: chu kỳ (giây) kiểm tra file corpus đổi, 0 để tắt (vẫn reload được qua POST /admin/reload)
+RELOAD_WATCH_INTERVAL = float(os.getenv("RELOAD_WATCH_INTERVAL", "10"))
+# Token cho các endpoint /admin (header X-Admin-Token); "" = không kiểm tra
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# Độ sâu truy hồi theo từng request và đóng gói context theo ngân sách token
+DEFAULT_TOP_K = int(os.getenv("DEFAULT_TOP_K", "5"))
+MAX_TOP_K = int(os.getenv("MAX_TOP_K", "20"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_MIN_SIMILARITY = float(os.getenv("CONTEXT_MIN_SIMILARITY", "0.25"))
+# Dạng tài liệu đưa vào prompt: "compact" (gọn, bỏ thông tin lặp theo từng loại nguồn) hoặc "raw" (page_content
+# dùng để embed). PROMPT_COMPRESSION=1: chỉ giữ các câu liên quan đến câu hỏi của tài liệu blog dài
+PROMPT_RENDERING = os.getenv("PROMPT_RENDERING", "compact").lower()
+PROMPT_COMPRESSION = os.getenv("PROMPT_COMPRESSION", "0") == "1"
+PROMPT_COMPRESS_MAX_SENTENCES = int(os.getenv("PROMPT_COMPRESS_MAX_SENTENCES", "4"))
+PROMPT_COMPRESS_MIN_TOKENS = int(os.getenv("PROMPT_COMPRESS_MIN_TOKENS", "80"))
+# Trả lời trực tiếp câu hỏi thống kê người chơi từ bảng dữ liệu, không qua RAG + LLM
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "1") == "1"
+# Cache embedding câu hỏi (LRU + SQLite, "" để tắt lưu đĩa) và gom batch các câu hỏi đồng thời
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(PERSIST_DIRECTORY, "query_embeddings.sqlite"))
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "32"))
+# Cache câu trả lời theo ngữ nghĩa của câu hỏi độc lập (standalone question)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+# Backend embedding: "torch" (HuggingFaceEmbeddings) hoặc "onnx" (onnxruntime trên CPU, tùy chọn int8)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", os.path.join("onnx_models", EMBEDDING_MODEL_NAME.replace("/", "__")))
+ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "1") == "1"
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # 0 = mặc định của onnxruntime
+
+# Phiên hội thoại phía server: LRU + TTL, ngân sách token cho lịch sử, tóm tắt cuốn chiếu các lượt cũ
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "86400"))
+SESSION_TOKEN_BUDGET = int(os.getenv("SESSION_TOKEN_BUDGET", "1000"))
+SESSION_SUMMARY_TOKENS = int(os.getenv("SESSION_SUMMARY_TOKENS", "200"))
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "")  # vd. chroma_db_dupr/sessions.sqlite, "" = chỉ trong bộ nhớ
+
+# Batch câu hỏi (/chat/batch, batch.py) và gộp các request /chat giống nhau đang chạy đồng thời
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "1") == "1"
+
+# Kiểm soát nhận request ở server.py (0 = không giới hạn): số request /chat xử lý đồng thời (toàn cục, theo client),
+# hàng đợi có giới hạn và hạn chót chờ; kích thước request được kiểm tra trước mọi bước embed
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "32"))
+ADMISSION_PER_CLIENT = int(os.getenv("ADMISSION_PER_CLIENT", "4"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_QUEUE_TIMEOUT_S = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_S", "10"))
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", "1000000"))
+MAX_MESSAGE_CHARS = int(os.getenv("MAX_MESSAGE_CHARS", "2000"))
+MAX_HISTORY_TURNS = int(os.getenv("MAX_HISTORY_TURNS", "50"))
+MAX_HISTORY_CHARS = int(os.getenv("MAX_HISTORY_CHARS", "20000"))
+
+# Điều phối lời gọi LLM (llm_scheduler.py): hạn mức mỗi model (0 = không giới hạn), phần token chừa cho
+# request tương tác khi chạy batch, thử lại có jitter, hedging sang model dự phòng, pool kết nối HTTP dùng chung
+LLM_RPM = float(os.getenv("LLM_RPM", "0"))
+LLM_TPM = float(os.getenv("LLM_TPM", "0"))
+LLM_BATCH_RESERVE = float(os.getenv("LLM_BATCH_RESERVE", "0.2"))
+LLM_EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "300"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_RETRY_BASE_S = float(os.getenv("LLM_RETRY_BASE_S", "0.5"))
+LLM_RETRY_MAX_S = float(os.getenv("LLM_RETRY_MAX_S", "8"))
+LLM_HEDGE_AFTER_S = float(os.getenv("LLM_HEDGE_AFTER_S", "0"))  # 0 = tắt hedging
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "")
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+LLM_HTTP_KEEPALIVE = int(os.getenv("LLM_HTTP_KEEPALIVE", "20"))
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "60"))
+GROQ_API_BASE = os.getenv("GROQ_API_BASE", "")  # vd. http://127.0.0.1:9000 (groq_standin.py)
 
 # --- Prompt templates ---
 CONTEXTUALIZE_PROMPT_TEMPLATE = """
@@ -36,6 +162,20 @@ Follow Up Input:
 Standalone question:
 """
 
+SUMMARY_PROMPT_TEMPLATE = """
+Update the running summary of a conversation between a user and a pickleball / DUPR assistant.
+Keep names, player IDs, numbers and the topics asked about. Reply with the updated summary only,
+at most a few sentences, in the language of the conversation.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}
+
+Updated summary:
+"""
+
 QA_PROMPT_TEMPLATE = """
 Bạn là một trợ lý AI chuyên gia về Pickleball và hệ thống xếp hạng DUPR.
 Nhiệm vụ của bạn là sử dụng những thông tin trong mục "Context" dưới đây để trả lời câu hỏi của người dùng một cách chính xác, chi tiết và thân thiện.
@@ -50,101 +190,1573 @@ Question:
 Answer:
 """
 
-def _load_jsonl_docs(path: str, build_doc_fn) -> List[Document]:
-    docs: List[Document] = []
+def _stable_id(prefix: str, key) -> str:
+    return f"{prefix}:{hashlib.sha1(str(key).encode('utf-8')).hexdigest()[:16]}"
+
+def _content_hash(doc: "Document") -> str:
+    payload = json.dumps(
+        {"page_content": doc.page_content, "metadata": doc.metadata},
+        sort_keys=True, ensure_ascii=False, default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _clean_metadata(metadata: dict) -> dict:
+    # Chroma chỉ nhận str/int/float/bool, bỏ các giá trị None
+    return {k: v for k, v in metadata.items() if v is not None}
+
+def _read_jsonl(path: str) -> Iterator[dict]:
     if not os.path.exists(path):
         print(f"⚠️  Không tìm thấy file: {path}")
-        return docs
+        return
     with open(path, "r", encoding="utf-8") as f:
         for line in f:
             try:
-                data = json.loads(line)
+                yield json.loads(line)
             except json.JSONDecodeError:
                 continue
-            doc = build_doc_fn(data)
-            if doc:
-                docs.append(doc)
-    return docs
 
-def load_documents() -> List[Document]:
-    # Player summaries
-    player_docs = _load_jsonl_docs(
-        SUMMARIES_JSONL,
-        lambda d: Document(
-            page_content=(
-                f"Tóm tắt người chơi: {d.get('player_name','N/A')}\n"
-                f"ID người chơi: {d.get('player_id')}\n"
-                f"ID Câu lạc bộ: {d.get('club_id')}\n"
-                f"Tổng số trận: {d.get('total_matches')}\n"
-                f"Thắng/Thua: {d.get('wins')}/{d.get('losses')}\n"
-                f"Thành tích Đơn: {d.get('singles_wins')} thắng - {d.get('singles_losses')} thua\n"
-                f"Thành tích Đôi: {d.get('doubles_wins')} thắng - {d.get('doubles_losses')} thua\n"
-                f"Tóm tắt chi tiết: {d.get('summary')}"
-            ),
-            metadata={
-                "source": "player_summary",
-                "player_id": d.get("player_id"),
-                "player_name": d.get("player_name"),
-            },
+def _iter_jsonl_docs(path: str, build_doc_fn, id_fn, dedupe_fn=None) -> Iterator["Document"]:
+    """
+    Đọc file JSONL thành Document theo luồng (không giữ cả file trong bộ nhớ), mỗi Document có
+    `metadata["doc_id"]` ổn định (id_fn(record)) để đồng bộ chỉ mục theo từng bản ghi.
+    Bản ghi trùng id chỉ giữ bản đầu tiên.
+    build_doc_fn có thể trả về một list Document (các chunk của cùng bản ghi): chunk thứ i
+    nhận id `<parent>#<i>` và `metadata["parent_id"]`.
+    dedupe_fn (tùy chọn) lọc/chuẩn hóa luồng bản ghi trước khi dựng Document.
+    """
+    seen = set()
+    records = _read_jsonl(path)
+    if dedupe_fn:
+        records = dedupe_fn(records)
+    for data in records:
+        doc_id = id_fn(data) or _stable_id("doc", json.dumps(data, sort_keys=True, ensure_ascii=False))
+        if doc_id in seen:
+            continue
+        seen.add(doc_id)
+        built = build_doc_fn(data)
+        if not built:
+            continue
+        if isinstance(built, list):
+            for i, chunk in enumerate(built):
+                chunk.metadata = _clean_metadata(
+                    {**chunk.metadata, "doc_id": f"{doc_id}#{i}", "parent_id": doc_id}
+                )
+                yield chunk
+        else:
+            built.metadata = _clean_metadata({**built.metadata, "doc_id": doc_id})
+            yield built
+
+def _load_jsonl_docs(path: str, build_doc_fn, id_fn, dedupe_fn=None) -> List["Document"]:
+    return list(_iter_jsonl_docs(path, build_doc_fn, id_fn, dedupe_fn))
+
+# --- Khử trùng lặp & chuẩn hóa bản ghi ---
+_TRACKING_PARAMS = {"fbclid", "gclid", "mc_cid", "mc_eid", "ref"}
+_ZERO_WIDTH_RE = re.compile("[\u200b\u200c\u200d\u2060\ufeff]")
+
+def canonical_url(url: str) -> str:
+    """Chuẩn hóa URL: scheme/host chữ thường, bỏ fragment, tham số tracking và dấu '/' cuối."""
+    parts = urlsplit(url.strip())
+    query = urlencode(sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not (k.lower().startswith("utm_") or k.lower() in _TRACKING_PARAMS)
+    ))
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, query, ""))
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text or "")
+    text = _ZERO_WIDTH_RE.sub("", text)
+    return " ".join(text.split())
+
+def _content_fingerprint(text: str) -> str:
+    return hashlib.sha1(normalize_text(text).lower().encode("utf-8")).hexdigest()
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    """SimHash 64-bit trên shingle từ; văn bản gần giống nhau cho khoảng cách Hamming nhỏ."""
+    words = re.findall(r"\w+", normalize_text(text).lower())
+    shingles = [" ".join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))]
+    bits = [
+        format(int.from_bytes(hashlib.blake2b(sh.encode("utf-8"), digest_size=8).digest(), "big"), "064b")
+        for sh in set(shingles)
+    ]
+    # Cột i của zip(*bits) là bit thứ (63 - i) của mọi shingle
+    signature = "".join("1" if col.count("1") * 2 > len(bits) else "0" for col in zip(*bits))
+    return int(signature, 2)
+
+def simhash_bands(max_hamming: int) -> List[Tuple[int, int]]:
+    """
+    Chia SimHash 64 bit thành max_hamming + 1 dải (shift, mask): hai chữ ký cách nhau <= max_hamming bit
+    chắc chắn trùng nhau ở ít nhất một dải (nguyên lý Dirichlet). Ngưỡng càng lớn dải càng hẹp, nhiều ứng viên hơn.
+    """
+    n = min(max(max_hamming, 0) + 1, 64)
+    edges = [64 * i // n for i in range(n + 1)]
+    return [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(edges, edges[1:])]
+
+def dedupe_records(records: Iterable[dict], url_key: str = "url", text_key: str = "content") -> Iterator[dict]:
+    """
+    Chuẩn hóa và khử trùng lặp luồng bản ghi theo thứ tự xuất hiện (giữ bản đầu tiên):
+    - trùng URL sau khi chuẩn hóa,
+    - trùng nội dung sau khi chuẩn hóa (fingerprint),
+    - gần giống (SimHash, Hamming <= NEAR_DUP_MAX_HAMMING), ví dụ bài đăng lại ở nơi khác.
+    Chỉ giữ URL/fingerprint/SimHash của bản ghi đã gặp, không giữ bản ghi.
+    In ra số lượng bản ghi bị loại theo từng lý do khi luồng kết thúc.
+    """
+    kept = 0
+    seen_urls, seen_fingerprints = set(), set()
+    band_layout = simhash_bands(NEAR_DUP_MAX_HAMMING)
+    bands: Dict[Tuple[int, int], List[int]] = {}
+    stats = {"total": 0, "duplicate_url": 0, "duplicate_content": 0, "near_duplicate": 0}
+
+    for record in records:
+        stats["total"] += 1
+        record = dict(record)
+        if record.get(url_key):
+            record[url_key] = canonical_url(record[url_key])
+        for key in ("title", "summary"):
+            if isinstance(record.get(key), str):
+                record[key] = normalize_text(record[key])
+
+        url = record.get(url_key)
+        if url and url in seen_urls:
+            stats["duplicate_url"] += 1
+            continue
+        fingerprint = _content_fingerprint(record.get(text_key) or "")
+        if fingerprint in seen_fingerprints:
+            stats["duplicate_content"] += 1
+            continue
+
+        if NEAR_DUP_MAX_HAMMING >= 0:
+            sig = simhash(record.get(text_key) or "")
+            band_keys = [(shift, sig >> shift & mask) for shift, mask in band_layout]
+            candidates = {c for key in band_keys for c in bands.get(key, [])}
+            if any(bin(sig ^ c).count("1") <= NEAR_DUP_MAX_HAMMING for c in candidates):
+                stats["near_duplicate"] += 1
+                continue
+            for key in band_keys:
+                bands.setdefault(key, []).append(sig)
+
+        if url:
+            seen_urls.add(url)
+        seen_fingerprints.add(fingerprint)
+        kept += 1
+        yield record
+
+    dropped = stats["total"] - kept
+    print(
+        f"🧹 Khử trùng lặp: giữ {kept}/{stats['total']} bản ghi, loại {dropped} "
+        f"(URL: {stats['duplicate_url']}, nội dung: {stats['duplicate_content']}, "
+        f"gần giống: {stats['near_duplicate']})."
+    )
+
+# --- Chunking ---
+_PARAGRAPH_RE = re.compile(r"[^\n]+(?:\n(?!\s*\n)[^\n]*)*")
+_SENTENCE_RE = re.compile(r"[^.!?。]+(?:[.!?。]+|$)")
+
+@lru_cache(maxsize=1)
+def _get_tokenizer():
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME)
+    except Exception as e:
+        print(f"⚠️  Không tải được tokenizer ({e}), ước lượng token theo số từ.")
+        return None
+
+def count_tokens(text: str) -> int:
+    tokenizer = _get_tokenizer()
+    if tokenizer is None:
+        return int(len(text.split()) * 1.3) + 1
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+def _split_units(text: str, max_tokens: int) -> List[Tuple[int, int, int]]:
+    """
+    Tách text thành các đơn vị (start, end, tokens): ưu tiên đoạn văn, đoạn quá dài
+    tách theo câu, câu quá dài tách theo cửa sổ từ.
+    """
+    units = []
+    for para in _PARAGRAPH_RE.finditer(text):
+        if not para.group().strip():
+            continue
+        n = count_tokens(para.group())
+        if n <= max_tokens:
+            units.append((para.start(), para.end(), n))
+            continue
+        for sent in _SENTENCE_RE.finditer(text, para.start(), para.end()):
+            if not sent.group().strip():
+                continue
+            n = count_tokens(sent.group())
+            if n <= max_tokens:
+                units.append((sent.start(), sent.end(), n))
+                continue
+            words = list(re.finditer(r"\S+", sent.group()))
+            step = max(1, int(max_tokens / 1.5))
+            for w in range(0, len(words), step):
+                window = words[w:w + step]
+                start, end = sent.start() + window[0].start(), sent.start() + window[-1].end()
+                units.append((start, end, count_tokens(text[start:end])))
+    return units
+
+def split_text(text: str, chunk_tokens: int, overlap_tokens: int) -> List[Tuple[int, str]]:
+    """Gom các đơn vị liên tiếp thành chunk <= chunk_tokens, chồng lấn ~overlap_tokens. Trả về (offset, chunk)."""
+    units = _split_units(text, chunk_tokens)
+    chunks: List[Tuple[int, str]] = []
+    i = 0
+    while i < len(units):
+        j, total = i, 0
+        while j < len(units) and (j == i or total + units[j][2] <= chunk_tokens):
+            total += units[j][2]
+            j += 1
+        chunks.append((units[i][0], text[units[i][0]:units[j - 1][1]]))
+        if j >= len(units):
+            break
+        # Lùi lại vài đơn vị cuối để tạo phần chồng lấn, nhưng luôn tiến ít nhất một đơn vị
+        k, overlap = j, 0
+        while k - 1 > i and overlap + units[k - 1][2] <= overlap_tokens:
+            k -= 1
+            overlap += units[k][2]
+        i = k
+    return chunks
+
+def _blog_header(d: dict) -> str:
+    return f"Tiêu đề bài blog: {d.get('title')}\nNgày đăng: {d.get('date')}\nNội dung: "
+
+def _build_blog_docs(d: dict):
+    from langchain_core.documents import Document
+    header = _blog_header(d)
+    content = _ZERO_WIDTH_RE.sub("", d.get("content") or "")
+    metadata = {
+        "source": "blog",
+        "url": d.get("url"),
+        "title": d.get("title"),
+        "date": d.get("date"),
+    }
+    if CHUNK_SIZE_TOKENS <= 0:
+        return Document(page_content=header + content, metadata=metadata)
+
+    body_tokens = max(32, CHUNK_SIZE_TOKENS - count_tokens(header))
+    pieces = split_text(content, body_tokens, CHUNK_OVERLAP_TOKENS) or [(0, content)]
+    return [
+        Document(
+            page_content=header + chunk,
+            metadata={**metadata, "chunk_index": i, "chunk_offset": offset, "chunk_count": len(pieces)},
         )
+        for i, (offset, chunk) in enumerate(pieces)
+    ]
+
+def merge_parent_chunks(docs: List["Document"]) -> List["Document"]:
+    """
+    Gộp các chunk cùng bài (parent_id) đã được truy hồi thành một Document trước khi nhồi vào prompt.
+    Giữ thứ tự theo lần xuất hiện đầu tiên của mỗi bài; các chunk liền kề bỏ phần chồng lấn.
+    """
+    from langchain_core.documents import Document
+    groups: Dict[str, List[Document]] = {}
+    order = []
+    for doc in docs:
+        key = doc.metadata.get("parent_id") or doc.metadata.get("doc_id") or id(doc)
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(doc)
+
+    merged = []
+    for key in order:
+        group = groups[key]
+        if len(group) == 1:
+            merged.append(group[0])
+            continue
+        group = sorted(group, key=lambda d: d.metadata.get("chunk_offset", 0))
+        header, _, _ = group[0].page_content.partition("Nội dung: ")
+        body, end = "", None
+        for chunk in group:
+            text = chunk.page_content.partition("Nội dung: ")[2]
+            offset = chunk.metadata.get("chunk_offset", 0)
+            if end is None:
+                body = text
+            elif offset <= end:
+                body += text[end - offset:]
+            else:
+                body += "\n[...]\n" + text
+            end = offset + len(text) if end is None else max(end, offset + len(text))
+        metadata = {k: v for k, v in group[0].metadata.items() if k not in ("doc_id", "chunk_index", "chunk_offset")}
+        metadata["chunk_indices"] = [c.metadata.get("chunk_index") for c in group]
+        similarities = [c.metadata["similarity"] for c in group if c.metadata.get("similarity") is not None]
+        if similarities:
+            metadata["similarity"] = max(similarities)
+        merged.append(Document(page_content=f"{header}Nội dung: {body}", metadata=metadata))
+    return merged
+
+def _build_player_doc(d: dict) -> "Document":
+    from langchain_core.documents import Document
+    return Document(
+        page_content=(
+            f"Tóm tắt người chơi: {d.get('player_name','N/A')}\n"
+            f"ID người chơi: {d.get('player_id')}\n"
+            f"ID Câu lạc bộ: {d.get('club_id')}\n"
+            f"Tổng số trận: {d.get('total_matches')}\n"
+            f"Thắng/Thua: {d.get('wins')}/{d.get('losses')}\n"
+            f"Thành tích Đơn: {d.get('singles_wins')} thắng - {d.get('singles_losses')} thua\n"
+            f"Thành tích Đôi: {d.get('doubles_wins')} thắng - {d.get('doubles_losses')} thua\n"
+            f"Tóm tắt chi tiết: {d.get('summary')}"
+        ),
+        metadata={
+            "source": "player_summary",
+            "player_id": d.get("player_id"),
+            "player_name": d.get("player_name"),
+            "club_id": str(d["club_id"]) if d.get("club_id") is not None else None,
+        },
     )
 
-    # Blog posts
-    blog_docs = _load_jsonl_docs(
-        BLOGS_JSONL,
-        lambda d: Document(
-            page_content=(
-                f"Tiêu đề bài blog: {d.get('title')}\n"
-                f"Ngày đăng: {d.get('date')}\n"
-                f"Nội dung: {d.get('content')}"
-            ),
-            metadata={
-                "source": "blog",
-                "url": d.get("url"),
-                "title": d.get("title"),
-            },
+def summary_paths() -> List[str]:
+    """Các file player summary (mỗi CLB một file), sắp theo tên để thứ tự corpus ổn định."""
+    paths = set()
+    for pattern in SUMMARIES_JSONL.split(","):
+        pattern = pattern.strip()
+        if pattern:
+            paths.update(glob.glob(pattern) if glob.has_magic(pattern) else [pattern])
+    return sorted(paths)
+
+def iter_player_records() -> Iterator[dict]:
+    for path in summary_paths():
+        yield from _read_jsonl(path)
+
+def iter_documents() -> Iterator["Document"]:
+    """Luồng Document của toàn bộ corpus (player summaries của mọi CLB rồi các chunk blog), thứ tự ổn định."""
+    for path in summary_paths():
+        # Cùng một người chơi có thể thuộc nhiều CLB: id gồm cả CLB
+        yield from _iter_jsonl_docs(
+            path,
+            _build_player_doc,
+            lambda d: f"player:{d.get('club_id')}:{d['player_id']}" if d.get("player_id") else None,
         )
+    # Blog posts (mỗi bài được chia thành nhiều chunk)
+    yield from _iter_jsonl_docs(
+        BLOGS_JSONL,
+        _build_blog_docs,
+        lambda d: _stable_id("blog", d["url"]) if d.get("url") else None,
+        dedupe_records,
     )
 
-    docs = player_docs + blog_docs
-    print(f"✅ Đã tải {len(player_docs)} tài liệu player + {len(blog_docs)} tài liệu blog (tổng {len(docs)}).")
+def load_documents() -> List["Document"]:
+    docs = list(iter_documents())
+    n_players = sum(1 for d in docs if d.metadata.get("source") == "player_summary")
+    print(f"✅ Đã tải {n_players} tài liệu player + {len(docs) - n_players} chunk blog (tổng {len(docs)}).")
     return docs
 
-def build_rag_chain():
-    docs = load_documents()
-    if not docs:
-        raise RuntimeError("❌ Không có tài liệu nào để lập chỉ mục. Hãy kiểm tra các file .jsonl.")
+# --- Đồng bộ chỉ mục tăng dần ---
+def _load_manifest() -> dict:
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+def _save_manifest(manifest: dict) -> None:
+    os.makedirs(os.path.dirname(MANIFEST_PATH) or ".", exist_ok=True)
+    tmp_path = f"{MANIFEST_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+def _open_vector_store(embeddings):
+    from langchain_community.vectorstores import Chroma
+    return Chroma(
+        collection_name=COLLECTION_NAME,
+        embedding_function=embeddings,
+        persist_directory=PERSIST_DIRECTORY,
+    )
+
+def load_lexical_index(docs: List["Document"]) -> BM25Index:
+    """Mở chỉ mục BM25 đã lưu nếu cùng phiên bản với chỉ mục vector, ngược lại dựng lại và lưu."""
+    version = _load_manifest().get("version")
+    index = BM25Index.load(LEXICAL_INDEX_PATH)
+    if index is None or index.version != version:
+        index = BM25Index.build(docs, version)
+        index.save(LEXICAL_INDEX_PATH)
+        print(f"✅ Đã dựng chỉ mục BM25 ({len(docs)} tài liệu).")
+    return index
+
+def embedding_model_id() -> str:
+    """Định danh vector: model + backend. Vector ONNX int8 lệch nhẹ so với PyTorch nên không dùng lẫn chỉ mục."""
+    if EMBEDDING_BACKEND == "onnx":
+        return f"{EMBEDDING_MODEL_NAME}@onnx{'-int8' if ONNX_QUANTIZE else ''}"
+    return EMBEDDING_MODEL_NAME
+
+def make_embeddings():
+    """Model embedding gốc theo EMBEDDING_BACKEND (import nặng chỉ xảy ra khi gọi)."""
+    if EMBEDDING_BACKEND == "onnx":
+        from onnx_embeddings import OnnxEmbeddings, export_onnx, model_path
+        if not os.path.exists(model_path(ONNX_MODEL_DIR, ONNX_QUANTIZE)):
+            print(f"⚠️  Chưa có model ONNX tại '{ONNX_MODEL_DIR}', đang xuất từ {EMBEDDING_MODEL_NAME}...")
+            export_onnx(EMBEDDING_MODEL_NAME, ONNX_MODEL_DIR, quantize=ONNX_QUANTIZE)
+        return OnnxEmbeddings(ONNX_MODEL_DIR, quantize=ONNX_QUANTIZE, threads=ONNX_THREADS)
+    if EMBEDDING_BACKEND != "torch":
+        raise ValueError(f"EMBEDDING_BACKEND không hợp lệ: {EMBEDDING_BACKEND!r} (torch | onnx)")
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+
+def index_version(doc_hashes) -> str:
+    """
+    Phiên bản chỉ mục: đổi khi model embedding hoặc bất kỳ tài liệu nào thay đổi.
+    doc_hashes: dict doc_id -> hash, hoặc luồng cặp (doc_id, hash) đã sắp theo doc_id (ingest lớn).
+    """
+    digest = hashlib.sha256(embedding_model_id().encode("utf-8"))
+    items = sorted(doc_hashes.items()) if isinstance(doc_hashes, dict) else doc_hashes
+    for doc_id, doc_hash in items:
+        digest.update(f"{doc_id}={doc_hash}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+def sync_vector_store(docs: List["Document"], embeddings):
+    """
+    Mở lại collection đã lưu và chỉ embed các tài liệu mới/thay đổi, xóa tài liệu đã biến mất.
+    Manifest (doc_id -> content hash) được lưu cạnh ChromaDB để lần khởi động sau so sánh.
+    """
+    vector_store = _open_vector_store(embeddings)
+    manifest = _load_manifest()
+    indexed: Dict[str, str] = manifest.get("docs", {})
+
+    # Manifest thiếu, đổi model embedding hoặc lệch với collection -> dựng lại từ đầu
+    if (
+        manifest.get("embedding_model") != embedding_model_id()
+        or vector_store._collection.count() != len(indexed)
+    ):
+        if vector_store._collection.count():
+            print("⚠️  Manifest không khớp với ChromaDB, dựng lại chỉ mục từ đầu...")
+        vector_store.delete_collection()
+        vector_store = _open_vector_store(embeddings)
+        indexed = {}
+
+    current = {d.metadata["doc_id"]: (d, _content_hash(d)) for d in docs}
+    stale_ids = [i for i, h in indexed.items() if i not in current or current[i][1] != h]
+    new_ids = [i for i, (_, h) in current.items() if indexed.get(i) != h]
+
+    if stale_ids:
+        vector_store.delete(ids=stale_ids)
+    for start in range(0, len(new_ids), INDEX_BATCH_SIZE):
+        batch_ids = new_ids[start:start + INDEX_BATCH_SIZE]
+        vector_store.add_documents([current[i][0] for i in batch_ids], ids=batch_ids)
+
+    doc_hashes = {i: h for i, (_, h) in current.items()}
+    _save_manifest({
+        "embedding_model": embedding_model_id(),
+        "version": index_version(doc_hashes),
+        "docs": doc_hashes,
+    })
+    print(
+        f"✅ Đồng bộ chỉ mục: +{len(new_ids)} mới/cập nhật, "
+        f"-{len(set(stale_ids) - set(new_ids))} đã xóa, {len(current)} tổng."
+    )
+    return vector_store
+
+def make_vector_backend(chroma):
+    """Backend phục vụ truy vấn theo VECTOR_BACKEND, trên collection Chroma đã đồng bộ."""
+    from vectors import ChromaVectorStore, NumpyVectorStore
+    if VECTOR_BACKEND == "numpy":
+        return NumpyVectorStore.from_chroma(chroma._collection)
+    if VECTOR_BACKEND != "chroma":
+        raise ValueError(f"VECTOR_BACKEND không hợp lệ: {VECTOR_BACKEND!r} (numpy | chroma)")
+    return ChromaVectorStore(chroma)
+
+# --- Retriever & LLM có giới hạn đồng thời ---
+_EXECUTORS: Dict[str, ThreadPoolExecutor] = {}
+
+def stage_executor(stage: str) -> ThreadPoolExecutor:
+    """Thread pool riêng, có giới hạn, cho các stage chạy đồng bộ (vector search)."""
+    if stage not in _EXECUTORS:
+        workers = {"search": SEARCH_CONCURRENCY}[stage]
+        _EXECUTORS[stage] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"rag-{stage}")
+    return _EXECUTORS[stage]
+
+# Singleton tạo ở lần dùng đầu tiên (không lúc import rag_core); khóa để hai luồng không tạo hai bản
+_SINGLETON_LOCK = threading.Lock()
+_LLM_SCHEDULER: Optional[LLMScheduler] = None
+
+def get_llm_scheduler() -> LLMScheduler:
+    """Mọi lời gọi LLM trong process đi qua một scheduler: LLM_CONCURRENCY slot, ưu tiên request tương tác."""
+    global _LLM_SCHEDULER
+    if _LLM_SCHEDULER is None:
+        with _SINGLETON_LOCK:
+            if _LLM_SCHEDULER is None:
+                _LLM_SCHEDULER = LLMScheduler(
+                    rpm=LLM_RPM, tpm=LLM_TPM, max_concurrent=LLM_CONCURRENCY, batch_reserve=LLM_BATCH_RESERVE,
+                    max_retries=LLM_MAX_RETRIES, retry_base_s=LLM_RETRY_BASE_S, retry_max_s=LLM_RETRY_MAX_S,
+                    hedge_after_s=LLM_HEDGE_AFTER_S,
+                )
+    return _LLM_SCHEDULER
+
+class SingleFlight:
+    """
+    Gộp các lời gọi async cùng khóa đang chạy đồng thời: lời gọi đầu tiên thực thi, các lời gọi sau
+    chờ và nhận chung kết quả (hoặc lỗi). Khóa được xóa ngay khi xong nên đây không phải là cache.
+    """
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.counters = {"leaders": 0, "coalesced": 0}
+
+    async def do(self, key: str, fn) -> Tuple[Any, bool]:
+        """
+        Trả về (kết quả, có phải lời gọi được gộp hay không). Công việc chạy trong task riêng nên
+        client đầu tiên ngắt kết nối cũng không hủy kết quả của các client đang chờ chung.
+        """
+        task = self._inflight.get(key)
+        coalesced = task is not None
+        if coalesced:
+            self.counters["coalesced"] += 1
+        else:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            self.counters["leaders"] += 1
+        return await asyncio.shield(task), coalesced
+
+    def stats(self) -> dict:
+        return {**self.counters, "inflight": len(self._inflight)}
+
+SINGLE_FLIGHT = SingleFlight()
+
+def request_key(message: str, chat_history, top_k=None, club_id=None) -> str:
+    """Khóa single-flight: câu hỏi đã chuẩn hóa + lịch sử + top-k + CLB."""
+    history = [(type(m).__name__, m.content) for m in chat_history or []]
+    payload = json.dumps([normalize_text(message), history, top_k, club_id], ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+def club_filter(club_id: Optional[str]) -> Optional[dict]:
+    """Bộ lọc metadata cho một CLB: player summary của CLB đó + toàn bộ blog (dùng chung)."""
+    if not club_id:
+        return None
+    return {"$or": [{"source": "blog"}, {"club_id": str(club_id)}]}
+
+def retrieval_config(top_k=None, club_id: Optional[str] = None) -> dict:
+    """
+    Config cho rag_chain.invoke/stream theo từng request: độ sâu truy hồi (top-k) và CLB. Bộ lọc CLB được
+    đẩy xuống vector search (và BM25); fast path thống kê và cache câu trả lời cũng tách theo CLB.
+    Không chọn CLB thì dùng TARGET_CLUB_ID; ALL_CLUBS thì không lọc.
+    """
+    k = max(1, min(int(top_k or DEFAULT_TOP_K), MAX_TOP_K))
+    club_id = None if club_id == ALL_CLUBS else str(club_id or TARGET_CLUB_ID) or None
+    retriever_kwargs = {"k": k}
+    if club_id:
+        retriever_kwargs["filter"] = club_filter(club_id)
+    return {"configurable": {"retriever_kwargs": retriever_kwargs, "club_id": club_id}}
+
+def config_club(config) -> Optional[str]:
+    return ((config or {}).get("configurable") or {}).get("club_id")
+
+def cache_scope(config) -> Tuple[Optional[str], int]:
+    """Scope của cache câu trả lời: (CLB, top-k thực tế), vì context và câu trả lời phụ thuộc cả hai."""
+    retriever_kwargs = ((config or {}).get("configurable") or {}).get("retriever_kwargs") or {}
+    return config_club(config), int(retriever_kwargs.get("k", DEFAULT_TOP_K))
+
+def club_ids() -> List[str]:
+    """Các CLB có dữ liệu người chơi (đã nạp), để client chọn và để kiểm tra club_id của request."""
+    table = PLAYER_TABLE
+    if table is None:
+        # Chưa khởi động xong: đọc thẳng từ các file summary (nhỏ)
+        return sorted({str(d["club_id"]) for d in iter_player_records() if d.get("club_id") is not None})
+    return sorted(table.club_ids)
+
+# --- Dạng tài liệu trong prompt ---
+# page_content là dạng để embed (giữ nguyên để không phải embed lại); prompt nhận dạng gọn theo từng loại nguồn
+_BLANK_LINES_RE = re.compile(r"[ \t]*\n\s*")
+_STOPWORDS = frozenset(
+    "the and for are was what who how why when which with from that this have has does did "
+    "cua cho nhung cac mot nao khong duoc voi trong nguoi choi la gi bao nhieu the nhu".split()
+)
+
+def _player_prompt(doc: "Document") -> str:
+    """Một dòng: tên, ID, CLB rồi bản tóm tắt tiếng Anh (đã gồm mọi số liệu của các dòng có nhãn phía trên)."""
+    m = doc.metadata
+    name = m.get("player_name") or "N/A"
+    summary = doc.page_content.partition("Tóm tắt chi tiết: ")[2].strip()
+    if not summary or summary == "None":
+        # Không có summary: giữ các dòng số liệu, bỏ tiêu đề / ID
+        summary = "; ".join(line.strip() for line in doc.page_content.splitlines()[3:] if not line.startswith("Tóm tắt chi tiết"))
+    elif summary.startswith(f"Player: {name}."):
+        summary = summary[len(f"Player: {name}."):].strip()
+    return f"[Người chơi] {name} (ID {m.get('player_id')}, CLB {m.get('club_id')}): {summary}"
+
+def compress_text(text: str, query: str, max_sentences: int = PROMPT_COMPRESS_MAX_SENTENCES) -> str:
+    """
+    Nén trích xuất: giữ tối đa `max_sentences` câu có nhiều từ khóa của câu hỏi nhất (theo thứ tự gốc,
+    các đoạn bị bỏ thay bằng "[...]"). Không câu nào khớp thì giữ các câu đầu.
+    """
+    terms = {t for t in tokenize(query) if len(t) > 2 and t not in _STOPWORDS}
+    sentences = [
+        sent.group().strip()
+        for line in text.splitlines()
+        for sent in _SENTENCE_RE.finditer(line)
+        if sent.group().strip()
+    ]
+    if not terms or len(sentences) <= max_sentences:
+        return text
+    scores = [len(terms.intersection(tokenize(sent))) for sent in sentences]
+    best = sorted(range(len(sentences)), key=lambda i: (-scores[i], i))[:max_sentences]
+    keep = sorted(i for i in best if scores[i] > 0) or list(range(max_sentences))
+    parts, prev = [], -1
+    for i in keep:
+        if i != prev + 1:
+            parts.append("[...]")
+        parts.append(sentences[i])
+        prev = i
+    if prev != len(sentences) - 1:
+        parts.append("[...]")
+    return " ".join(parts)
+
+def _blog_prompt(doc: "Document", query: Optional[str]) -> str:
+    m = doc.metadata
+    body = doc.page_content.partition("Nội dung: ")[2] or doc.page_content
+    body = _BLANK_LINES_RE.sub("\n", body).strip()
+    if PROMPT_COMPRESSION and query and count_tokens(body) > PROMPT_COMPRESS_MIN_TOKENS:
+        body = compress_text(body, query)
+    date = f" ({m['date']})" if m.get("date") else ""
+    return f"[Blog] {m.get('title')}{date}:\n{body}"
+
+def render_prompt(doc: "Document", query: Optional[str] = None) -> str:
+    """Nội dung của `doc` khi đưa vào {context} (PROMPT_RENDERING); `query` dùng cho nén trích xuất."""
+    if PROMPT_RENDERING == "raw":
+        return doc.page_content
+    source = doc.metadata.get("source")
+    if source == "player_summary":
+        return _player_prompt(doc)
+    if source == "blog":
+        return _blog_prompt(doc, query)
+    return doc.page_content
+
+def pack_context(docs: List["Document"], query: Optional[str] = None) -> List["Document"]:
+    """
+    Chọn tài liệu đưa vào prompt: bỏ phần đuôi có độ tương đồng < CONTEXT_MIN_SIMILARITY
+    (tài liệu chỉ khớp BM25 không có điểm vector nên được giữ), rồi lấy lần lượt theo thứ hạng
+    trong ngân sách CONTEXT_TOKEN_BUDGET, tính trên dạng prompt (render_prompt). Luôn giữ ít nhất
+    một tài liệu (cắt bớt nếu quá dài). Trả về bản sao: metadata["prompt"] là dạng prompt,
+    metadata["tokens"] / ["raw_tokens"] là số token của dạng prompt / của page_content.
+    """
+    from langchain_core.documents import Document
+    packed, used = [], 0
+    for i, doc in enumerate(docs):
+        similarity = doc.metadata.get("similarity")
+        if i > 0 and similarity is not None and similarity < CONTEXT_MIN_SIMILARITY:
+            continue
+        prompt = render_prompt(doc, query)
+        tokens = count_tokens(prompt)
+        metadata = {**doc.metadata}
+        if used + tokens > CONTEXT_TOKEN_BUDGET:
+            if packed:
+                continue
+            keep = max(1, int(len(prompt) * CONTEXT_TOKEN_BUDGET / tokens))
+            prompt, tokens = prompt[:keep], CONTEXT_TOKEN_BUDGET
+            metadata["truncated"] = True
+        metadata.update(prompt=prompt, tokens=tokens, raw_tokens=count_tokens(doc.page_content))
+        packed.append(Document(page_content=doc.page_content, metadata=metadata))
+        used += tokens
+    if len(packed) < len(docs):
+        logger.info("context packing: kept %d/%d docs, %d tokens", len(packed), len(docs), used)
+    return packed
+
+def traced_pack_context(docs: List["Document"], query: Optional[str] = None) -> List["Document"]:
+    count_docs("retrieved", len(docs))
+    with span("pack"):
+        packed = pack_context(docs, query)
+    count_docs("packed", len(packed))
+    count_context_tokens(raw_context_tokens(packed), context_tokens(packed))
+    return packed
+
+def format_context(docs: List["Document"]) -> str:
+    """Ghép dạng prompt của các tài liệu thành chuỗi {context} (như create_stuff_documents_chain)."""
+    with span("format"):
+        return "\n\n".join(d.metadata.get("prompt") or d.page_content for d in docs)
+
+def context_tokens(docs: List["Document"]) -> int:
+    return sum(d.metadata.get("tokens", 0) for d in docs)
+
+def raw_context_tokens(docs: List["Document"]) -> int:
+    """Số token nếu đưa nguyên page_content vào prompt, để báo cáo mức giảm của render_prompt."""
+    return sum(d.metadata.get("raw_tokens", d.metadata.get("tokens", 0)) for d in docs)
+
+# --- Cache câu trả lời theo ngữ nghĩa ---
+class SemanticCache:
+    """
+    Cache LRU + TTL cho câu trả lời, khóa là embedding (đã chuẩn hóa) của câu hỏi độc lập.
+    Trúng cache khi cosine >= threshold, chỉ trong cùng `scope` (CLB, top-k). Toàn bộ cache bị xóa khi phiên bản chỉ mục đổi.
+    Dùng chung (singleton ANSWER_CACHE) cho mọi chain dựng bởi build_rag_chain trong process.
+    """
+    def __init__(self, threshold: float, ttl: float, max_size: int):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.version = None
+        self._entries: "OrderedDict[int, Tuple[Any, float, dict, Optional[str]]]" = OrderedDict()  # vector numpy
+        self._next_key = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def _normalize(embedding):
+        import numpy as np
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def set_version(self, version: str) -> None:
+        with self._lock:
+            if version != self.version:
+                if self._entries:
+                    self.counters["invalidations"] += 1
+                self._entries.clear()
+                self.version = version
+
+    def lookup(self, embedding, scope: Optional[tuple] = None):
+        """Trả về (similarity, value) của mục gần nhất cùng scope nếu đạt ngưỡng, ngược lại None."""
+        vec = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, (_, created, _, _) in self._entries.items() if now - created > self.ttl]
+            for k in expired:
+                del self._entries[k]
+            best_key, best_sim = None, -1.0
+            keys = [k for k, entry in self._entries.items() if entry[3] == scope]
+            if keys:
+                import numpy as np
+                sims = np.stack([self._entries[k][0] for k in keys]) @ vec
+                idx = int(np.argmax(sims))
+                best_key, best_sim = keys[idx], float(sims[idx])
+            if best_key is None or best_sim < self.threshold:
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.counters["hits"] += 1
+            return best_sim, self._entries[best_key][2]
+
+    def store(self, embedding, value: dict, version: Optional[str] = None, scope: Optional[tuple] = None) -> None:
+        """`version`: phiên bản chỉ mục đã tạo ra câu trả lời; bỏ qua nếu chỉ mục đã đổi (request chạy qua reload)."""
+        vec = self._normalize(embedding)
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._entries[self._next_key] = (vec, time.monotonic(), value, scope)
+            self._next_key += 1
+            self.counters["stores"] += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "size": len(self._entries),
+                "hit_rate": round(self.counters["hits"] / total, 4) if total else 0.0,
+                "version": self.version,
+            }
+
+ANSWER_CACHE = SemanticCache(ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL, ANSWER_CACHE_SIZE)
+QUERY_EMBEDDINGS = None  # CachedEmbeddings dùng chung, gán trong build_rag_chain
 
-    print("⏳ Khởi tạo embeddings...")
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
-    print("✅ Embeddings OK.")
+def cache_stats() -> dict:
+    return {
+        "answer_cache": ANSWER_CACHE.stats(),
+        "query_embeddings": QUERY_EMBEDDINGS.stats() if QUERY_EMBEDDINGS else None,
+    }
 
-    print(f"⏳ Tạo/tải ChromaDB tại '{PERSIST_DIRECTORY}'...")
-    vector_store = Chroma.from_documents(docs, embeddings, persist_directory=PERSIST_DIRECTORY)
-    print("✅ Vector store OK.")
+def pipeline_stats() -> dict:
+    """Bộ đếm tích lũy của cache, cổng viết lại câu hỏi và phiên hội thoại (xuất ra /metrics)."""
+    return {
+        **cache_stats(),
+        "rewrite_gate": REWRITE_GATE.stats() if REWRITE_GATE else None,
+        "sessions": _SESSIONS.stats() if _SESSIONS else None,
+        "single_flight": SINGLE_FLIGHT.stats(),
+        "reload": RELOADER.stats(),
+        "llm_scheduler": _LLM_SCHEDULER.stats() if _LLM_SCHEDULER else None,
+    }
 
-    retriever = vector_store.as_retriever(search_kwargs={"k": 5})
+def _with_answer_cache(retrieve_and_answer, embeddings, version: Optional[str] = None):
+    """
+    Bước định tuyến đặt sau bước tạo câu hỏi độc lập: trúng cache thì trả ngay
+    context + answer đã lưu, trượt thì chạy retrieve_and_answer rồi lưu kết quả (kể cả khi stream).
+    """
+    from langchain_core.runnables import RunnableGenerator, RunnableLambda
+    def _store_after(embedding, scope):
+        def _collect(chunks):
+            final = None
+            for chunk in chunks:
+                final = chunk if final is None else final + chunk
+                yield chunk
+            _store(embedding, final, scope)
 
+        async def _acollect(chunks):
+            final = None
+            async for chunk in chunks:
+                final = chunk if final is None else final + chunk
+                yield chunk
+            _store(embedding, final, scope)
+
+        return retrieve_and_answer | RunnableGenerator(_collect, _acollect)
+
+    def _store(embedding, final, scope):
+        if final and final.get("answer"):
+            ANSWER_CACHE.store(embedding, {"context": final.get("context", []), "answer": final["answer"]}, version, scope)
+
+    def _route(inputs: dict, embedding, config):
+        # Câu trả lời phụ thuộc CLB và top-k được chọn: cache tách theo cả hai
+        scope = cache_scope(config)
+        hit = ANSWER_CACHE.lookup(embedding, scope)
+        count_cache("answer_cache", hit is not None)
+        if hit is None:
+            return _store_after(embedding, scope)
+        similarity, value = hit
+        return {**inputs, **value, "cache_hit": True, "cache_similarity": round(similarity, 4)}
+
+    def route(inputs: dict, config=None):
+        if not ANSWER_CACHE_ENABLED:
+            return retrieve_and_answer
+        with span("embed"):
+            embedding = embeddings.embed_query(inputs["standalone_question"])
+        return _route(inputs, embedding, config)
+
+    async def aroute(inputs: dict, config=None):
+        if not ANSWER_CACHE_ENABLED:
+            return retrieve_and_answer
+        with span("embed"):
+            embedding = await embeddings.aembed_query(inputs["standalone_question"])
+        return _route(inputs, embedding, config)
+
+    return RunnableLambda(route, afunc=aroute)
+
+# --- Cổng quyết định có cần viết lại câu hỏi ---
+_FOLLOWUP_PATTERNS = [
+    # Đại từ / chỉ định tiếng Anh
+    r"\b(he|she|him|her|his|hers|they|them|their|theirs|it|its|this|that|these|those|there|former|latter)\b",
+    r"^(and|but|also|so|then|what about|how about|same|more|else|why|how come)\b",
+    # Đại từ / chỉ định / tỉnh lược tiếng Việt
+    r"\b(anh ấy|chị ấy|cô ấy|ông ấy|bà ấy|bạn ấy|cậu ấy|em ấy|họ|nó|người này|người đó|người kia|bài này|bài đó)\b",
+    r"\b(đó|đấy|này|kia|trên|vừa rồi|như vậy|như thế(?!\s+nào))\b",
+    r"^(còn|thế còn|vậy|vậy còn|thế|và|nhưng|tại sao vậy)\b",
+    r"\b(thì sao|thế nào rồi)\s*\??$",
+]
+_FOLLOWUP_RE = re.compile("|".join(f"(?:{p})" for p in _FOLLOWUP_PATTERNS), re.IGNORECASE)
+
+def needs_rewrite(question: str, chat_history) -> Tuple[bool, str]:
+    """
+    Heuristic cục bộ: chỉ gọi LLM viết lại khi câu hỏi có vẻ phụ thuộc ngữ cảnh
+    (đại từ, tỉnh lược, câu quá ngắn). Trả về (cần viết lại?, lý do).
+    """
+    if not chat_history:
+        return False, "no_history"
+    text = normalize_text(question)
+    if len(text.split()) <= 3:
+        return True, "short"
+    match = _FOLLOWUP_RE.search(text)
+    if match:
+        return True, f"reference:{match.group().strip().lower()}"
+    return False, "self_contained"
+
+class RewriteGate:
+    """Bọc chain viết lại câu hỏi; ghi log từng quyết định và ước lượng thời gian tiết kiệm (EWMA)."""
+
+    def __init__(self, rewrite_chain):
+        self.rewrite_chain = rewrite_chain
+        self.avg_rewrite_s = None
+        self.counters = {"rewritten": 0, "skipped": 0, "no_history": 0, "saved_s": 0.0}
+        self._lock = threading.Lock()
+
+    def _decide(self, inputs: dict) -> bool:
+        rewrite, reason = needs_rewrite(inputs["input"], inputs.get("chat_history"))
+        if not rewrite:
+            with self._lock:
+                key = "no_history" if reason == "no_history" else "skipped"
+                self.counters[key] += 1
+                saved = (self.avg_rewrite_s or 0.0) if key == "skipped" else 0.0
+                self.counters["saved_s"] += saved
+            if reason != "no_history":
+                logger.info("rewrite skipped (%s), saved ~%.2fs", reason, saved)
+        else:
+            logger.info("rewrite needed (%s)", reason)
+        return rewrite
+
+    def _record(self, elapsed: float) -> None:
+        with self._lock:
+            self.counters["rewritten"] += 1
+            self.avg_rewrite_s = elapsed if self.avg_rewrite_s is None else 0.8 * self.avg_rewrite_s + 0.2 * elapsed
+
+    def invoke(self, inputs: dict, config=None) -> str:
+        if not self._decide(inputs):
+            return inputs["input"]
+        start = time.perf_counter()
+        with span("rewrite"):
+            question = self.rewrite_chain.invoke(inputs, config=config)
+        self._record(time.perf_counter() - start)
+        return question
+
+    async def ainvoke(self, inputs: dict, config=None) -> str:
+        if not self._decide(inputs):
+            return inputs["input"]
+        start = time.perf_counter()
+        with span("rewrite"):
+            question = await self.rewrite_chain.ainvoke(inputs, config=config)
+        self._record(time.perf_counter() - start)
+        return question
+
+    def as_runnable(self):
+        from langchain_core.runnables import RunnableLambda
+        return RunnableLambda(self.invoke, afunc=self.ainvoke)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, "avg_rewrite_s": self.avg_rewrite_s}
+
+REWRITE_GATE = None  # RewriteGate dùng chung, gán trong build_rag_chain
+
+# --- Phiên hội thoại ---
+_SESSIONS: Optional[SessionStore] = None
+
+def get_session_store() -> SessionStore:
+    """Kho phiên dùng chung, mở (kể cả file SQLite SESSION_DB_PATH) ở lần dùng đầu tiên."""
+    global _SESSIONS
+    if _SESSIONS is None:
+        with _SINGLETON_LOCK:
+            if _SESSIONS is None:
+                _SESSIONS = SessionStore(
+                    count_tokens,
+                    max_sessions=SESSION_MAX,
+                    ttl=SESSION_TTL,
+                    token_budget=SESSION_TOKEN_BUDGET,
+                    summary_tokens=SESSION_SUMMARY_TOKENS,
+                    path=SESSION_DB_PATH,
+                )
+    return _SESSIONS
+SESSION_SUMMARIZER = None  # chain tóm tắt (model viết lại), gán trong build_rag_chain
+
+async def summarize_turns(summary: str, turns) -> str:
+    """Gộp các lượt cũ vào tóm tắt bằng model viết lại câu hỏi; chưa có model thì để SessionStore tự trích xuất."""
+    if SESSION_SUMMARIZER is None:
+        return ""
+    text = "\n".join(f"User: {user}\nAssistant: {bot}" for user, bot in turns)
+    with llm_priority(BATCH):
+        return await SESSION_SUMMARIZER.ainvoke({"summary": summary or "(none)", "turns": text})
+
+# --- Fast path thống kê người chơi ---
+PLAYER_TABLE = None  # PlayerTable dùng chung, gán trong build_rag_chain
+
+def load_player_table() -> PlayerTable:
+    table = PlayerTable.from_records(iter_player_records())
+    print(f"✅ Bảng người chơi: {len(table.players)} người, {len(table.club_ids)} CLB.")
+    return table
+
+def _with_player_fast_path(chain, table: PlayerTable):
+    """
+    Bước đầu tiên của chain: câu hỏi tra cứu/tổng hợp/xếp hạng về người chơi được trả lời
+    ngay từ PlayerTable (chính xác, vài ms); các câu khác đi tiếp vào chain RAG.
+    """
+    from langchain_core.runnables import RunnableLambda
+    def route(inputs: dict, config=None):
+        hit = None
+        if FAST_PATH_ENABLED:
+            hit = table.for_club(config_club(config)).answer(inputs["input"], bool(inputs.get("chat_history")))
+        if hit is None:
+            return chain
+        answer, players = hit
+        logger.info("player fast path: %r", inputs["input"])
+        return {
+            **inputs,
+            "standalone_question": inputs["input"],
+            "context": [table.to_document(p) for p in players],
+            "answer": answer,
+            "fast_path": True,
+        }
+
+    async def aroute(inputs: dict, config=None):
+        return route(inputs, config)
+
+    return RunnableLambda(route, afunc=aroute)
+
+def make_chat_model(model_name: str, max_tokens: Optional[int] = None, role: str = "answer"):
+    """Model chat theo LLM_PROVIDER: ChatGroq qua get_llm_scheduler(), hoặc model giả lập cho load test."""
+    from llm_metrics import LLMMetricsCallback
+    callbacks = [LLMMetricsCallback(role)]
+    if LLM_PROVIDER == "fake":
+        from fake_llm import FakeChatModel
+        return FakeChatModel(
+            model_name=model_name, max_tokens=max_tokens, echo=role != "answer",
+            latency_ms=FAKE_LLM_LATENCY_MS, tokens_per_s=FAKE_LLM_TOKENS_PER_S,
+            reply_tokens=FAKE_LLM_REPLY_TOKENS, streaming=FAKE_LLM_STREAM, callbacks=callbacks,
+        )
+    if LLM_PROVIDER != "groq":
+        raise ValueError(f"LLM_PROVIDER không hợp lệ: {LLM_PROVIDER!r} (groq | fake)")
     api_key = os.getenv("GROQ_API_KEY")
     if not api_key:
         raise RuntimeError("❌ Thiếu GROQ_API_KEY trong biến môi trường hoặc .env")
+    from llm import ScheduledChatGroq, http_clients
+    sync_client, async_client = http_clients()
+    kwargs = dict(
+        temperature=0, groq_api_key=api_key, max_retries=0, request_timeout=LLM_TIMEOUT_S,
+        http_client=sync_client, http_async_client=async_client,
+    )
+    if GROQ_API_BASE:
+        kwargs["groq_api_base"] = GROQ_API_BASE
+    if max_tokens:
+        kwargs["max_tokens"] = max_tokens
+    fallback = None
+    if role == "answer" and LLM_FALLBACK_MODEL and LLM_FALLBACK_MODEL != model_name:
+        fallback = ScheduledChatGroq(model_name=LLM_FALLBACK_MODEL, **kwargs)
+    return ScheduledChatGroq(model_name=model_name, callbacks=callbacks, fallback=fallback, **kwargs)
 
-    llm = ChatGroq(temperature=0, groq_api_key=api_key, model_name=LLM_MODEL_NAME)
+@dataclass(eq=False)
+class IndexGeneration:
+    """
+    Một thế hệ chỉ mục + chain, bất biến sau khi dựng. Reload dựng thế hệ mới rồi thay bằng một phép gán;
+    request đang chạy giữ tham chiếu tới thế hệ cũ nên chạy xong trên đó, sau đó thế hệ cũ được GC thu hồi.
+    """
+    number: int
+    chain: Any
+    retriever: Any
+    qa_chain: Any
+    player_table: Any
+    lexical_index: Any
+    version: Optional[str]
+    docs: int
+    built_at: float = field(default_factory=time.time)
 
-    contextualize_q_prompt = ChatPromptTemplate.from_messages([
-        ("system", CONTEXTUALIZE_PROMPT_TEMPLATE),
-        MessagesPlaceholder(variable_name="chat_history"),
-        ("user", "{input}")
-    ])
-    history_aware_retriever = create_history_aware_retriever(llm, retriever, contextualize_q_prompt)
+def build_generation(embeddings=None, stage=None) -> IndexGeneration:
+    """
+    Dựng một thế hệ chỉ mục + chain. Lần đầu (embeddings=None) nạp model embedding và các chain dùng chung
+    (cổng viết lại, tóm tắt phiên); khi reload truyền lại CachedEmbeddings đang dùng và `stage` riêng để
+    không tải lại model và không đụng tới trạng thái khởi động (/readyz).
+    """
+    stage = stage or STARTUP.stage
+    with stage("imports"):
+        # Import nặng (langchain_core, chromadb, groq; torch/onnxruntime ở bước embeddings) chỉ xảy ra ở đây,
+        # không lúc import rag_core
+        from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+        from langchain_core.output_parsers import StrOutputParser
+        from langchain_core.runnables import ConfigurableField, RunnableLambda, RunnablePassthrough
+        from embeddings import CachedEmbeddings
+        from retriever import DuprRetriever
+        if not INDEX_SNAPSHOT:
+            from langchain_community.vectorstores import Chroma  # noqa: F401
+        if LLM_PROVIDER == "groq":
+            import llm  # noqa: F401
+
+    with stage("documents"):
+        # Có snapshot: không cần đọc corpus, chỉ mục đã dựng sẵn
+        docs = [] if INDEX_SNAPSHOT else load_documents()
+    if not docs and not INDEX_SNAPSHOT:
+        raise RuntimeError("❌ Không có tài liệu nào để lập chỉ mục. Hãy kiểm tra các file .jsonl.")
+
+    global QUERY_EMBEDDINGS
+    if embeddings is None:
+        print(f"⏳ Khởi tạo embeddings (backend: {EMBEDDING_BACKEND})...")
+        with stage("embeddings"):
+            embeddings = CachedEmbeddings(
+                make_embeddings(),
+                embedding_model_id(),
+                cache_size=EMBEDDING_CACHE_SIZE,
+                cache_path=EMBEDDING_CACHE_PATH,
+                batch_window_ms=EMBED_BATCH_WINDOW_MS,
+                max_batch=EMBED_MAX_BATCH,
+                workers=EMBED_CONCURRENCY,
+            )
+        QUERY_EMBEDDINGS = embeddings
+        print("✅ Embeddings OK.")
+
+    with stage("vector_store"):
+        if INDEX_SNAPSHOT:
+            from snapshot import SnapshotVectorStore
+            print(f"⏳ Mở snapshot chỉ mục '{INDEX_SNAPSHOT}'...")
+            vector_store = SnapshotVectorStore.open(INDEX_SNAPSHOT, embedding_model_id())
+            lexical_index = vector_store.lexical_index() if HYBRID_SEARCH else None
+            version = vector_store.version
+            n_docs = vector_store.manifest["count"]
+            print(f"✅ Snapshot OK ({vector_store.manifest['count']} vector {vector_store.manifest['dtype']}).")
+        else:
+            print(f"⏳ Tạo/tải ChromaDB tại '{PERSIST_DIRECTORY}'...")
+            # Đồng bộ tăng dần: khi reload chỉ embed tài liệu mới/đổi. Backend "numpy" giữ bản sao vector riêng
+            # nên thế hệ cũ không thấy thay đổi; với "chroma" request đang chạy có thể thấy collection đang cập nhật.
+            vector_store = make_vector_backend(sync_vector_store(docs, embeddings))
+            lexical_index = load_lexical_index(docs) if HYBRID_SEARCH else None
+            version = _load_manifest().get("version")
+            n_docs = len(docs)
+            print(f"✅ Vector store OK (backend: {VECTOR_BACKEND}).")
+
+    base_retriever = DuprRetriever(
+        vector_store=vector_store, embeddings=embeddings, lexical_index=lexical_index,
+        search_kwargs={"k": DEFAULT_TOP_K},
+    )
+    retriever = base_retriever.configurable_fields(
+        search_kwargs=ConfigurableField(id="retriever_kwargs", name="Retriever kwargs", description="vd. {\"k\": 8}")
+    )
+
+    answer_llm = make_chat_model(LLM_MODEL_NAME)
+
+    # Chỉ nhờ LLM (model viết lại riêng) khi heuristic cho rằng câu hỏi phụ thuộc lịch sử
+    global REWRITE_GATE, SESSION_SUMMARIZER
+    if REWRITE_GATE is None:
+        contextualize_q_prompt = ChatPromptTemplate.from_messages([
+            ("system", CONTEXTUALIZE_PROMPT_TEMPLATE),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("user", "{input}")
+        ])
+        rewrite_llm = make_chat_model(REWRITE_MODEL_NAME, max_tokens=REWRITE_MAX_TOKENS, role="rewrite")
+        REWRITE_GATE = RewriteGate(contextualize_q_prompt | rewrite_llm | StrOutputParser())
+    if SESSION_SUMMARIZER is None:
+        SESSION_SUMMARIZER = (
+            ChatPromptTemplate.from_template(SUMMARY_PROMPT_TEMPLATE)
+            | make_chat_model(REWRITE_MODEL_NAME, max_tokens=SESSION_SUMMARY_TOKENS, role="summary")
+            | StrOutputParser()
+        )
+    contextualize_chain = REWRITE_GATE.as_runnable()
 
     qa_prompt = ChatPromptTemplate.from_messages([
         ("system", QA_PROMPT_TEMPLATE),
         MessagesPlaceholder(variable_name="chat_history"),
         ("user", "{input}")
     ])
-    question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
+    question_answer_chain = (
+        RunnablePassthrough.assign(context=lambda x: format_context(x["context"])).with_config(run_name="format_inputs")
+        | qa_prompt
+        | answer_llm
+        | StrOutputParser()
+    )
 
-    rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
+    # Đóng gói cần cả câu hỏi (nén trích xuất) nên retriever được gọi bên trong, cùng config (retriever_kwargs)
+    def retrieve_and_pack(x: dict, config) -> List["Document"]:
+        return traced_pack_context(retriever.invoke(x["standalone_question"], config), x["standalone_question"])
+
+    async def aretrieve_and_pack(x: dict, config) -> List["Document"]:
+        return traced_pack_context(await retriever.ainvoke(x["standalone_question"], config), x["standalone_question"])
+
+    retrieve_and_answer = (
+        RunnablePassthrough.assign(context=RunnableLambda(retrieve_and_pack, afunc=aretrieve_and_pack))
+        .assign(
+            context_tokens=lambda x: context_tokens(x["context"]),
+            context_tokens_raw=lambda x: raw_context_tokens(x["context"]),
+        )
+        .assign(answer=question_answer_chain)
+    )
+    player_table = load_player_table()
+    rag_chain = _with_player_fast_path(
+        RunnablePassthrough.assign(standalone_question=contextualize_chain)
+        | _with_answer_cache(retrieve_and_answer, embeddings, version),
+        player_table,
+    )
+    current = _generation
+    return IndexGeneration(
+        number=current.number + 1 if current else 1,
+        chain=rag_chain,
+        retriever=base_retriever,
+        qa_chain=question_answer_chain,
+        player_table=player_table,
+        lexical_index=lexical_index,
+        version=version,
+        docs=n_docs,
+    )
+
+def install_generation(generation: IndexGeneration) -> None:
+    """Thay thế hệ đang phục vụ (một phép gán) và các global dùng cho batch / chế độ suy giảm."""
+    global _generation, PLAYER_TABLE, LEXICAL_INDEX
+    ANSWER_CACHE.set_version(generation.version)
+    PLAYER_TABLE = generation.player_table
+    LEXICAL_INDEX = generation.lexical_index or LEXICAL_INDEX
+    old, _generation = _generation, generation
+    if old is not None:
+        # Vector store (phần tốn bộ nhớ) được giải phóng khi request cuối cùng còn giữ chain cũ kết thúc
+        weakref.finalize(old.retriever.vector_store, logger.info, "index generation %d freed", old.number)
+    logger.info("index generation %d installed (version %s, %d docs)", generation.number, generation.version, generation.docs)
+
+def build_rag_chain():
+    """Dựng và cài thế hệ đầu tiên, trả về rag_chain."""
+    generation = build_generation()
+    install_generation(generation)
+    STARTUP.complete("chain")
     print("✅ RAG chain hội thoại sẵn sàng.")
-    return rag_chain
+    return generation.chain
+
+# --- Khởi động nền, trạng thái sẵn sàng & chế độ suy giảm ---
+class StartupState:
+    """Tiến độ khởi động (cho /readyz): các stage đã xong, stage đang chạy, lỗi nếu có."""
+    STAGES = ("player_table", "lexical_index", "imports", "documents", "embeddings", "vector_store", "chain")
+
+    def __init__(self):
+        self.status = "idle"
+        self.current = None
+        self.completed: List[str] = []
+        self.error = None
+        self.started_at = time.monotonic()
+        self.ready_s = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        with self._lock:
+            self.status, self.current = "warming", name
+        start = time.perf_counter()
+        yield
+        logger.info("startup stage %s took %.2fs", name, time.perf_counter() - start)
+        self.complete(name)
+
+    def complete(self, name: str) -> None:
+        with self._lock:
+            if name not in self.completed:
+                self.completed.append(name)
+            self.current = None
+            if name == "chain":
+                self.status = "ready"
+                self.ready_s = round(time.monotonic() - self.started_at, 3)
+
+    def fail(self, error: Exception) -> None:
+        with self._lock:
+            self.status, self.error = "failed", f"{type(error).__name__}: {error}"
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "status": self.status,
+                "stage": self.current,
+                "completed": list(self.completed),
+                "progress": round(len(self.completed) / len(self.STAGES), 2),
+                "uptime_s": round(time.monotonic() - self.started_at, 3),
+                "ready_s": self.ready_s,
+                "error": self.error,
+            }
+
+STARTUP = StartupState()
+LEXICAL_INDEX = None  # BM25Index dùng cho chế độ suy giảm khi chain chưa sẵn sàng
+_generation: Optional[IndexGeneration] = None
+_warmup_thread = None
+_warmup_lock = threading.Lock()
+
+def _warmup() -> None:
+    global PLAYER_TABLE, LEXICAL_INDEX
+    # Mốc của file theo dõi lấy trước khi đọc corpus: file đổi trong lúc khởi động vẫn được reload sau đó
+    RELOADER.start_watching()
+    try:
+        # Dữ liệu nhẹ trước: đủ để trả lời suy giảm trong lúc model/chỉ mục đang tải
+        with STARTUP.stage("player_table"):
+            PLAYER_TABLE = load_player_table()
+        with STARTUP.stage("lexical_index"):
+            LEXICAL_INDEX = BM25Index.load(
+                os.path.join(INDEX_SNAPSHOT, "bm25_index.json") if INDEX_SNAPSHOT else LEXICAL_INDEX_PATH
+            )
+        build_rag_chain()
+    except Exception as e:
+        STARTUP.fail(e)
+        logger.exception("warm-up failed")
+
+def start_background_warmup() -> None:
+    """Dựng rag_chain trong thread nền (idempotent); process nhận request ngay trong lúc đó."""
+    global _warmup_thread
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=_warmup, name="rag-warmup", daemon=True)
+            _warmup_thread.start()
+
+def current_generation() -> Optional[IndexGeneration]:
+    """Thế hệ đang phục vụ; request nên lấy một lần rồi dùng xuyên suốt."""
+    return _generation
+
+def get_rag_chain():
+    """rag_chain đã sẵn sàng, hoặc None nếu vẫn đang khởi động."""
+    generation = _generation
+    return generation.chain if generation is not None else None
+
+# --- Reload corpus nóng ---
+class IndexReloader:
+    """
+    Dựng lại chỉ mục trong thread nền khi file corpus đổi (theo dõi mtime/size mỗi `interval` giây) hoặc khi
+    được gọi (POST /admin/reload), rồi cài thế hệ mới bằng install_generation. Model embedding được dùng lại,
+    Chroma chỉ embed tài liệu mới/đổi. Các yêu cầu đến trong lúc đang dựng được gộp thành một lần dựng tiếp theo.
+    Dựng lỗi thì thế hệ cũ tiếp tục phục vụ.
+    """
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.status = "idle"
+        self.current = None
+        self.last_error = None
+        self.last_trigger = None
+        self.last_reload_s = None
+        self.counters = {"reloads": 0, "failures": 0, "requests": 0, "coalesced": 0}
+        self._pending = False
+        self._running = False
+        self._watcher = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def watched_paths() -> List[str]:
+        if INDEX_SNAPSHOT:
+            # snapshot.py export đổi symlink sang phiên bản mới một cách nguyên tử, manifest.json đổi theo
+            return [os.path.join(INDEX_SNAPSHOT, "manifest.json"), *summary_paths()]
+        return [*summary_paths(), BLOGS_JSONL]
+
+    def _signature(self) -> tuple:
+        signature = []
+        for path in self.watched_paths():
+            try:
+                st = os.stat(path)
+                signature.append((path, st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append((path, None, None))
+        return tuple(signature)
+
+    def request(self, trigger: str = "admin") -> dict:
+        """Yêu cầu reload (không chặn). Trả về trạng thái hiện tại; "warming" nếu chain chưa dựng xong."""
+        with self._lock:
+            if not STARTUP.ready:
+                return {**self._stats_locked(), "status": "warming"}
+            self.counters["requests"] += 1
+            self.last_trigger = trigger
+            self._pending = True
+            if self._running:
+                self.counters["coalesced"] += 1
+            else:
+                self._running, self.status = True, "reloading"
+                threading.Thread(target=self._run, name="rag-reload", daemon=True).start()
+            return self._stats_locked()
+
+    @contextmanager
+    def _stage(self, name: str):
+        self.current = name
+        with span(f"reload_{name}"):
+            yield
+        self.current = None
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._running = False
+                    self.status = "idle" if self.last_error is None else "failed"
+                    return
+                self._pending = False
+                self.status = "reloading"
+            start = time.perf_counter()
+            try:
+                print("⏳ Reload chỉ mục từ corpus...")
+                generation = build_generation(QUERY_EMBEDDINGS, stage=self._stage)
+                install_generation(generation)
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.counters["reloads"] += 1
+                    self.last_error, self.last_reload_s = None, round(elapsed, 3)
+                print(f"✅ Reload xong trong {elapsed:.1f}s: thế hệ {generation.number}, phiên bản {generation.version}.")
+            except Exception as e:
+                logger.exception("index reload failed")
+                with self._lock:
+                    self.counters["failures"] += 1
+                    self.last_error = f"{type(e).__name__}: {e}"
+            finally:
+                self.current = None
+
+    def start_watching(self) -> None:
+        """Thread theo dõi file corpus (idempotent; interval <= 0 thì chỉ reload qua endpoint)."""
+        with self._lock:
+            if self.interval <= 0 or self._watcher is not None:
+                return
+            self._watcher = threading.Thread(target=self._watch, args=(self._signature(),), name="rag-reload-watch", daemon=True)
+            self._watcher.start()
+
+    def _watch(self, seen: tuple) -> None:
+        candidate = None
+        while True:
+            time.sleep(self.interval)
+            signature = self._signature()
+            if signature == seen or not STARTUP.ready:
+                candidate = None
+                continue
+            # Chỉ reload khi file đã đứng yên qua một chu kỳ (tránh đọc file đang được ghi dở)
+            if signature != candidate:
+                candidate = signature
+                continue
+            before = {path: stat for path, *stat in seen}
+            changed = [path for path, *stat in signature if before.get(path) != stat] or ["(file bị xóa)"]
+            logger.info("corpus changed: %s", ", ".join(changed))
+            self.request("watch")
+            seen, candidate = signature, None
+
+    def _stats_locked(self) -> dict:
+        generation = _generation
+        return {
+            **self.counters,
+            "status": self.status,
+            "stage": self.current,
+            "generation": generation.number if generation else None,
+            "version": generation.version if generation else None,
+            "docs": generation.docs if generation else None,
+            "last_trigger": self.last_trigger,
+            "last_reload_s": self.last_reload_s,
+            "last_error": self.last_error,
+            "watching": self._watcher is not None,
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return self._stats_locked()
+
+RELOADER = IndexReloader(RELOAD_WATCH_INTERVAL)
+
+def degraded_answer(question: str, k: int = 3, club_id: Optional[str] = None, has_history: bool = False) -> Optional[dict]:
+    """
+    Trả lời khi chain chưa sẵn sàng: fast path thống kê người chơi nếu khớp, ngược lại các
+    đoạn liên quan nhất theo BM25 (không cần model embedding hay LLM). None nếu chưa có gì.
+    """
+    club_id = config_club(retrieval_config(club_id=club_id))
+    if PLAYER_TABLE is not None:
+        hit = PLAYER_TABLE.for_club(club_id).answer(question, has_history)
+        if hit is not None:
+            answer, players = hit
+            return {"answer": answer, "context": [PLAYER_TABLE.to_document(p) for p in players], "fast_path": True}
+    if LEXICAL_INDEX is None:
+        return None
+    from vectors import matches_filter
+    where = club_filter(club_id)
+    predicate = (lambda d: matches_filter(d.metadata, where)) if where else None
+    docs = [doc for doc, _ in LEXICAL_INDEX.search(question, k, predicate)]
+    if not docs:
+        return None
+    lines = ["⏳ Hệ thống đang khởi động, đây là các đoạn liên quan nhất tìm theo từ khóa:"]
+    for doc in docs:
+        title = doc.metadata.get("title") or doc.metadata.get("player_name") or doc.metadata.get("source", "")
+        snippet = " ".join((doc.page_content.partition("Nội dung: ")[2] or doc.page_content).split()[:50])
+        lines.append(f"- **{title}**: {snippet}...")
+    return {"answer": "\n".join(lines), "context": docs, "degraded": True}
+
+# --- Batch câu hỏi ---
+async def abatch_answer(
+    questions: List[str], top_k=None, concurrency: int = BATCH_LLM_CONCURRENCY, club_id: Optional[str] = None
+) -> AsyncIterator[dict]:
+    """
+    Trả lời nhiều câu hỏi độc lập (không lịch sử), trả kết quả ngay khi xong (không theo thứ tự):
+    câu trùng nhau chỉ xử lý một lần; fast path và cache câu trả lời trước; các câu còn lại được embed
+    trong một lần encode, truy hồi bằng một truy vấn nhiều vector, rồi gọi LLM với độ đồng thời
+    `concurrency`. Mọi câu hỏi dùng chung một CLB (`club_id`).
+    Mỗi kết quả: {"indices", "question", "answer", "sources", ...} hoặc {"error"}.
+    """
+    # Cả batch chạy trên một thế hệ chỉ mục, kể cả khi có reload giữa chừng
+    generation = current_generation()
+    if generation is None:
+        raise RuntimeError("RAG chain chưa sẵn sàng")
+    config = retrieval_config(top_k, club_id)
+    configurable, scope = config["configurable"], cache_scope(config)
+    k, where, club_id = configurable["retriever_kwargs"]["k"], configurable["retriever_kwargs"].get("filter"), configurable["club_id"]
+    player_table = generation.player_table.for_club(club_id)
+    groups: "OrderedDict[str, List[int]]" = OrderedDict()
+    originals: Dict[str, str] = {}
+    for i, question in enumerate(questions):
+        key = normalize_text(question)
+        groups.setdefault(key, []).append(i)
+        originals.setdefault(key, question)
+
+    def item(key: str, answer: str, docs: List["Document"], **flags) -> dict:
+        return {"indices": groups[key], "question": originals[key], "answer": answer, "sources": source_metadata(docs), **flags}
+
+    pending = []
+    for key in groups:
+        hit = player_table.answer(originals[key]) if FAST_PATH_ENABLED else None
+        if hit is None:
+            pending.append(key)
+            continue
+        answer, players = hit
+        yield item(key, answer, [player_table.to_document(p) for p in players], fast_path=True)
+    if not pending:
+        return
+
+    with span("embed"):
+        vectors = await QUERY_EMBEDDINGS.aembed_queries([originals[key] for key in pending])
+    todo = []
+    for key, vector in zip(pending, vectors):
+        hit = ANSWER_CACHE.lookup(vector, scope) if ANSWER_CACHE_ENABLED else None
+        count_cache("answer_cache", hit is not None)
+        if hit is None:
+            todo.append((key, vector))
+            continue
+        _, value = hit
+        yield item(key, value["answer"], value["context"], cache_hit=True)
+    if not todo:
+        return
+
+    loop = asyncio.get_running_loop()
+    with span("vector_search"):
+        retrieved = await loop.run_in_executor(
+            stage_executor("search"), generation.retriever.search_many,
+            [originals[key] for key, _ in todo], [vector for _, vector in todo], k, where,
+        )
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def answer_one(key: str, vector, docs: List["Document"]) -> dict:
+        try:
+            context = traced_pack_context(docs, originals[key])
+            async with semaphore:
+                with llm_priority(BATCH):
+                    answer = await generation.qa_chain.ainvoke({"input": originals[key], "chat_history": [], "context": context})
+            ANSWER_CACHE.store(vector, {"context": context, "answer": answer}, generation.version, scope)
+            return item(
+                key, answer, context,
+                context_tokens=context_tokens(context), context_tokens_raw=raw_context_tokens(context),
+            )
+        except Exception as e:
+            logger.exception("batch question failed: %r", originals[key])
+            return {"indices": groups[key], "question": originals[key], "error": str(e)}
+
+    tasks = [asyncio.ensure_future(answer_one(key, vector, docs)) for (key, vector), docs in zip(todo, retrieved)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Client ngắt kết nối giữa chừng: hủy các câu chưa trả lời
+        for task in tasks:
+            task.cancel()
+
+# --- Streaming ---
+def source_metadata(docs: List["Document"]) -> List[dict]:
+    """Metadata gọn của các tài liệu nguồn để gửi cho client trước khi có câu trả lời."""
+    keys = ("source", "title", "url", "date", "player_id", "player_name")
+    return [{k: d.metadata[k] for k in keys if d.metadata.get(k) is not None} for d in docs]
+
+class _AnswerEvents:
+    """
+    Chuyển các chunk từ rag_chain.stream/astream thành sự kiện (kind, payload):
+    ("sources", docs) khi truy hồi xong, ("token", str) cho từng token, ("done", timing) ở cuối.
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.timing = {
+            "retrieval_s": None, "first_token_s": None, "context_tokens": None, "context_tokens_raw": None,
+            "cache_hit": False, "fast_path": False,
+        }
+
+    def _elapsed(self) -> float:
+        return round(time.perf_counter() - self.start, 3)
+
+    def feed(self, chunk: dict) -> List[Tuple[str, object]]:
+        events = []
+        if chunk.get("cache_hit"):
+            self.timing["cache_hit"] = True
+        if chunk.get("fast_path"):
+            self.timing["fast_path"] = True
+        for key in ("context_tokens", "context_tokens_raw"):
+            if key in chunk:
+                self.timing[key] = chunk[key]
+        if "context" in chunk:
+            self.timing["retrieval_s"] = self._elapsed()
+            events.append(("sources", chunk["context"]))
+        if chunk.get("answer"):
+            if self.timing["first_token_s"] is None:
+                self.timing["first_token_s"] = self._elapsed()
+            events.append(("token", chunk["answer"]))
+        return events
+
+    def done(self) -> Tuple[str, dict]:
+        return "done", {**self.timing, "total_s": self._elapsed()}
+
+def iter_answer_events(chain, inputs: dict, config=None) -> Iterator[Tuple[str, object]]:
+    events = _AnswerEvents()
+    for chunk in chain.stream(inputs, config=config):
+        yield from events.feed(chunk)
+    yield events.done()
+
+async def aiter_answer_events(chain, inputs: dict, config=None) -> AsyncIterator[Tuple[str, object]]:
+    events = _AnswerEvents()
+    async for chunk in chain.astream(inputs, config=config):
+        for event in events.feed(chunk):
+            yield event
+    yield events.done()
@@ -0,0 +1,80 @@
+"""
+Retriever của chain RAG, tách khỏi rag_core để import rag_core không kéo theo langchain_core
+(như llm.py với langchain_groq); build_generation import module này ở stage "imports".
+"""
+import asyncio
+from typing import Any, List, Optional, Tuple
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from lexical import reciprocal_rank_fusion
+from metrics import span
+from rag_core import DEFAULT_TOP_K, HYBRID_CANDIDATES, RRF_K, merge_parent_chunks, stage_executor
+from vectors import matches_filter
+
+
+class DuprRetriever(BaseRetriever):
+    """
+    Retriever tách rõ hai stage: embed câu hỏi rồi tìm theo vector. Ở đường async, embedding đi qua
+    bộ gom batch của CachedEmbeddings và vector search chạy trong thread pool riêng có giới hạn,
+    để không chiếm event loop hay threadpool của Starlette.
+    Nếu có lexical_index, kết quả vector được gộp với BM25 bằng RRF.
+    Kết quả được gộp chunk theo bài gốc (merge_parent_chunks).
+    vector_store theo giao diện vectors.VectorStore (NumPy, Chroma hoặc snapshot), khoảng cách L2 bình phương.
+    """
+    vector_store: Any
+    embeddings: Any
+    lexical_index: Any = None
+    search_kwargs: dict = {"k": 5}
+
+    def _n_candidates(self, k: int) -> int:
+        return max(k, HYBRID_CANDIDATES) if self.lexical_index is not None else k
+
+    def _search(self, query: str, embedding: List[float]) -> List[Document]:
+        k = self.search_kwargs.get("k", DEFAULT_TOP_K)
+        scored = self.vector_store.similarity_search_by_vector_with_relevance_scores(
+            embedding, **{**self.search_kwargs, "k": self._n_candidates(k)}
+        )
+        return self._fuse(query, scored, k, self.search_kwargs.get("filter"))
+
+    def search_many(self, queries: List[str], embeddings: List[List[float]], k: int, where: Optional[dict] = None) -> List[List[Document]]:
+        """Truy hồi cho nhiều câu hỏi bằng một truy vấn nhiều vector (dùng cho batch)."""
+        if not queries:
+            return []
+        where = where or self.search_kwargs.get("filter")
+        scored_lists = self.vector_store.similarity_search_by_vectors(embeddings, k=self._n_candidates(k), filter=where)
+        return [merge_parent_chunks(self._fuse(query, scored, k, where)) for query, scored in zip(queries, scored_lists)]
+
+    def _fuse(self, query: str, scored: List[Tuple[Document, float]], k: int, where: Optional[dict] = None) -> List[Document]:
+        # Embedding đã chuẩn hóa + khoảng cách L2 bình phương của Chroma: cos = 1 - d / 2
+        similarity = {d.metadata.get("doc_id"): round(1 - distance / 2, 4) for d, distance in scored}
+        dense = [d for d, _ in scored]
+        if self.lexical_index is None:
+            fused = dense[:k]
+        else:
+            predicate = (lambda d: matches_filter(d.metadata, where)) if where else None
+            lexical = [doc for doc, _ in self.lexical_index.search(query, self._n_candidates(k), predicate)]
+            fused = reciprocal_rank_fusion([dense, lexical], k, rrf_k=RRF_K)
+        # Bản sao theo request: tài liệu của chỉ mục BM25 được dùng chung giữa các request
+        return [
+            Document(page_content=d.page_content, metadata={**d.metadata, "similarity": similarity.get(d.metadata.get("doc_id"))})
+            for d in fused
+        ]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        with span("embed"):
+            embedding = self.embeddings.embed_query(query)
+        with span("vector_search"):
+            return merge_parent_chunks(self._search(query, embedding))
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        loop = asyncio.get_running_loop()
+        with span("embed"):
+            embedding = await self.embeddings.aembed_query(query)
+        with span("vector_search"):
+            docs = await loop.run_in_executor(stage_executor("search"), self._search, query, embedding)
+            return merge_parent_chunks(docs)
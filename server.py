@@ -1,37 +1,345 @@
 import os
-from typing import List, Tuple
-from fastapi import FastAPI
-from pydantic import BaseModel
+import json
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
+from typing_extensions import Annotated
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, field_validator
+from starlette.background import BackgroundTask
 from dotenv import load_dotenv
-from langchain_core.messages import HumanMessage, AIMessage
-from rag_core import build_rag_chain
+from rag_core import (
+    MAX_TOP_K, LLM_PROVIDER, STARTUP, BATCH_MAX_QUESTIONS, SINGLE_FLIGHT, SINGLE_FLIGHT_ENABLED,
+    abatch_answer, request_key, get_session_store, SESSION_TOKEN_BUDGET, count_tokens, summarize_turns, retrieval_config, cache_stats as rag_cache_stats,
+    aiter_answer_events, source_metadata, start_background_warmup, get_rag_chain, degraded_answer, pipeline_stats,
+    RELOADER, ADMIN_TOKEN, ALL_CLUBS, club_ids,
+    ADMISSION_MAX_CONCURRENT, ADMISSION_PER_CLIENT, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT_S,
+    MAX_REQUEST_BYTES, MAX_MESSAGE_CHARS, MAX_HISTORY_TURNS, MAX_HISTORY_CHARS,
+)
+from admission import AdmissionController, AdmissionRejected
+from llm_scheduler import LLMOverloadedError
+from metrics import register_stats, render_metrics, request_trace
+from sessions import trim_history
 
 load_dotenv()
 app = FastAPI(title="DUPR RAG API")
-rag_chain = None
+WARMING_RETRY_AFTER = os.getenv("WARMING_RETRY_AFTER", "5")
+logger = logging.getLogger("server")
+# Task nền (tóm tắt phiên): event loop chỉ giữ tham chiếu yếu nên phải giữ ở đây đến khi xong
+_BACKGROUND_TASKS = set()
+ADMISSION = AdmissionController(
+    ADMISSION_MAX_CONCURRENT, ADMISSION_PER_CLIENT, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT_S
+)
+
+Message = Annotated[str, Field(min_length=1, max_length=MAX_MESSAGE_CHARS)]
 
 class ChatRequest(BaseModel):
-    message: str
-    history: List[Tuple[str, str]] = []  # [(user, assistant), ...]
+    message: Message
+    # [(user, assistant), ...], bỏ qua khi có session_id
+    history: List[Tuple[str, str]] = Field(default=[], max_length=MAX_HISTORY_TURNS)
+    session_id: Optional[str] = None  # lịch sử lưu phía server, client chỉ gửi câu hỏi mới
+    top_k: Optional[int] = Field(default=None, ge=1, le=MAX_TOP_K)  # độ sâu truy hồi, mặc định DEFAULT_TOP_K
+    club_id: Optional[str] = None  # CLB được hỏi (xem GET /clubs), mặc định TARGET_CLUB_ID; "*" = tất cả
+
+    @field_validator("history")
+    @classmethod
+    def _history_size(cls, history):
+        if sum(len(user) + len(bot) for user, bot in history) > MAX_HISTORY_CHARS:
+            raise ValueError(f"history dài quá {MAX_HISTORY_CHARS} ký tự")
+        return history
 
-def startup():
-    global rag_chain
-    if rag_chain is None:
-        rag_chain = build_rag_chain()
+class BatchRequest(BaseModel):
+    questions: List[Message] = Field(..., min_length=1, max_length=BATCH_MAX_QUESTIONS)
+    top_k: Optional[int] = Field(default=None, ge=1, le=MAX_TOP_K)
+    club_id: Optional[str] = None
 
 @app.on_event("startup")
 def on_start():
-    if not os.getenv("GROQ_API_KEY"):
+    if LLM_PROVIDER == "groq" and not os.getenv("GROQ_API_KEY"):
         raise RuntimeError("Missing GROQ_API_KEY")
-    startup()
+    register_stats(lambda: {**pipeline_stats(), "admission": ADMISSION.stats()})
+    # Không chặn: process bind cổng ngay, model và chỉ mục được tải trong thread nền
+    start_background_warmup()
+
+@app.middleware("http")
+async def limit_request_size(request: Request, call_next):
+    """Từ chối body quá lớn theo Content-Length, trước khi FastAPI đọc và parse JSON."""
+    length = request.headers.get("content-length")
+    if MAX_REQUEST_BYTES and length and length.isdigit() and int(length) > MAX_REQUEST_BYTES:
+        return JSONResponse({"detail": f"Request lớn hơn {MAX_REQUEST_BYTES} byte"}, status_code=413)
+    return await call_next(request)
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request: Request, exc: AdmissionRejected):
+    retry_after = max(1, round(exc.retry_after))
+    return JSONResponse(
+        {"detail": {"status": "rejected", "reason": exc.reason, "retry_after": retry_after}},
+        status_code=exc.status_code,
+        headers={"Retry-After": str(retry_after)},
+    )
+
+@app.exception_handler(LLMOverloadedError)
+async def llm_overloaded(request: Request, exc: LLMOverloadedError):
+    """Groq vẫn báo quá hạn mức sau mọi lượt thử: 503 + Retry-After thay vì 500."""
+    retry_after = max(1, round(exc.retry_after))
+    return JSONResponse(
+        {"detail": {"status": "llm_overloaded", "retry_after": retry_after}},
+        status_code=503,
+        headers={"Retry-After": str(retry_after)},
+    )
+
+@app.get("/healthz")
+def healthz():
+    return {"status": "alive"}
+
+@app.get("/readyz")
+def readyz():
+    state = STARTUP.snapshot()
+    return JSONResponse(state, status_code=200 if STARTUP.ready else 503)
+
+def _not_ready_answer(req: ChatRequest) -> dict:
+    """Câu trả lời suy giảm trong lúc khởi động, hoặc 503 + Retry-After nếu chưa có gì để trả lời."""
+    resp = degraded_answer(req.message, club_id=req.club_id, has_history=bool(_chat_history(req)))
+    if resp is None:
+        raise HTTPException(
+            status_code=503,
+            detail={"status": "warming", **STARTUP.snapshot()},
+            headers={"Retry-After": WARMING_RETRY_AFTER},
+        )
+    return resp
+
+def _check_club(club_id: Optional[str]) -> None:
+    clubs = club_ids()
+    if club_id and club_id != ALL_CLUBS and clubs and club_id not in clubs:
+        raise HTTPException(status_code=404, detail=f"Không có dữ liệu CLB {club_id}")
+
+def _client_id(request: Request) -> str:
+    """Khóa giới hạn theo client: header X-Client-Id (gateway / app gắn vào), nếu không có thì IP."""
+    return request.headers.get("x-client-id") or (request.client.host if request.client else "unknown")
+
+def _deadline(request: Request) -> Optional[float]:
+    """Hạn chót client chấp nhận chờ (header X-Timeout-Ms), dùng để từ chối sớm thay vì để request chết trong hàng đợi."""
+    value = request.headers.get("x-timeout-ms")
+    try:
+        return float(value) / 1000.0 if value else None
+    except ValueError:
+        return None
+
+@asynccontextmanager
+async def _admitted(request: Request):
+    ticket = await ADMISSION.acquire(_client_id(request), _deadline(request))
+    try:
+        yield
+    finally:
+        ticket.release()
+
+def _lc_history(history: List[Tuple[str, str]]):
+    from langchain_core.messages import AIMessage, HumanMessage
 
-@app.post("/chat")
-def chat(req: ChatRequest):
     lc_history = []
-    for user, bot in req.history:
+    for user, bot in trim_history(history, count_tokens, SESSION_TOKEN_BUDGET):
         if user:
             lc_history.append(HumanMessage(content=user))
         if bot:
             lc_history.append(AIMessage(content=bot))
-    resp = rag_chain.invoke({"input": req.message, "chat_history": lc_history})
-    return {"answer": resp["answer"]}
+    return lc_history
+
+def _chat_history(req: ChatRequest):
+    if req.session_id:
+        sessions = get_session_store()
+        return sessions.history(sessions.get_or_create(req.session_id))
+    return _lc_history(req.history)
+
+def _remember_turn(req: ChatRequest, answer: str) -> None:
+    """Lưu lượt vào phiên; tóm tắt các lượt cũ chạy nền, không làm chậm request này."""
+    if not req.session_id or not answer:
+        return
+    session = get_session_store().append(req.session_id, req.message, answer)
+    if session.pending:
+        task = asyncio.create_task(get_session_store().compact(req.session_id, summarize_turns))
+        _BACKGROUND_TASKS.add(task)
+        task.add_done_callback(_background_done)
+
+def _background_done(task: asyncio.Task) -> None:
+    _BACKGROUND_TASKS.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("session compaction failed", exc_info=task.exception())
+
+def _request_path(resp: dict) -> str:
+    for flag in ("degraded", "fast_path", "cache_hit", "coalesced"):
+        if resp.get(flag):
+            return flag
+    return "rag"
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat")
+async def chat(req: ChatRequest, request: Request):
+    _check_club(req.club_id)
+    async with _admitted(request):
+        with request_trace("chat", top_k=req.top_k, club_id=req.club_id) as trace:
+            rag_chain = get_rag_chain()
+            if rag_chain is None:
+                trace["path"] = "warming"
+                resp = _not_ready_answer(req)
+            else:
+                inputs = {"input": req.message, "chat_history": _chat_history(req)}
+
+                def run():
+                    return rag_chain.ainvoke(inputs, config=retrieval_config(req.top_k, req.club_id))
+
+                if SINGLE_FLIGHT_ENABLED:
+                    # Câu hỏi giống hệt đang được xử lý: chờ chung một lần truy hồi + một lần gọi LLM
+                    resp, coalesced = await SINGLE_FLIGHT.do(request_key(req.message, inputs["chat_history"], req.top_k, req.club_id), run)
+                    if coalesced:
+                        resp = {**resp, "coalesced": True}
+                else:
+                    resp = await run()
+            trace["path"] = _request_path(resp)
+            _remember_turn(req, resp["answer"])
+    return {
+        "answer": resp["answer"],
+        "context_tokens": resp.get("context_tokens"),
+        "context_tokens_raw": resp.get("context_tokens_raw"),
+        "cache_hit": resp.get("cache_hit", False),
+        "fast_path": resp.get("fast_path", False),
+        "degraded": resp.get("degraded", False),
+        "coalesced": resp.get("coalesced", False),
+        "timing": trace["stages"],
+        "session_id": req.session_id,
+    }
+
+@app.post("/sessions")
+def create_session():
+    return {"session_id": get_session_store().get_or_create().session_id}
+
+@app.get("/sessions/{session_id}")
+def get_session(session_id: str):
+    session = get_session_store().get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {
+        "session_id": session.session_id,
+        "summary": session.summary,
+        "turns": session.turns,
+        "tokens": session.tokens,
+        "total_turns": session.total_turns,
+    }
+
+@app.delete("/sessions/{session_id}")
+def delete_session(session_id: str):
+    get_session_store().delete(session_id)
+    return {"deleted": session_id}
+
+@app.get("/clubs")
+def clubs():
+    return {"clubs": club_ids()}
+
+@app.get("/metrics")
+def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/cache/stats")
+def cache_stats():
+    return rag_cache_stats()
+
+def _check_admin(token: Optional[str]) -> None:
+    if ADMIN_TOKEN and token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Sai hoặc thiếu X-Admin-Token")
+
+@app.post("/admin/reload")
+def admin_reload(x_admin_token: Optional[str] = Header(default=None)):
+    """Dựng lại chỉ mục từ corpus trong nền rồi thay nguyên tử; request đang chạy hoàn tất trên thế hệ cũ."""
+    _check_admin(x_admin_token)
+    state = RELOADER.request("admin")
+    return JSONResponse(state, status_code=503 if state["status"] == "warming" else 202)
+
+@app.get("/admin/reload")
+def admin_reload_status(x_admin_token: Optional[str] = Header(default=None)):
+    _check_admin(x_admin_token)
+    return RELOADER.stats()
+
+@app.post("/chat/batch")
+async def chat_batch(req: BatchRequest, request: Request):
+    """
+    NDJSON: mỗi dòng là kết quả của một câu hỏi (gồm `indices` trong danh sách gửi lên), trả về ngay
+    khi xong nên thứ tự không theo đầu vào. Câu trùng nhau chỉ được trả lời một lần.
+    """
+    _check_club(req.club_id)
+    if get_rag_chain() is None:
+        raise HTTPException(
+            status_code=503,
+            detail={"status": "warming", **STARTUP.snapshot()},
+            headers={"Retry-After": WARMING_RETRY_AFTER},
+        )
+
+    # Cả batch chiếm một slot (độ đồng thời LLM bên trong đã có BATCH_LLM_CONCURRENCY)
+    ticket = await ADMISSION.acquire(_client_id(request), _deadline(request))
+
+    async def lines():
+        try:
+            with request_trace("chat_batch", questions=len(req.questions), club_id=req.club_id):
+                async for item in abatch_answer(req.questions, top_k=req.top_k, club_id=req.club_id):
+                    yield json.dumps(item, ensure_ascii=False) + "\n"
+        finally:
+            ticket.release()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", background=BackgroundTask(ticket.release))
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest, request: Request):
+    """
+    Server-Sent Events: `sources` (metadata tài liệu truy hồi) -> nhiều `token` -> `done` (timing).
+    Lỗi giữa chừng được gửi dưới dạng sự kiện `error` vì header 200 đã được gửi đi.
+    """
+    _check_club(req.club_id)
+    # Slot giữ đến khi stream kết thúc (generator đóng, hoặc background task nếu client ngắt trước)
+    ticket = await ADMISSION.acquire(_client_id(request), _deadline(request))
+    try:
+        inputs = {"input": req.message, "chat_history": _chat_history(req)}
+        rag_chain = get_rag_chain()
+        degraded = _not_ready_answer(req) if rag_chain is None else None
+    except Exception:
+        ticket.release()
+        raise
+
+    async def events():
+        try:
+            with request_trace("chat_stream", top_k=req.top_k, club_id=req.club_id) as trace:
+                if degraded is not None:
+                    trace["path"] = _request_path(degraded)
+                    yield _sse("sources", source_metadata(degraded["context"]))
+                    yield _sse("token", {"text": degraded["answer"]})
+                    yield _sse("done", {"degraded": degraded.get("degraded", False), "fast_path": degraded.get("fast_path", False)})
+                    return
+                try:
+                    answer = []
+                    async for kind, payload in aiter_answer_events(rag_chain, inputs, retrieval_config(req.top_k, req.club_id)):
+                        if kind == "sources":
+                            yield _sse("sources", source_metadata(payload))
+                        elif kind == "token":
+                            answer.append(payload)
+                            yield _sse("token", {"text": payload})
+                        else:
+                            trace["path"] = _request_path(payload)
+                            _remember_turn(req, "".join(answer))
+                            yield _sse("done", {**payload, "stages": dict(trace["stages"])})
+                except LLMOverloadedError as e:
+                    trace["status"] = "llm_overloaded"
+                    yield _sse("error", {"detail": str(e), "status": "llm_overloaded", "retry_after": max(1, round(e.retry_after))})
+                except Exception as e:
+                    trace["status"] = "error"
+                    yield _sse("error", {"detail": str(e)})
+        finally:
+            ticket.release()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(ticket.release),
+    )
@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import TYPE_CHECKING, Awaitable, Callable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage
+
+Turn = Tuple[str, str]
+
+
+@dataclass
+class Session:
+    session_id: str
+    summary: str = ""
+    turns: List[Turn] = field(default_factory=list)
+    turn_tokens: List[int] = field(default_factory=list)
+    pending: List[Turn] = field(default_factory=list)  # lượt đã ra khỏi cửa sổ, chờ gộp vào tóm tắt
+    total_turns: int = 0
+    updated_at: float = field(default_factory=time.time)
+
+    @property
+    def tokens(self) -> int:
+        return sum(self.turn_tokens)
+
+
+class _SessionDB:
+    """Lưu phiên vào SQLite (JSON), để phiên sống qua lần khởi động lại / nhiều worker dùng chung."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT, updated_at REAL)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[Session]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if not row:
+            return None
+        data = json.loads(row[0])
+        data["turns"] = [tuple(t) for t in data.get("turns", [])]
+        data["pending"] = [tuple(t) for t in data.get("pending", [])]
+        return Session(**data)
+
+    def put(self, session: Session) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, updated_at) VALUES (?, ?, ?)",
+                (session.session_id, json.dumps(asdict(session), ensure_ascii=False), session.updated_at),
+            )
+            self._conn.commit()
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self._conn.commit()
+
+    def purge(self, older_than: float) -> int:
+        with self._lock:
+            n = self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (older_than,)).rowcount
+            self._conn.commit()
+        return n
+
+
+class SessionStore:
+    """
+    Lịch sử hội thoại phía server: LRU + TTL trong bộ nhớ (tối đa `max_sessions` phiên), SQLite tùy chọn.
+    Mỗi phiên giữ các lượt gần nhất trong ngân sách `token_budget`; lượt cũ hơn bị đẩy ra và được gộp
+    vào một bản tóm tắt cuốn chiếu (tối đa `summary_tokens`), nên prompt mỗi lượt có kích thước gần như cố định.
+    """
+
+    def __init__(
+        self,
+        count_tokens: Callable[[str], int],
+        max_sessions: int = 10000,
+        ttl: float = 86400.0,
+        token_budget: int = 1000,
+        summary_tokens: int = 200,
+        path: str = "",
+    ):
+        self.count_tokens = count_tokens
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._db = _SessionDB(path) if path else None
+        self.counters = {"created": 0, "expired": 0, "evicted": 0, "compactions": 0, "turns": 0}
+
+    # --- truy cập ---
+    def _expired(self, session: Session) -> bool:
+        return time.time() - session.updated_at > self.ttl
+
+    def get(self, session_id: str) -> Optional[Session]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None and self._db:
+                session = self._db.get(session_id)
+            if session is None:
+                return None
+            if self._expired(session):
+                self.delete(session_id)
+                self.counters["expired"] += 1
+                return None
+            self._remember(session)
+            return session
+
+    def get_or_create(self, session_id: Optional[str] = None) -> Session:
+        with self._lock:
+            session = self.get(session_id) if session_id else None
+            if session is None:
+                session = Session(session_id=session_id or uuid.uuid4().hex)
+                self.counters["created"] += 1
+                self._remember(session)
+            return session
+
+    def _remember(self, session: Session) -> None:
+        self._sessions[session.session_id] = session
+        self._sessions.move_to_end(session.session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.counters["evicted"] += 1
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            if self._db:
+                self._db.delete(session_id)
+
+    # --- lịch sử ---
+    def history(self, session: Session) -> List["BaseMessage"]:
+        """Tóm tắt (nếu có) + các lượt trong cửa sổ, dạng message cho MessagesPlaceholder("chat_history")."""
+        from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+        with self._lock:
+            messages: List["BaseMessage"] = []
+            if session.summary:
+                messages.append(SystemMessage(content=f"Tóm tắt các lượt hội thoại trước: {session.summary}"))
+            for user, bot in session.turns:
+                messages.append(HumanMessage(content=user))
+                messages.append(AIMessage(content=bot))
+            return messages
+
+    def append(self, session_id: str, user: str, assistant: str) -> Session:
+        """Thêm một lượt; các lượt cũ vượt ngân sách token được chuyển sang `pending` để tóm tắt."""
+        with self._lock:
+            session = self.get_or_create(session_id)
+            session.turns.append((user, assistant))
+            session.turn_tokens.append(self.count_tokens(user) + self.count_tokens(assistant))
+            session.total_turns += 1
+            session.updated_at = time.time()
+            # Luôn giữ lượt mới nhất, kể cả khi nó đã vượt ngân sách
+            while len(session.turns) > 1 and session.tokens > self.token_budget:
+                session.pending.append(session.turns.pop(0))
+                session.turn_tokens.pop(0)
+            self.counters["turns"] += 1
+            self._persist(session)
+            return session
+
+    async def compact(self, session_id: str, summarize: Optional[Callable[[str, List[Turn]], Awaitable[str]]] = None) -> None:
+        """
+        Gộp các lượt `pending` vào tóm tắt. Chạy sau khi đã trả lời (ngoài đường găng của request).
+        `summarize(summary, turns)` là LLM tóm tắt; thiếu hoặc lỗi thì dùng tóm tắt trích xuất (câu hỏi cũ).
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or not session.pending:
+                return
+            pending, session.pending = session.pending, []
+            previous = session.summary
+        summary = None
+        if summarize is not None:
+            try:
+                summary = (await summarize(previous, pending)).strip()
+            except Exception:
+                summary = None
+        if not summary:
+            summary = self._extractive_summary(previous, pending)
+        with self._lock:
+            session.summary = self._truncate(summary)
+            self.counters["compactions"] += 1
+            self._persist(session)
+
+    def _extractive_summary(self, previous: str, turns: List[Turn]) -> str:
+        questions = "; ".join(user.strip() for user, _ in turns if user.strip())
+        return f"{previous} Người dùng đã hỏi: {questions}.".strip() if questions else previous
+
+    def _truncate(self, text: str) -> str:
+        # Giữ phần mới nhất của tóm tắt trong ngân sách summary_tokens
+        words = text.split()
+        while words and self.count_tokens(" ".join(words)) > self.summary_tokens:
+            words = words[max(1, len(words) // 10):]
+        return " ".join(words)
+
+    def _persist(self, session: Session) -> None:
+        if self._db:
+            self._db.put(session)
+            if self.counters["turns"] % 100 == 0:
+                self._db.purge(time.time() - self.ttl)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, "size": len(self._sessions)}
+
+
+def trim_history(history: List[Turn], count_tokens: Callable[[str], int], token_budget: int) -> List[Turn]:
+    """Cho client vẫn gửi `history`: chỉ giữ các lượt gần nhất trong ngân sách token."""
+    kept, used = [], 0
+    for user, bot in reversed(history):
+        tokens = count_tokens(user or "") + count_tokens(bot or "")
+        if kept and used + tokens > token_budget:
+            break
+        kept.append((user, bot))
+        used += tokens
+    return kept[::-1]
@@ -0,0 +1,316 @@
+"""
+Snapshot chỉ mục dựng sẵn, mở read-only bằng mmap để nhiều replica / worker dùng chung page cache:
+    python snapshot.py export --out snapshots/dupr --dtype int8     # từ ChromaDB đã ingest (CI)
+    python snapshot.py info snapshots/dupr                           # kiểm tra + thời gian mở
+Serving: INDEX_SNAPSHOT=snapshots/dupr -> build_rag_chain bỏ qua đọc corpus, đồng bộ Chroma và dựng BM25.
+
+`--out snapshots/dupr` là symlink tới thư mục phiên bản `snapshots/dupr.<thời điểm>`; export ghi phiên bản mới
+rồi đổi symlink nguyên tử (os.replace), nên replica mở/reload lúc nào cũng thấy một snapshot đầy đủ.
+
+Thư mục snapshot:
+    manifest.json   định dạng, model embedding, phiên bản corpus (index_version), số dòng, chiều, dtype
+    vectors.npy     ma trận (n, d) float16 hoặc int8 (np.load mmap_mode="r")
+    scales.npy      hệ số của từng dòng khi int8 (v ~= q * scale)
+    norms.npy       |v|^2 gốc (float32) để tính khoảng cách L2 bình phương như Chroma
+    meta.sqlite     doc_id, page_content, metadata (JSON) theo số dòng
+    bm25_index.json chỉ mục BM25 cùng phiên bản (nếu có)
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from langchain_core.documents import Document
+
+SNAPSHOT_FORMAT = 1
+_SEARCH_CHUNK_ROWS = 65536  # số dòng giải lượng tử mỗi lần khi quét, giới hạn bộ nhớ tạm
+
+
+def export_snapshot(
+    collection,
+    out_dir: str,
+    embedding_model: str,
+    version: Optional[str],
+    dtype: str = "float16",
+    lexical_path: Optional[str] = None,
+    page_size: int = 2048,
+) -> dict:
+    """Ghi collection Chroma ra snapshot theo từng trang (bộ nhớ không phụ thuộc kích thước chỉ mục)."""
+    if dtype not in ("float16", "int8"):
+        raise ValueError(f"dtype không hỗ trợ: {dtype!r} (float16 | int8)")
+    count = collection.count()
+    if not count:
+        raise RuntimeError("Collection rỗng, không có gì để export")
+    first = collection.get(limit=1, include=["embeddings"])
+    dim = len(first["embeddings"][0])
+
+    tmp_dir = f"{out_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    vectors = np.lib.format.open_memmap(os.path.join(tmp_dir, "vectors.npy"), mode="w+", dtype=dtype, shape=(count, dim))
+    norms = np.lib.format.open_memmap(os.path.join(tmp_dir, "norms.npy"), mode="w+", dtype=np.float32, shape=(count,))
+    scales = (np.lib.format.open_memmap(os.path.join(tmp_dir, "scales.npy"), mode="w+", dtype=np.float32, shape=(count,))
+              if dtype == "int8" else None)
+    conn = sqlite3.connect(os.path.join(tmp_dir, "meta.sqlite"))
+    conn.execute("CREATE TABLE docs (row INTEGER PRIMARY KEY, doc_id TEXT, page_content TEXT, metadata TEXT)")
+
+    row = 0
+    for offset in range(0, count, page_size):
+        page = collection.get(limit=page_size, offset=offset, include=["embeddings", "documents", "metadatas"])
+        block = np.asarray(page["embeddings"], dtype=np.float32)
+        n = min(len(block), count - row)
+        block = block[:n]
+        norms[row:row + n] = (block * block).sum(axis=1)
+        if scales is None:
+            vectors[row:row + n] = block.astype(np.float16)
+        else:
+            scale = np.abs(block).max(axis=1) / 127.0
+            scale[scale == 0] = 1.0
+            vectors[row:row + n] = np.round(block / scale[:, None]).astype(np.int8)
+            scales[row:row + n] = scale
+        conn.executemany(
+            "INSERT INTO docs (row, doc_id, page_content, metadata) VALUES (?, ?, ?, ?)",
+            [
+                (row + i, page["ids"][i], page["documents"][i], json.dumps(page["metadatas"][i] or {}, ensure_ascii=False))
+                for i in range(n)
+            ],
+        )
+        row += n
+    conn.execute("CREATE INDEX docs_doc_id ON docs (doc_id)")
+    conn.commit()
+    conn.close()
+    for array in (vectors, norms, scales):
+        if array is not None:
+            array.flush()
+    del vectors, norms, scales
+
+    lexical = False
+    if lexical_path and os.path.exists(lexical_path):
+        with open(lexical_path, "r", encoding="utf-8") as f:
+            lexical = json.load(f).get("version") == version
+        if lexical:
+            shutil.copyfile(lexical_path, os.path.join(tmp_dir, "bm25_index.json"))
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "embedding_model": embedding_model,
+        "version": version,
+        "count": row,
+        "dim": dim,
+        "dtype": dtype,
+        "lexical": lexical,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    _publish(tmp_dir, out_dir)
+    return manifest
+
+
+def _publish(tmp_dir: str, out_dir: str) -> None:
+    """
+    Đổi tên `tmp_dir` thành thư mục phiên bản rồi trỏ symlink `out_dir` sang đó bằng os.replace (nguyên tử).
+    Giữ lại phiên bản vừa bị thay (replica có thể đang mở), xóa các phiên bản cũ hơn.
+    """
+    out_dir = out_dir.rstrip(os.sep)
+    version_dir = f"{out_dir}.{time.strftime('%Y%m%d%H%M%S', time.gmtime())}-{os.getpid()}"
+    os.replace(tmp_dir, version_dir)
+    previous = os.path.realpath(out_dir) if os.path.islink(out_dir) else None
+    if os.path.isdir(out_dir) and not os.path.islink(out_dir):
+        # Snapshot cũ là thư mục thật (định dạng trước): dời sang một bên một lần để thay bằng symlink
+        previous = f"{out_dir}.legacy"
+        shutil.rmtree(previous, ignore_errors=True)
+        os.replace(out_dir, previous)
+    link_tmp = f"{out_dir}.link.tmp"
+    if os.path.lexists(link_tmp):
+        os.remove(link_tmp)
+    os.symlink(os.path.basename(version_dir), link_tmp)
+    os.replace(link_tmp, out_dir)
+
+    parent = os.path.dirname(out_dir) or "."
+    pattern = re.compile(re.escape(os.path.basename(out_dir)) + r"\.(\d{14}-\d+|legacy)$")
+    keep = {os.path.realpath(version_dir), previous}
+    for name in os.listdir(parent):
+        path = os.path.join(parent, name)
+        if pattern.match(name) and os.path.realpath(path) not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class SnapshotVectorStore:
+    """
+    Vector store chỉ đọc trên snapshot: tìm kiếm chính xác (quét toàn bộ, nhân ma trận theo khối)
+    trên vector mmap. Trả về khoảng cách L2 bình phương giống Chroma để DuprRetriever dùng chung công thức
+    cos = 1 - d / 2. Metadata được đọc từ SQLite chỉ cho các dòng trúng.
+    """
+
+    def __init__(self, path: str, manifest: dict):
+        self.path = path
+        self.manifest = manifest
+        self.version = manifest.get("version")
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.norms = np.load(os.path.join(path, "norms.npy"), mmap_mode="r")
+        scales_path = os.path.join(path, "scales.npy")
+        self.scales = np.load(scales_path, mmap_mode="r") if manifest["dtype"] == "int8" else None
+        self._conn = sqlite3.connect(f"file:{os.path.join(path, 'meta.sqlite')}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._masks: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+    @classmethod
+    def open(cls, path: str, embedding_model: Optional[str] = None) -> "SnapshotVectorStore":
+        # Phân giải symlink một lần: mọi file đọc từ cùng một phiên bản dù export đổi link giữa chừng
+        path = os.path.realpath(path)
+        with open(os.path.join(path, "manifest.json"), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(f"Định dạng snapshot không hỗ trợ: {manifest.get('format')}")
+        if embedding_model and manifest.get("embedding_model") != embedding_model:
+            raise ValueError(
+                f"Snapshot dựng bằng {manifest.get('embedding_model')!r}, server đang dùng {embedding_model!r}"
+            )
+        return cls(path, manifest)
+
+    def lexical_index(self):
+        from lexical import BM25Index
+        return BM25Index.load(os.path.join(self.path, "bm25_index.json")) if self.manifest.get("lexical") else None
+
+    # --- lọc metadata ---
+    def _mask(self, where: Optional[dict]) -> Optional[np.ndarray]:
+        """Mask các dòng thỏa `where` (bộ lọc kiểu Chroma: $eq/$ne/$in/$nin, $and/$or), cache theo bộ lọc."""
+        if not where:
+            return None
+        key = json.dumps(where, sort_keys=True, ensure_ascii=False)
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is None:
+                sql, params = self._where_sql(where)
+                rows = [r[0] for r in self._conn.execute(f"SELECT row FROM docs WHERE {sql}", params)]
+                mask = np.zeros(len(self.norms), dtype=bool)
+                mask[rows] = True
+                self._masks[key] = mask
+                while len(self._masks) > 64:
+                    self._masks.popitem(last=False)
+            else:
+                self._masks.move_to_end(key)
+            return mask
+
+    def _where_sql(self, where: dict) -> Tuple[str, list]:
+        clauses, params = [], []
+        for field, cond in where.items():
+            if field in ("$and", "$or"):
+                parts = [self._where_sql(c) for c in cond]
+                clauses.append("(" + f" {field[1:].upper()} ".join(p[0] for p in parts) + ")")
+                params.extend(x for p in parts for x in p[1])
+            else:
+                # Cùng ngữ nghĩa với vectors.matches_filter: thiếu trường thì $ne/$nin khớp, $eq/$in không
+                column = "json_extract(metadata, ?)"
+                for op, value in (cond if isinstance(cond, dict) else {"$eq": cond}).items():
+                    if op == "$eq":
+                        clauses.append(f"{column} = ?")
+                        params.extend([f"$.{field}", value])
+                    elif op == "$ne":
+                        clauses.append(f"({column} IS NULL OR {column} != ?)")
+                        params.extend([f"$.{field}", f"$.{field}", value])
+                    elif op in ("$in", "$nin"):
+                        values = list(value)
+                        if not values:
+                            clauses.append("0" if op == "$in" else "1")
+                            continue
+                        placeholders = ",".join("?" * len(values))
+                        if op == "$in":
+                            clauses.append(f"{column} IN ({placeholders})")
+                            params.extend([f"$.{field}", *values])
+                        else:
+                            clauses.append(f"({column} IS NULL OR {column} NOT IN ({placeholders}))")
+                            params.extend([f"$.{field}", f"$.{field}", *values])
+                    else:
+                        raise ValueError(f"Toán tử lọc không hỗ trợ: {op}")
+        return " AND ".join(clauses) or "1", params
+
+    # --- tìm kiếm ---
+    def search(self, queries: np.ndarray, k: int, where: Optional[dict] = None) -> List[List[Tuple[int, float]]]:
+        """Top-k (dòng, khoảng cách L2 bình phương) cho từng câu hỏi trong `queries` (m, d)."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        q_norms = (queries * queries).sum(axis=1)
+        mask = self._mask(where)
+        n = len(self.norms)
+        best_rows: List[np.ndarray] = []
+        best_dist: List[np.ndarray] = []
+        for start in range(0, n, _SEARCH_CHUNK_ROWS):
+            end = min(n, start + _SEARCH_CHUNK_ROWS)
+            block = np.asarray(self.vectors[start:end], dtype=np.float32)
+            if self.scales is not None:
+                block *= self.scales[start:end, None]
+            dist = q_norms[:, None] + self.norms[start:end][None, :] - 2.0 * (queries @ block.T)
+            if mask is not None:
+                dist[:, ~mask[start:end]] = np.inf
+            kk = min(k, end - start)
+            idx = np.argpartition(dist, kk - 1, axis=1)[:, :kk]
+            best_rows.append(idx + start)
+            best_dist.append(np.take_along_axis(dist, idx, axis=1))
+        rows = np.concatenate(best_rows, axis=1)
+        dist = np.concatenate(best_dist, axis=1)
+        order = np.argsort(dist, axis=1)[:, :k]
+        results = []
+        for i in range(len(queries)):
+            results.append([
+                (int(rows[i, j]), float(max(0.0, dist[i, j]))) for j in order[i] if np.isfinite(dist[i, j])
+            ])
+        return results
+
+    def documents(self, rows: Sequence[int]) -> Dict[int, Document]:
+        if not rows:
+            return {}
+        marks = ",".join("?" * len(rows))
+        with self._lock:
+            found = self._conn.execute(
+                f"SELECT row, page_content, metadata FROM docs WHERE row IN ({marks})", [int(r) for r in rows]
+            ).fetchall()
+        return {row: Document(page_content=text, metadata=json.loads(meta)) for row, text, meta in found}
+
+    def similarity_search_by_vectors(self, embeddings, k: int = 4, filter: Optional[dict] = None, **kwargs) -> List[List[Tuple[Document, float]]]:
+        results = self.search(np.asarray(embeddings, dtype=np.float32), k, where=filter)
+        docs = self.documents(sorted({row for hits in results for row, _ in hits}))
+        return [[(docs[row], distance) for row, distance in hits] for hits in results]
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k: int = 4, filter: Optional[dict] = None, **kwargs):
+        return self.similarity_search_by_vectors([embedding], k=k, filter=filter)[0]
+
+
+def main(argv=None) -> int:
+    import rag_core
+
+    parser = argparse.ArgumentParser(description="Export / kiểm tra snapshot chỉ mục mmap.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="Ghi collection ChromaDB (PERSIST_DIRECTORY) ra snapshot")
+    export.add_argument("--out", required=True)
+    export.add_argument("--dtype", choices=("float16", "int8"), default="float16")
+    info = sub.add_parser("info", help="In manifest và thời gian mở snapshot")
+    info.add_argument("path")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        collection = rag_core._open_vector_store(None)._collection
+        manifest = export_snapshot(
+            collection, args.out, rag_core.embedding_model_id(), rag_core._load_manifest().get("version"),
+            dtype=args.dtype, lexical_path=rag_core.LEXICAL_INDEX_PATH,
+        )
+        print(json.dumps(manifest, ensure_ascii=False, indent=2))
+        print(f"✅ Đã export snapshot: {args.out}")
+        return 0
+
+    start = time.perf_counter()
+    store = SnapshotVectorStore.open(args.path)
+    opened_ms = (time.perf_counter() - start) * 1000
+    size = sum(os.path.getsize(os.path.join(args.path, f)) for f in os.listdir(args.path))
+    print(json.dumps({**store.manifest, "open_ms": round(opened_ms, 2), "size_bytes": size}, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
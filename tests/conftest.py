@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Các module nằm phẳng ở gốc repo (rag_core.py, admission.py, ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_admits_immediately_when_slot_free():
+    async def scenario():
+        ctrl = AdmissionController(max_concurrent=2)
+        ticket = await ctrl.acquire("a")
+        assert ctrl.active == 1
+        ticket.release()
+        ticket.release()  # gọi lại không trừ hai lần
+        assert ctrl.active == 0
+        assert ctrl.stats()["clients"] == 0
+
+    run(scenario())
+
+
+def test_freed_slot_goes_to_waiter_without_changing_active():
+    async def scenario():
+        ctrl = AdmissionController(max_concurrent=1, queue_timeout_s=5.0)
+        first = await ctrl.acquire("a")
+        waiter = asyncio.ensure_future(ctrl.acquire("b"))
+        await asyncio.sleep(0)
+        assert ctrl.waiting == 1 and ctrl.active == 1
+        first.release()
+        second = await waiter
+        assert ctrl.active == 1 and ctrl.waiting == 0
+        assert ctrl.counters["queued"] == 1
+        second.release()
+        assert ctrl.active == 0
+
+    run(scenario())
+
+
+def test_per_client_limit_counts_waiting_requests():
+    async def scenario():
+        ctrl = AdmissionController(max_concurrent=1, per_client=1, queue_timeout_s=5.0)
+        ticket = await ctrl.acquire("a")
+        with pytest.raises(AdmissionRejected) as exc:
+            await ctrl.acquire("a")
+        assert exc.value.status_code == 429
+        assert exc.value.retry_after >= 1.0
+        ticket.release()
+
+    run(scenario())
+
+
+def test_queue_full_rejected_with_503():
+    async def scenario():
+        ctrl = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout_s=5.0)
+        ticket = await ctrl.acquire("a")
+        waiter = asyncio.ensure_future(ctrl.acquire("b"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as exc:
+            await ctrl.acquire("c")
+        assert exc.value.status_code == 503
+        assert ctrl.counters["rejected_queue_full"] == 1
+        ticket.release()
+        (await waiter).release()
+
+    run(scenario())
+
+
+def test_rejects_early_when_estimated_wait_exceeds_deadline():
+    async def scenario():
+        ctrl = AdmissionController(max_concurrent=1, queue_timeout_s=5.0)
+        ctrl._service_s = 3.0
+        ticket = await ctrl.acquire("a")
+        with pytest.raises(AdmissionRejected) as exc:
+            await ctrl.acquire("b", timeout=1.0)
+        assert exc.value.status_code == 503
+        assert ctrl.counters["rejected_deadline"] == 1
+        assert ctrl.waiting == 0
+        ticket.release()
+
+    run(scenario())
+
+
+def test_timeout_releases_client_reservation():
+    async def scenario():
+        ctrl = AdmissionController(max_concurrent=1, per_client=1, queue_timeout_s=0.05)
+        ctrl._service_s = 0.01
+        ticket = await ctrl.acquire("a")
+        with pytest.raises(AdmissionRejected) as exc:
+            await ctrl.acquire("b")
+        assert exc.value.status_code == 503
+        assert ctrl.counters["timed_out"] == 1
+        assert "b" not in ctrl._clients
+        ticket.release()
+        assert ctrl.active == 0
+        # Client "b" không bị kẹt bởi lần chờ hết hạn
+        (await ctrl.acquire("b")).release()
+
+    run(scenario())
+
+
+def test_cancelled_waiter_does_not_leak_slot():
+    async def scenario():
+        ctrl = AdmissionController(max_concurrent=1, queue_timeout_s=5.0)
+        ticket = await ctrl.acquire("a")
+        waiter = asyncio.ensure_future(ctrl.acquire("b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert ctrl.waiting == 0 and "b" not in ctrl._clients
+        ticket.release()
+        assert ctrl.active == 0
+
+    run(scenario())
+
+
+def test_slot_granted_while_cancelling_is_not_lost():
+    async def scenario():
+        ctrl = AdmissionController(max_concurrent=1, queue_timeout_s=5.0)
+        ticket = await ctrl.acquire("a")
+        cancelled = asyncio.ensure_future(ctrl.acquire("b"))
+        nxt = asyncio.ensure_future(ctrl.acquire("c"))
+        await asyncio.sleep(0)
+        # Slot được trao cho "b" rồi "b" bị hủy trước khi kịp chạy tiếp: tùy phiên bản Python,
+        # wait_for trả về Ticket hoặc ném CancelledError (slot chuyển sang "c"). Không được mất slot.
+        ticket.release()
+        cancelled.cancel()
+        try:
+            (await cancelled).release()
+        except asyncio.CancelledError:
+            pass
+        third = await nxt
+        assert ctrl.active == 1
+        third.release()
+        assert ctrl.active == 0 and ctrl.waiting == 0
+        assert ctrl.stats()["clients"] == 0
+
+    run(scenario())
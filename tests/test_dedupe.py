@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+import rag_core
+from rag_core import canonical_url, dedupe_records, simhash, simhash_bands
+
+ARTICLE = " ".join(
+    f"Giải pickleball mở rộng lần {i} có nhiều vận động viên tham gia ở nội dung đơn và đôi." for i in range(30)
+)
+
+
+def test_canonical_url_drops_tracking_and_fragment():
+    assert canonical_url("HTTPS://Example.com/blog/post/?utm_source=x&b=2&a=1#top") == "https://example.com/blog/post?a=1&b=2"
+    assert canonical_url("https://example.com/") == "https://example.com/"
+
+
+def test_drops_url_and_content_duplicates():
+    records = [
+        {"url": "https://example.com/a?utm_campaign=x", "content": "Bài A"},
+        {"url": "https://example.com/a/", "content": "Bài khác"},
+        {"url": "https://example.com/b", "content": "  bài   A \u200b"},
+        {"url": "https://example.com/c", "content": "Bài C"},
+    ]
+    kept = list(dedupe_records(records))
+    assert [r["url"] for r in kept] == ["https://example.com/a", "https://example.com/c"]
+    # Bản ghi gốc không bị sửa
+    assert records[0]["url"].endswith("utm_campaign=x")
+
+
+def test_near_duplicate_within_threshold(monkeypatch):
+    repost = ARTICLE.replace("lần 7 ", "lần bảy ")
+    distance = bin(simhash(ARTICLE) ^ simhash(repost)).count("1")
+    assert 0 < distance < 32
+    monkeypatch.setattr(rag_core, "NEAR_DUP_MAX_HAMMING", distance)
+    records = [
+        {"url": "https://a.example/post", "content": ARTICLE},
+        {"url": "https://b.example/repost", "content": repost},
+        {"url": "https://c.example/other", "content": "Hướng dẫn luật giao bóng trong pickleball cho người mới bắt đầu."},
+    ]
+    kept = list(dedupe_records(records))
+    assert [r["url"] for r in kept] == ["https://a.example/post", "https://c.example/other"]
+
+
+def test_near_duplicate_disabled_with_negative_threshold(monkeypatch):
+    monkeypatch.setattr(rag_core, "NEAR_DUP_MAX_HAMMING", -1)
+    records = [{"url": "https://a.example", "content": ARTICLE}, {"url": "https://b.example", "content": ARTICLE + " Hết."}]
+    assert len(list(dedupe_records(records))) == 2
+
+
+@pytest.mark.parametrize("max_hamming", [0, 3, 6, 10, 63, 100])
+def test_simhash_bands_cover_all_bits(max_hamming):
+    bands = simhash_bands(max_hamming)
+    assert len(bands) == min(max_hamming + 1, 64)
+    covered = 0
+    for shift, mask in bands:
+        assert covered & (mask << shift) == 0
+        covered |= mask << shift
+    assert covered == (1 << 64) - 1
+
+
+@pytest.mark.parametrize("max_hamming", [3, 6, 10])
+def test_simhash_bands_share_a_band_within_threshold(max_hamming):
+    # Nguyên lý Dirichlet: lệch <= max_hamming bit thì ít nhất một dải giống hệt nhau
+    rng = random.Random(max_hamming)
+    bands = simhash_bands(max_hamming)
+    for _ in range(500):
+        a = rng.getrandbits(64)
+        b = a
+        for bit in rng.sample(range(64), max_hamming):
+            b ^= 1 << bit
+        assert any((a >> shift & mask) == (b >> shift & mask) for shift, mask in bands)
@@ -0,0 +1,174 @@
+import asyncio
+
+import pytest
+
+from llm_scheduler import (
+    BATCH, INTERACTIVE, LLMOverloadedError, LLMScheduler, PriorityGate, TokenBucket, retry_info,
+)
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeAPIError(Exception):
+    """Giống lỗi SDK: có status_code và response.headers."""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = FakeResponse(status_code, {"retry-after": str(retry_after)} if retry_after is not None else {})
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_retry_info():
+    assert retry_info(FakeAPIError(429, 1.5)) == (True, 429, 1.5)
+    assert retry_info(FakeAPIError(503)) == (True, 503, None)
+    assert retry_info(FakeAPIError(400)) == (False, 400, None)
+    assert retry_info(ValueError("x")) == (False, None, None)
+
+
+def test_token_bucket_reserve_and_adjust():
+    bucket = TokenBucket(60)  # 1 đơn vị/giây
+    assert bucket.reserve(30) == 0.0
+    # Vượt mức: trả về thời gian chờ để bù khoản nợ
+    assert bucket.reserve(40) == pytest.approx(10.0, abs=0.1)
+    bucket.adjust(-40)  # hoàn lại
+    assert bucket.available() == pytest.approx(30.0, abs=0.1)
+    bucket.adjust(-1000)  # không vượt dung lượng
+    assert bucket.available() == pytest.approx(60.0, abs=0.1)
+
+
+def test_token_bucket_floor_reserved_for_interactive():
+    bucket = TokenBucket(100)
+    # Việc nền phải chừa 20% dung lượng
+    assert bucket.reserve(80, floor=0.2) == 0.0
+    assert bucket.reserve(10, floor=0.2) > 0.0
+
+
+def test_429_refunds_tokens_and_pauses_model():
+    scheduler = LLMScheduler(rpm=60, tpm=6000, max_retries=2)
+    limiter = scheduler.limiter("m")
+    before = limiter.tokens.available()
+    scheduler._pace("m", 500, INTERACTIVE)
+    assert limiter.tokens.available() == pytest.approx(before - 500, abs=1)
+
+    wait = scheduler._on_error("m", 500, FakeAPIError(429, 2.0), attempt=0)
+    assert wait >= 2.0
+    assert scheduler.counters["rate_limited"] == 1 and scheduler.counters["retries"] == 1
+    # Bucket bị xả về 0 và tạm dừng theo Retry-After: lời gọi kế tiếp phải chờ
+    assert limiter.tokens.available() <= 1
+    assert limiter.requests.reserve(1) >= 1.5
+
+
+def test_429_after_last_attempt_raises_overloaded():
+    scheduler = LLMScheduler(rpm=60, tpm=6000, max_retries=1)
+    with pytest.raises(LLMOverloadedError) as exc:
+        scheduler._on_error("m", 100, FakeAPIError(429, 3.0), attempt=1)
+    assert exc.value.retry_after == 3.0
+    assert scheduler.counters["overloaded"] == 1
+
+
+def test_non_retryable_error_is_raised():
+    scheduler = LLMScheduler()
+    with pytest.raises(FakeAPIError):
+        scheduler._on_error("m", 100, FakeAPIError(400), attempt=0)
+    assert scheduler.counters["server_errors"] == 1 and scheduler.counters["retries"] == 0
+
+
+def test_call_retries_and_reconciles_usage():
+    scheduler = LLMScheduler(tpm=6000, retry_base_s=0.001, retry_max_s=0.001)
+    attempts = []
+
+    async def fn():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise FakeAPIError(503)
+        return "ok"
+
+    assert run(scheduler.call("m", 100, fn, usage=lambda _: 40)) == "ok"
+    assert len(attempts) == 2
+    assert scheduler.counters["calls"] == 2 and scheduler.counters["retries"] == 1
+    # 2 lần ước lượng 100 token, đối soát lần thành công về 40 thực tế
+    limiter = scheduler.limiter("m")
+    assert limiter.tokens.capacity - limiter.tokens.available() == pytest.approx(140, abs=1)
+
+
+def test_hedged_backup_wins_when_primary_is_slow():
+    scheduler = LLMScheduler(hedge_after_s=0.02)
+    primary_cancelled = []
+
+    async def primary():
+        try:
+            await asyncio.sleep(1.0)
+            return "primary"
+        except asyncio.CancelledError:
+            primary_cancelled.append(True)
+            raise
+
+    async def backup():
+        return "backup"
+
+    async def scenario():
+        result = await scheduler.hedged(primary, backup)
+        await asyncio.sleep(0)
+        return result
+
+    assert run(scenario()) == "backup"
+    assert scheduler.counters["hedged"] == 1 and scheduler.counters["hedge_wins"] == 1
+    assert primary_cancelled
+
+
+def test_hedged_skips_backup_when_primary_is_fast():
+    scheduler = LLMScheduler(hedge_after_s=0.5)
+    called = []
+
+    async def primary():
+        return "primary"
+
+    async def backup():
+        called.append(True)
+        return "backup"
+
+    assert run(scheduler.hedged(primary, backup)) == "primary"
+    assert not called and scheduler.counters["hedged"] == 0
+
+
+def test_hedged_falls_back_when_primary_fails():
+    scheduler = LLMScheduler(hedge_after_s=0.01)
+
+    async def primary():
+        await asyncio.sleep(0.05)
+        raise FakeAPIError(500)
+
+    async def backup():
+        await asyncio.sleep(0.1)
+        return "backup"
+
+    assert run(scheduler.hedged(primary, backup)) == "backup"
+
+
+def test_priority_gate_prefers_interactive():
+    async def scenario():
+        gate = PriorityGate(1)
+        await gate.acquire(INTERACTIVE)
+        order = []
+
+        async def waiter(priority, name):
+            await gate.acquire(priority)
+            order.append(name)
+            gate.release()
+
+        tasks = [asyncio.ensure_future(waiter(BATCH, "batch")), asyncio.ensure_future(waiter(INTERACTIVE, "chat"))]
+        await asyncio.sleep(0)
+        gate.release()
+        await asyncio.gather(*tasks)
+        assert order == ["chat", "batch"]
+        assert gate.active == 0
+
+    run(scenario())
@@ -0,0 +1,84 @@
+import pytest
+
+from player_stats import PlayerRecord, PlayerTable, normalize_name
+
+CLUB_A, CLUB_B = "5380169465", "7712003311"
+
+
+def _player(pid, name, club, **stats):
+    return PlayerRecord.from_json({"player_id": pid, "player_name": name, "club_id": club, **stats})
+
+
+@pytest.fixture
+def table():
+    return PlayerTable([
+        _player("1000001", "Joaquín  Aguiar", CLUB_A, total_matches=20, wins=15, losses=5,
+                doubles_wins=9, doubles_rating_delta=0.35),
+        _player("1000002", "Lan Nguyễn", CLUB_A, total_matches=10, wins=3, losses=7, doubles_wins=2,
+                doubles_rating_delta=-0.1),
+        _player("1000003", "Minh Trần", CLUB_B, total_matches=30, wins=24, losses=6, doubles_wins=20,
+                top_opponents=[{"name": "Lan Nguyễn", "count": 4}]),
+    ])
+
+
+def test_normalize_name():
+    assert normalize_name("Joaquín  Aguiar") == "joaquin aguiar"
+
+
+def test_lookup_by_name_and_id(table):
+    answer, players = table.answer("How many wins does joaquin aguiar have?")
+    assert [p.player_id for p in players] == ["1000001"]
+    assert "15" in answer
+    answer, _ = table.answer("Tỉ lệ thắng của người chơi 1000002 là bao nhiêu?")
+    assert "30.0%" in answer and answer.startswith("Tỉ lệ thắng")
+    answer, _ = table.answer("Who did Minh Trần play against most often? opponents")
+    assert "Lan Nguyễn (4)" in answer
+
+
+def test_lookup_still_answers_with_history(table):
+    # Câu hỏi nêu rõ người chơi không phụ thuộc ngữ cảnh hội thoại
+    assert table.answer("Doubles wins of Lan Nguyễn?", has_history=True) is not None
+
+
+def test_ambiguous_or_multi_player_questions_go_to_rag(table):
+    assert table.answer("Compare Lan Nguyễn and Minh Trần wins") is None
+    assert table.answer("Tell me about Lan Nguyễn") is None
+
+
+def test_general_questions_without_club_go_to_rag(table):
+    # Câu hỏi chung về pickleball không được trả lời bằng dữ liệu CLB
+    assert table.answer("Who has the most wins in the MLP?") is None
+    assert table.answer("Ai thắng nhiều nhất giải PPA năm nay?") is None
+    assert table.answer("How many players are in a doubles match?") is None
+
+
+def test_club_ranking_and_count(table):
+    answer, ranked = table.answer("Who has the most wins in the club?")
+    assert [p.player_id for p in ranked] == ["1000003"]
+    answer, ranked = table.answer(f"Top 2 doubles wins in club {CLUB_A}, who?")
+    assert [p.player_id for p in ranked] == ["1000001", "1000002"]
+    answer, _ = table.answer("Có bao nhiêu người chơi trong CLB?")
+    assert "3" in answer
+    answer, _ = table.answer(f"How many players in {CLUB_B}?")
+    assert "1 players" in answer
+
+
+def test_club_aggregate(table):
+    answer, players = table.answer(f"Average wins in club {CLUB_A}?")
+    assert players == [] and "9.00" in answer
+    answer, _ = table.answer("Tổng số trận thắng của CLB?")
+    assert "42" in answer
+
+
+def test_no_player_questions_skip_table_with_history(table):
+    # "Ai thắng nhiều nhất?" trong hội thoại có thể nói về chủ đề trước đó
+    assert table.answer("Who has the most wins in the club?", has_history=True) is None
+
+
+def test_for_club_restricts_pool(table):
+    club = table.for_club(CLUB_A)
+    assert table.for_club(CLUB_A) is club
+    assert table.for_club(None) is table
+    answer, ranked = club.answer("Who has the most doubles wins in the club?")
+    assert [p.player_id for p in ranked] == ["1000001"]
+    assert club.answer("Minh Trần wins?") is None
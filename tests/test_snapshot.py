@@ -0,0 +1,133 @@
+import itertools
+import json
+import os
+import sqlite3
+
+import numpy as np
+import pytest
+
+import snapshot
+from snapshot import SnapshotVectorStore, _publish, export_snapshot
+from vectors import matches_filter
+
+METAS = [
+    {"source": "blog"},
+    {"source": "player_summary", "club_id": "1"},
+    {"source": "player_summary", "club_id": "2"},
+    {},
+]
+
+
+class FakeCollection:
+    """Đủ cho export_snapshot: count() và get() phân trang như Chroma."""
+
+    def __init__(self, vectors, metadatas):
+        self.vectors = vectors
+        self.metadatas = metadatas
+
+    def count(self):
+        return len(self.vectors)
+
+    def get(self, limit, offset=0, include=()):
+        rows = range(offset, min(offset + limit, len(self.vectors)))
+        return {
+            "ids": [f"doc-{i}" for i in rows],
+            "embeddings": [self.vectors[i] for i in rows],
+            "documents": [f"text {i}" for i in rows],
+            "metadatas": [self.metadatas[i] for i in rows],
+        }
+
+
+@pytest.fixture
+def store_sql():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE docs (row INTEGER, metadata TEXT)")
+    conn.executemany("INSERT INTO docs VALUES (?, ?)", [(i, json.dumps(m)) for i, m in enumerate(METAS)])
+    store = SnapshotVectorStore.__new__(SnapshotVectorStore)
+    return store, conn
+
+
+@pytest.mark.parametrize("where", [
+    {"club_id": "1"},
+    {"club_id": {"$eq": "2"}},
+    {"club_id": {"$ne": "1"}},
+    {"club_id": {"$in": ["1", "2"]}},
+    {"club_id": {"$nin": ["1", "2"]}},
+    {"club_id": {"$in": []}},
+    {"club_id": {"$nin": []}},
+    {"$or": [{"source": "blog"}, {"club_id": "2"}]},
+    {"$and": [{"source": "player_summary"}, {"club_id": {"$ne": "2"}}]},
+])
+def test_where_sql_matches_python_filter(store_sql, where):
+    store, conn = store_sql
+    sql, params = store._where_sql(where)
+    got = [r[0] for r in conn.execute(f"SELECT row FROM docs WHERE {sql} ORDER BY row", params)]
+    assert got == [i for i, m in enumerate(METAS) if matches_filter(m, where)]
+
+
+def test_where_sql_rejects_unknown_operator(store_sql):
+    store, _ = store_sql
+    with pytest.raises(ValueError):
+        store._where_sql({"club_id": {"$gt": 1}})
+    with pytest.raises(ValueError):
+        matches_filter({"club_id": 1}, {"club_id": {"$gt": 1}})
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    # _publish đặt tên phiên bản theo giây: mỗi lần gọi lấy một giây mới
+    ticks = itertools.count(1)
+    real = snapshot.time.strftime
+    monkeypatch.setattr(
+        snapshot.time, "strftime",
+        lambda fmt, *a: f"20260101{next(ticks):06d}" if fmt == "%Y%m%d%H%M%S" else real(fmt, *a),
+    )
+
+
+def _write_tmp(out_dir, content):
+    tmp = f"{out_dir}.tmp"
+    os.makedirs(tmp)
+    with open(os.path.join(tmp, "manifest.json"), "w") as f:
+        f.write(content)
+    return tmp
+
+
+def test_publish_swaps_symlink_and_keeps_previous_version(tmp_path, fake_clock):
+    out = str(tmp_path / "dupr")
+    for i in range(3):
+        _publish(_write_tmp(out, str(i)), out)
+        assert os.path.islink(out)
+        with open(os.path.join(out, "manifest.json")) as f:
+            assert f.read() == str(i)
+    versions = sorted(n for n in os.listdir(tmp_path) if n.startswith("dupr."))
+    # Phiên bản hiện tại + phiên bản vừa bị thay (replica có thể còn mở); bản cũ hơn bị xóa
+    assert len(versions) == 2
+    assert os.path.realpath(out) == str(tmp_path / versions[-1])
+
+
+def test_publish_replaces_legacy_directory(tmp_path, fake_clock):
+    out = str(tmp_path / "dupr")
+    os.makedirs(out)
+    _publish(_write_tmp(out, "new"), out)
+    assert os.path.islink(out)
+    assert os.path.isdir(f"{out}.legacy")
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_export_and_search_roundtrip(tmp_path, fake_clock, dtype):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(4, 8)).astype(np.float32)
+    out = str(tmp_path / "snap")
+    manifest = export_snapshot(FakeCollection(vectors.tolist(), METAS), out, "model-x", "v1", dtype=dtype, page_size=3)
+    assert manifest["count"] == 4 and manifest["dim"] == 8
+
+    store = SnapshotVectorStore.open(out, "model-x")
+    # open phân giải symlink: đọc từ đúng thư mục phiên bản
+    assert store.path == os.path.realpath(out)
+    hits = store.search(vectors[2], k=2)[0]
+    assert hits[0][0] == 2 and hits[0][1] == pytest.approx(0.0, abs=0.05)
+    filtered = store.search(vectors[2], k=4, where={"club_id": {"$ne": "2"}})[0]
+    assert sorted(row for row, _ in filtered) == [0, 1, 3]
+
+    with pytest.raises(ValueError):
+        SnapshotVectorStore.open(out, "other-model")
@@ -0,0 +1,265 @@
+"""
+Backend vector store dùng trong process (VECTOR_BACKEND):
+- "numpy":  ma trận float32 liền mạch các embedding đã chuẩn hóa, top-k chính xác bằng argpartition,
+            lọc metadata vector hóa (mã hóa từ điển theo cột). Không SQLite, không khóa, kết quả tất định.
+- "chroma": langchain Chroma như trước (HNSW + SQLite).
+Mọi backend (kể cả SnapshotVectorStore) trả về khoảng cách L2 bình phương như Chroma, để DuprRetriever
+dùng chung công thức cos = 1 - d / 2.
+
+Benchmark hai backend trên chỉ mục hiện tại:
+    python vectors.py bench --queries 200 --k 20
+"""
+import sys
+import json
+import time
+import argparse
+from typing import Any, Dict, List, Optional, Protocol, Sequence, Tuple
+import numpy as np
+from langchain_core.documents import Document
+
+Scored = List[Tuple[Document, float]]
+
+
+class VectorStore(Protocol):
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k: int = 4, filter: Optional[dict] = None, **kwargs) -> Scored:
+        ...
+
+    def similarity_search_by_vectors(self, embeddings, k: int = 4, filter: Optional[dict] = None, **kwargs) -> List[Scored]:
+        ...
+
+
+class ChromaVectorStore:
+    """Bọc langchain Chroma theo giao diện VectorStore (thêm truy vấn nhiều vector một lần)."""
+
+    def __init__(self, chroma):
+        self.chroma = chroma
+        self._collection = chroma._collection
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k: int = 4, filter: Optional[dict] = None, **kwargs) -> Scored:
+        return self.chroma.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=filter, **kwargs)
+
+    def similarity_search_by_vectors(self, embeddings, k: int = 4, filter: Optional[dict] = None, **kwargs) -> List[Scored]:
+        result = self._collection.query(
+            query_embeddings=[list(map(float, e)) for e in embeddings], n_results=k,
+            include=["documents", "metadatas", "distances"], **({"where": filter} if filter else {}),
+        )
+        return [
+            [
+                (Document(page_content=text, metadata=metadata or {}), distance)
+                for text, metadata, distance in zip(result["documents"][i], result["metadatas"][i], result["distances"][i])
+            ]
+            for i in range(len(embeddings))
+        ]
+
+
+def matches_filter(metadata: dict, where: Optional[dict]) -> bool:
+    """Đánh giá bộ lọc kiểu Chroma trên một dict metadata (cùng ngữ nghĩa với NumpyVectorStore._mask)."""
+    if not where:
+        return True
+    for field, cond in where.items():
+        if field == "$and":
+            if not all(matches_filter(metadata, sub) for sub in cond):
+                return False
+            continue
+        if field == "$or":
+            if not any(matches_filter(metadata, sub) for sub in cond):
+                return False
+            continue
+        value = metadata.get(field)
+        if not isinstance(cond, dict):
+            cond = {"$eq": cond}
+        for op, expected in cond.items():
+            if op == "$eq":
+                ok = value is not None and value == expected
+            elif op == "$ne":
+                ok = value is None or value != expected
+            elif op == "$in":
+                ok = value is not None and value in expected
+            elif op == "$nin":
+                ok = value is None or value not in expected
+            else:
+                raise ValueError(f"Toán tử lọc không hỗ trợ: {op}")
+            if not ok:
+                return False
+    return True
+
+
+class _Column:
+    """Cột metadata mã hóa từ điển: codes[i] = mã của giá trị ở dòng i (-1 nếu thiếu)."""
+
+    def __init__(self, values: Sequence[Any]):
+        self.vocab: Dict[Any, int] = {}
+        codes = np.full(len(values), -1, dtype=np.int32)
+        for i, value in enumerate(values):
+            if value is not None:
+                codes[i] = self.vocab.setdefault(value, len(self.vocab))
+        self.codes = codes
+
+    def equals(self, value) -> np.ndarray:
+        code = self.vocab.get(value)
+        return self.codes == code if code is not None else np.zeros(len(self.codes), dtype=bool)
+
+    def isin(self, values) -> np.ndarray:
+        codes = [self.vocab[v] for v in values if v in self.vocab]
+        return np.isin(self.codes, codes) if codes else np.zeros(len(self.codes), dtype=bool)
+
+
+class NumpyVectorStore:
+    """
+    Tìm kiếm chính xác trên ma trận (n, d) float32 đã chuẩn hóa: một phép nhân ma trận-vector,
+    argpartition lấy top-k, rồi sắp xếp tất định (điểm giảm dần, hòa thì theo thứ tự dòng).
+    Chỉ đọc sau khi dựng nên an toàn khi nhiều thread truy vấn đồng thời.
+    """
+
+    def __init__(self, ids: List[str], vectors: np.ndarray, documents: List[Document]):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.ids = ids
+        self.matrix = vectors / norms
+        self.documents = documents
+        keys = sorted({key for doc in documents for key in doc.metadata})
+        self.columns = {key: _Column([doc.metadata.get(key) for doc in documents]) for key in keys}
+
+    @classmethod
+    def from_chroma(cls, collection, page_size: int = 5000) -> "NumpyVectorStore":
+        """Nạp toàn bộ collection Chroma (nơi lưu trữ/đồng bộ tăng dần) vào bộ nhớ."""
+        ids, blocks, documents = [], [], []
+        for offset in range(0, collection.count(), page_size):
+            page = collection.get(limit=page_size, offset=offset, include=["embeddings", "documents", "metadatas"])
+            ids.extend(page["ids"])
+            blocks.append(np.asarray(page["embeddings"], dtype=np.float32))
+            documents.extend(
+                Document(page_content=text, metadata=metadata or {})
+                for text, metadata in zip(page["documents"], page["metadatas"])
+            )
+        vectors = np.concatenate(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+        return cls(ids, vectors, documents)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    # --- lọc metadata ---
+    def _mask(self, where: Optional[dict]) -> Optional[np.ndarray]:
+        """Bộ lọc kiểu Chroma: {"key": v}, {"key": {"$eq"/"$ne"/"$in"/"$nin": ...}}, {"$and"/"$or": [...]}."""
+        if not where:
+            return None
+        mask = np.ones(len(self.ids), dtype=bool)
+        for field, cond in where.items():
+            if field == "$and":
+                for sub in cond:
+                    mask &= self._mask(sub)
+                continue
+            if field == "$or":
+                any_mask = np.zeros(len(self.ids), dtype=bool)
+                for sub in cond:
+                    any_mask |= self._mask(sub)
+                mask &= any_mask
+                continue
+            column = self.columns.get(field)
+            if column is None:
+                column = _Column([None] * len(self.ids))
+            if not isinstance(cond, dict):
+                cond = {"$eq": cond}
+            for op, value in cond.items():
+                if op == "$eq":
+                    mask &= column.equals(value)
+                elif op == "$ne":
+                    mask &= ~column.equals(value)
+                elif op == "$in":
+                    mask &= column.isin(value)
+                elif op == "$nin":
+                    mask &= ~column.isin(value)
+                else:
+                    raise ValueError(f"Toán tử lọc không hỗ trợ: {op}")
+        return mask
+
+    # --- tìm kiếm ---
+    def search(self, queries: np.ndarray, k: int, where: Optional[dict] = None) -> List[List[Tuple[int, float]]]:
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        q_norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        q_norms[q_norms == 0] = 1.0
+        scores = (queries / q_norms) @ self.matrix.T  # (m, n) cosine
+        mask = self._mask(where)
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+        n = scores.shape[1]
+        k = min(k, n)
+        if k <= 0:
+            return [[] for _ in range(len(queries))]
+        results = []
+        for row_scores in scores:
+            top = np.argpartition(-row_scores, k - 1)[:k] if k < n else np.arange(n)
+            # Tất định: điểm giảm dần, hòa điểm thì dòng nhỏ trước
+            top = top[np.lexsort((top, -row_scores[top]))]
+            results.append([(int(i), float(2.0 - 2.0 * row_scores[i])) for i in top if np.isfinite(row_scores[i])])
+        return results
+
+    def similarity_search_by_vectors(self, embeddings, k: int = 4, filter: Optional[dict] = None, **kwargs) -> List[Scored]:
+        return [
+            [(self.documents[i], distance) for i, distance in hits]
+            for hits in self.search(np.asarray(embeddings, dtype=np.float32), k, where=filter)
+        ]
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k: int = 4, filter: Optional[dict] = None, **kwargs) -> Scored:
+        return self.similarity_search_by_vectors([embedding], k=k, filter=filter)[0]
+
+
+def _latency(fn, queries, k: int) -> dict:
+    timings = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q, k=k)
+        timings.append(time.perf_counter() - start)
+    arr = np.asarray(timings) * 1000
+    return {"p50_ms": round(float(np.percentile(arr, 50)), 4), "p99_ms": round(float(np.percentile(arr, 99)), 4)}
+
+
+def benchmark(chroma, numpy_store: NumpyVectorStore, n_queries: int, k: int, seed: int = 0) -> dict:
+    """So sánh độ trễ và độ trùng top-k (NumPy chính xác làm chuẩn) trên câu hỏi lấy từ chính các vector."""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(numpy_store), size=min(n_queries, len(numpy_store)), replace=False)
+    # Nhiễu nhẹ để câu hỏi không trùng hẳn một tài liệu
+    queries = numpy_store.matrix[rows] + rng.normal(scale=0.05, size=numpy_store.matrix[rows].shape).astype(np.float32)
+    chroma_store = ChromaVectorStore(chroma)
+    exact = numpy_store.similarity_search_by_vectors(queries, k=k)
+    approx = chroma_store.similarity_search_by_vectors(queries, k=k)
+    recall = np.mean([
+        len({d.page_content for d, _ in a} & {d.page_content for d, _ in e}) / max(1, len(e))
+        for a, e in zip(approx, exact)
+    ])
+    return {
+        "vectors": len(numpy_store),
+        "dim": int(numpy_store.matrix.shape[1]),
+        "queries": len(queries),
+        "k": k,
+        "numpy": _latency(numpy_store.similarity_search_by_vector_with_relevance_scores, queries, k),
+        "chroma": _latency(chroma_store.similarity_search_by_vector_with_relevance_scores, queries.tolist(), k),
+        "chroma_recall_vs_exact": round(float(recall), 4),
+    }
+
+
+def main(argv=None) -> int:
+    import rag_core
+
+    parser = argparse.ArgumentParser(description="Benchmark backend vector store (NumPy vs Chroma).")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="Đo trên collection Chroma hiện có (PERSIST_DIRECTORY)")
+    bench.add_argument("--queries", type=int, default=200)
+    bench.add_argument("--k", type=int, default=rag_core.HYBRID_CANDIDATES)
+    args = parser.parse_args(argv)
+
+    chroma = rag_core._open_vector_store(None)
+    start = time.perf_counter()
+    numpy_store = NumpyVectorStore.from_chroma(chroma._collection)
+    if not len(numpy_store):
+        print("❌ Collection rỗng, hãy ingest trước (python ingest.py).")
+        return 1
+    report = benchmark(chroma, numpy_store, args.queries, args.k)
+    report["numpy_load_s"] = round(time.perf_counter() - start, 3)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())